@@ -7,27 +7,25 @@ Created on Mon Feb 26 15:33:10 2024
 
 import tkinter as tk
 from tkinter import ttk
-import threading
-from threading import Timer, Event
 import time
-import matplotlib.pyplot as plt
 import matplotlib.dates
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.backend_bases import key_press_handler
-from matplotlib.ticker import ScalarFormatter
-import telebot
 import os
-from dotenv import load_dotenv
 from datetime import datetime
 from datetime import timedelta
-import ctypes
 import numpy as np
-from picosdk.pl1000 import pl1000 as pl
-from picosdk.functions import adc2mVpl1000, assert_pico_ok
-import socket
-import math
-import collections
+import sys
+import queue
+import subprocess
+from pressurebot.plotting import epoch2num, num2epoch
+from pressurebot.channels import load_channels, find_channel
+from pressurebot.storage import format_time
+from pressurebot.ipc import DaemonClient
+
+# Milliseconds a toolbar zoom or pan must settle for before the view is queried.
+XLIM_DELAY = 150
 
 # def internet(host="8.8.8.8", port=53, timeout=3):
 #     """
@@ -47,283 +45,25 @@ import collections
 #         return False
 
 
-def format_time(offset=0):
-    """
-    Returns current time in Year-M-D H:M:S format. Offset in seconds. Default of 0.
-    """
-    t = datetime.now() - timedelta(seconds=offset)
-    # print(t)
-    if t.microsecond % 1000 >= 500:  # check if there will be rounding up
-        t = t + timedelta(milliseconds=1)  # manually round up
-    return t.strftime('%Y:%m:%d %H:%M:%S%f')[:-6]
-
-
-def OpenUnit(chandle, status, channel=16, nr_of_values=10000, us_for_block=100000):
-    """
-    Opens PicoLog Data Logger 1216.
-
-    Parameters
-    ----------
-    chandle : c_int16
-        Empty ctypes.c_int16().
-
-    status : dictionary
-        Empty dictionary to store device status codes.
-
-    channel : int, optional
-        Data Logger input channel. Ranges between 1 and 16 (default).
-
-    nr_of_values : int, optional
-        Specifies how many readings to take.
-
-    us_for_block : int, optional
-        Specifies how long to stream for.
-
-    Returns
-    -------
-    None
-
-    """
-    # open PicoLog 1000 device
-    status["openUnit"] = pl.pl1000OpenUnit(ctypes.byref(chandle))
-    assert_pico_ok(status["openUnit"])
-
-    # set sampling interval
-    usForBlock = ctypes.c_uint32(us_for_block)  # 1 Second (5e5 microseconds)
-    noOfValues = ctypes.c_uint32(nr_of_values)  # 5e5 measurements
-    channels = ctypes.c_int16(16)
-
-    status["setInterval"] = pl.pl1000SetInterval(
-        chandle, ctypes.byref(usForBlock), noOfValues, ctypes.byref(channels), 1)
-    assert_pico_ok(status["setInterval"])
-
-    return [chandle, status, noOfValues]
-
-
-def AverageReading(chandle, status, noOfValues):
-    """
-    STREAM DATA
-    """
-    # Start streaming
-    mode = pl.PL1000_BLOCK_METHOD["BM_STREAM"]
-    status["run"] = pl.pl1000Run(chandle, noOfValues.value, mode)
-    assert_pico_ok(status["run"])
-
-    # Wait for device to finish collecting data
-    time.sleep(0.5)  # time must be longer than usForBlock
-
-    # Get values
-    values = (ctypes.c_uint16 * noOfValues.value)()
-    oveflow = ctypes.c_uint16()
-    status["getValues"] = pl.pl1000GetValues(chandle, ctypes.byref(
-        values), ctypes.byref(noOfValues), ctypes.byref(oveflow), None)
-    assert_pico_ok(status["getValues"])
-
-    # Convert adc values to mV
-    maxADC = ctypes.c_uint16(4095)
-    inputRange = 2500
-    mVValues = adc2mVpl1000(values, inputRange, maxADC)
-
-    # Divide by 1000 to return answer in Volts not mV.
-    return [chandle, status, np.mean(mVValues) / 1000]
-
-
-def CloseUnit(chandle, status):
-    """
-    CLOSE DEVICE
-    """
-    # close PicoLog 1000 device
-    status["closeUnit"] = pl.pl1000CloseUnit(chandle)
-    assert_pico_ok(status["closeUnit"])
-
-
-def volts2mbar(voltage):
-    """
-    Voltage - milivolts
-
-    Returns
-    -------
-    Pressure (mbar)
-    """
-    if not isinstance(voltage, float):
-        return
-
-    # Maximum voltage of 8.6, scaled by 4.16 gives max of ~ 2.066
-    voltage = min(voltage, 2.066414)
-
-    # Scale voltage up by 4.246 because of potential divider
-    voltage = voltage * 4.16
-
-    # Before converting voltage to pressure.
-    pressure = 10**(1.667*voltage-11.33)
-
-    # return "{:.2e}".format(pressure)
-    return pressure
-
-
-def decay_generator(start, end, num_points):
-    decay_factor = math.exp(math.log(end / start) / (num_points - 1))
-    values = [int(start * decay_factor**i) for i in range(num_points)]
-    index = 0
-
-    while True:
-        yield values[index]
-        index = (index + 1) % num_points
-
-
-# Example: Generate a sequence of 50 gradually decreasing integers from 4000 to around 2500
-decay_sequence_generator = decay_generator(3500, 2500, 50)
-
-
-class DataCollector:
-    def __init__(self, stop_event):
-        self.pressure_data = []
-        self.time_data = []
-        self.latest_value = None
-        self.latest_time = None
-        self.lock = threading.Lock()
-        self.stop_event = stop_event
-        self.sample_time = 5  # Sample every 5 seconds.
-        max_storage = 1  # Store 1 day worth of data.
-
-        self.deque_data = collections.deque(maxlen=int(max_storage*86400/self.sample_time))
-        self.deque_time = collections.deque(maxlen=int(max_storage*86400/self.sample_time))
-
-    def stop_collection(self):
-        self.stop_event.set()
-
-    def start_collection(self):
-        self.stop_event.clear()
-
-        chandle = ctypes.c_int16()
-        status = {}
-        chandle, status, noOfValues = OpenUnit(chandle, status)
-
-        while not self.stop_event.is_set():
-            # Simulate streaming data, e.g., from sensors or external source
-            with self.lock:
-                # Get pressure reading
-                # adc = SingleReading(channel = 16)
-
-                chandle, status, voltage = AverageReading(chandle, status, noOfValues)
-
-                # adc = next(decay_sequence_generator)
-                # mV = adc2volts(adc)
-                # voltage = min(mV, 8.6) # If Voltage > 8.6, set it to 8.6. Shouldn't exceed 1000mbar.
-                pressure_reading = volts2mbar(voltage)
-
-                # Time of reading
-                time_reading = format_time()
-
-                self.latest_value = pressure_reading
-                self.latest_time = time_reading
-                self.deque_data.append(pressure_reading)
-                self.deque_time.append(time_reading)
-                self.save_to_file(pressure_reading, time_reading)
-
-            # Wait 2 seconds
-            self.stop_event.wait(timeout=self.sample_time)
-
-        CloseUnit(chandle, status)
-        print(status["closeUnit"])
-        return 0
-
-    def bot(self, bot):
-        """
-        Requires BOT_TOKEN.env file to be in same path as Python script.
-        """
-        self.stop_event.clear()
-        print("BOT START")
-
-        @bot.message_handler(commands=['pressure', 'p', 'P', 'Pressure'])
-        def pressure_reponse(message):
-            with self.lock:
-                latest_value = "{:.2e}".format(self.latest_value)
-
-            if latest_value is None:
-                response = ("No Data Collected Yet")
-                print('Bot Reply: Mo Data Collected Yet')
-            else:
-                response = f'Pressure: {latest_value} mbar'
-                print(f'Bot Reply: Pressure: {latest_value} mbar')
-
-            bot.reply_to(message, response)
-
-        @bot.message_handler(commands=['end'])
-        def end(message):
-            self.stop_collection()
-
-        def checker():
-            if self.stop_event.is_set():  # If stop_event is set, terminate
-                bot.stop_polling()
-                print("Stopped polling")
-                return 0
-
-            # Run checker function again
-            else:
-                recur = Timer(self.sample_time, checker)
-                recur.start()
-
-        # Start checker function, which determined
-        checker()
-
-        # Start bot polling
-        bot.polling(skip_pending=True, timeout=5)
-
-    def get_all_data(self):
-        """
-        Returns list with copy of pressure_data and time_data.
-        """
-        with self.lock:
-            return [[*self.deque_data.copy()], [*self.deque_time.copy()]]
-
-    def get_latest_value(self):
-        """
-        Prints latest value
-        """
-        with self.lock:
-            # print("{:.2e}".format(self.latest_value))
-            return self.latest_value
-
-    def get_latest_time(self):
-        """
-        Prints latest time
-        """
-        with self.lock:
-            # print(self.latest_time)
-            return self.latest_time
-
-    def save_to_file(self, pressure_value, time_value, filename='pressure_data.txt'):
-        with open(filename, 'a') as file:
-            pressure_value = min(pressure_value, 1000)
-            pressure = "{:.2e}".format(pressure_value)
-            file.write(f"{pressure} {time_value}\n")
-            # print(f"{pressure} {time_value}\n")
-
-
 class App:
     def __init__(self, master):
         self.master = master
         self.master.title("PicoLog1216 Voltage-To-Pressure")
         self.after_id = None
 
-        # Create telegram bot
-        load_dotenv(dotenv_path="BOT_TOKEN.env")
-        self.bot = telebot.TeleBot(os.getenv('BOT_TOKEN'))
-
-        # Create a Stop Event to terminate Bot and PicoLog1216 Collection Threads
-        self.stop_event = Event()
-
-        # Set Event, as we only want this to be clear when the threads are running.
-        self.stop_event.set()
-
-        # Define our datacollector class, which has the Bot and PicoLog1216 Threads.
-        self.data_collector = DataCollector(self.stop_event)
+        # Collection and the bot run in the daemon (python -m pressurebot run). The GUI
+        # queries it over a local socket, and is sent every new reading.
+        self.client = DaemonClient()
+        self.channels = load_channels()
+        self.readings = queue.Queue()  # Filled by the subscription thread.
+        self.latest = None  # (time, pressures, flags) of the latest reading.
+        self.attached = False
+        self.daemon = None  # Daemon process started by this GUI.
 
         """
         Create buttons:
-            start_collection: starts data collection and telegram bot
-            stop_collection: stops data collection and telegram bot
+            start_collection: starts the daemon (data collection and telegram bot)
+            stop_collection: stops the daemon
             get_latest_value: prints latest data
             time_range_entry:
             plot_button:
@@ -341,17 +81,17 @@ class App:
         self.stop_collection_button.grid(row=1, column=1, pady=10, sticky='nw')
 
         self.get_latest_value_button = tk.Button(
-            self.button_frame, text="Print Latest Value", command=self.get_latest_value)
+            self.button_frame, text="Print Latest Value", command=lambda: print(self.get_latest_value()))
         self.get_latest_value_button.grid(row=2, column=1, pady=5, sticky='nw')
 
         self.get_latest_value_button = tk.Button(
-            self.button_frame, text="Print Latest Time", command=self.get_latest_time)
+            self.button_frame, text="Print Latest Time", command=lambda: print(self.get_latest_time()))
         self.get_latest_value_button.grid(row=2, column=2, pady=5, sticky='nw')
 
         self.time_range_label = tk.Label(self.button_frame, text="Time Range (seconds):")
         self.time_range_label.grid(row=3, column=1, pady=5, sticky='nw')
 
-        self.plot_button = tk.Button(self.button_frame, text="Plot", command=self.select_datetime)
+        self.plot_button = tk.Button(self.button_frame, text="Plot", command=self.reset_view)
         self.plot_button.grid(row=5, column=1, sticky='n')
 
         """
@@ -374,6 +114,18 @@ class App:
             self.button_frame, self.time_unit_var, 'seconds', 'minutes', 'hours', 'days')
         self.time_unit_optionmenu.grid(row=4, column=2, padx=10, pady=5, sticky='nw')
 
+        """
+        Select which gauge (PL1216 channel) to plot.
+        """
+        channel_names = [channel.name for channel in self.channels]
+        self.channel_var = tk.StringVar()
+        self.channel_var.set(channel_names[0])
+        self.channel_label = tk.Label(self.button_frame, text="Gauge:")
+        self.channel_label.grid(row=6, column=1, pady=5, sticky='nw')
+        self.channel_optionmenu = tk.OptionMenu(
+            self.button_frame, self.channel_var, *channel_names, command=lambda name: self.reset_view())
+        self.channel_optionmenu.grid(row=6, column=2, padx=10, pady=5, sticky='nw')
+
         """
         Display latest data and time reading.
         """
@@ -423,12 +175,65 @@ class App:
         # Get the current graph axis.
         self.ax = self.figure.gca()
 
+        # Create one persistent line, whose data is replaced in place on every update.
+        self.line, = self.ax.plot([], [], marker='o')
+        self.ax.xaxis_date()
+        self.ax.set_yscale('log')
+        self.ylim = None  # Only recomputed when the data leaves the current limits.
+
+        # Re-decimate the line whenever the toolbar zooms or pans.
+        self.zoomed = False
+        self.view_xlim = None  # x limits last set by plot_data.
+        self.xlim_id = None  # Pending load_view, see on_xlim_changed.
+        self.ax.callbacks.connect("xlim_changed", self.on_xlim_changed)
+
+        # Only re-run tight_layout when the canvas changes size.
+        self.figure.tight_layout(pad=3)
+        self.canvas.mpl_connect("resize_event", self.on_resize)
+
         # Pack all the widgets.
         self.canvas.get_tk_widget().pack(side=tk.BOTTOM, fill=tk.BOTH, expand=tk.TRUE)
 
         self.master.protocol('WM_DELETE_WINDOW', lambda: self.confirm_exit(self.master)) # GUI exit protocol
-        
+
+        # Attach to the daemon if it is already running.
+        self.attach()
+
+    def on_resize(self, event):
+        self.figure.tight_layout(pad=3)
+        self.canvas.draw_idle()
+
+    def on_xlim_changed(self, ax):
+        if self.view_xlim is None or ax.get_xlim() == self.view_xlim:
+            return
+
+        # Zoom or pan from the toolbar. Keep the new view on later updates, and query
+        # it once the motion has settled, not on every event of a drag.
+        self.zoomed = True
+        self.cancel_load_view()
+        self.xlim_id = self.master.after(XLIM_DELAY, self.load_view)
+
+    def load_view(self):
+        self.xlim_id = None
+        self.update_line(*num2epoch(self.ax.get_xlim()))
+        self.canvas.draw_idle()
+
+    def cancel_load_view(self):
+        if self.xlim_id is not None:
+            self.master.after_cancel(self.xlim_id)
+            self.xlim_id = None
+
+    def reset_view(self):
+        self.zoomed = False
+        self.cancel_load_view()
+        self.select_datetime()
+
     def confirm_exit(self, master):
+        # The daemon keeps running without the GUI.
+        if self.after_id is not None:
+            self.master.after_cancel(self.after_id)
+        self.cancel_load_view()
+        self.client.close()
         print("CLOSING")
         master.quit()
         print("DESTROYING")
@@ -476,102 +281,168 @@ class App:
         # Create Plot
         self.plot_data()
 
-    def plot_data(self):
-        # Get data and timestamps
-        all_data, all_timestamps = self.data_collector.get_all_data()
+    def update_line(self, start_time, end_time=None):
+        """
+        Loads the data between start_time and end_time (epoch seconds) into the plot
+        line, decimated by the daemon to one min/max pair per pixel of axis width.
 
-        # Convert timestamps into datetime objects
-        datetime_objects = [datetime.strptime(timestamp, '%Y:%m:%d %H:%M:%S')
-                            for timestamp in all_timestamps]
+        Returns the decimated pressure data.
+        """
+        if not self.attached:
+            return np.array([])
+        try:
+            data, times = self.client.query(start_time, end_time, self.channel_var.get(),
+                                            bins=int(self.ax.bbox.width))
+        except ConnectionError as e:
+            print(e)
+            return np.array([])
+        if len(data):
+            self.line.set_data(epoch2num(times), data)
+        return data
 
+    def plot_data(self):
         # Find how far back we want to filter our data by. I.e., last 5 minutes or 5 hours etc.
         start_time = self.datetime_variable
 
-        # Filter data within time range
-        filtered_data = [data for data, timestamp in zip(
-            all_data, datetime_objects) if start_time <= timestamp]
-        filtered_time = [timestamp for data, timestamp in zip(
-            all_data, datetime_objects) if start_time <= timestamp]
+        if self.zoomed:
+            # Keep the toolbar zoom, just reload the data inside it.
+            filtered_data = self.update_line(*num2epoch(self.ax.get_xlim()))
+        else:
+            # Get data within time range
+            filtered_data = self.update_line(start_time.timestamp())
 
-        if not filtered_data:
+        if not len(filtered_data):
             print("No Filtered Data in this time range. Displaying over last 24 hours.")
             start_time = timedelta(days=1)
             return
 
-        # Plot the filtered data
-        self.ax.clear()
-
-        # self.ax.plot(datetime_objects, all_data, marker='o', label='All Data')
-        self.ax.plot(filtered_time, filtered_data, marker='o',
-                     label=f'Pressure Over Last {float(self.time_range_entry.get())} {self.time_unit_var.get()}')
-        self.ax.legend(loc='upper right')
-        self.ax.set_yscale('log')
-
-        # Additional plotting configurations (axis labels, formatting, etc.)
-        self.figure.tight_layout(pad=3)
-        self.ax.set_ylim(0.9*np.amin(filtered_data), 1.1*min(1e3, np.amax(filtered_data)))
-        self.canvas.draw()
+        # Update the legend (and refit the y axis) only when the time range or gauge changes.
+        label = (f'{self.channel_var.get()} Pressure Over Last '
+                 f'{float(self.time_range_entry.get())} {self.time_unit_var.get()}')
+        if label != self.line.get_label():
+            self.line.set_label(label)
+            self.ax.legend(loc='upper right')
+            self.ylim = None
+
+        if not self.zoomed:
+            # The x axis follows the time window. The y axis is only recomputed when
+            # the new data no longer fits inside it.
+            self.view_xlim = (matplotlib.dates.date2num(start_time), self.line.get_xdata()[-1])
+            self.ax.set_xlim(*self.view_xlim)
+
+            low = 0.9*np.amin(filtered_data)
+            high = 1.1*min(1e3, np.amax(filtered_data))
+            if self.ylim is None or low < self.ylim[0] or high > self.ylim[1]:
+                self.ylim = (low, high)
+                self.ax.set_ylim(*self.ylim)
+
+        # Let Tk redraw when it is idle, instead of forcing a full draw now.
+        self.canvas.draw_idle()
 
         """
         Update Latest value
         """
-        latest_data = self.data_collector.get_latest_value()
-        latest_data = "{:.2e}".format(latest_data)
+        latest_data = self.get_latest_value()
+        latest_data = "{:.2e}".format(latest_data) if latest_data is not None else "No Data"
 
         self.latest_data_text.config(state='normal')  # Enable the text widget for editing
         self.latest_data_text.delete('1.0', tk.END)  # Clear existing content
         self.latest_data_text.insert(tk.END, f"{latest_data}")  # Insert new content
         self.latest_data_text.config(state='disabled')  # Disable the text widget for editing
 
-        latest_time = self.data_collector.get_latest_time()
+        latest_time = self.get_latest_time()
         self.latest_time_text.config(state='normal')  # Enable the text widget for editing
         self.latest_time_text.delete('1.0', tk.END)  # Clear existing content
         self.latest_time_text.insert(tk.END, f"{latest_time}")  # Insert new content
         self.latest_time_text.config(state='disabled')  # Disable the text widget for editing
 
-    def start_collection(self):
-        self.collection_thread = threading.Thread(
-            target=self.data_collector.start_collection, args=[])
-        self.collection_thread.start()
+    def attach(self):
+        """
+        Connects to the daemon and subscribes to its readings. Returns False if the
+        daemon is not running.
+        """
+        try:
+            self.client.subscribe(self.readings.put)
+            self.latest = self.client.latest()
+        except ConnectionError:
+            return False
 
-        self.stop_event.wait(2)  # Wait 2 seconds
+        self.attached = True
+        self.start_collection_button.config(state=tk.DISABLED)
+        self.stop_collection_button.config(state=tk.NORMAL)
+        self.reset_view()
+        self.after_id = self.master.after(200, self.update_data)
+        return True
 
-        self.telebot_thread = threading.Thread(target=self.data_collector.bot, args=[self.bot])
-        self.telebot_thread.start()
+    def start_collection(self):
+        if self.attached or self.attach():
+            return
 
-        self.after_id = self.master.after(5000, self.update_data)
+        # Start the daemon in its own process group, so it outlives the GUI.
+        flags = subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+        self.daemon = subprocess.Popen(
+            [sys.executable, '-m', 'pressurebot', 'run'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), creationflags=flags,
+            start_new_session=os.name != 'nt')
+        self.start_collection_button.config(state=tk.DISABLED)
+        self.wait_for_daemon(time.time() + 30)
 
-    def stop_collection(self):
-        if self.stop_event.set():
+    def wait_for_daemon(self, deadline):
+        if self.attach():
             return
+        if time.time() > deadline or self.daemon.poll() is not None:
+            print("The daemon did not start")
+            self.start_collection_button.config(state=tk.NORMAL)
+            return
+        self.master.after(500, self.wait_for_daemon, deadline)
 
-        self.data_collector.stop_collection()
-        self.telebot_thread.join(5)
-        self.collection_thread.join(5)
-        print("Thread Ended")
+    def stop_collection(self):
+        if not self.attached:
+            return
 
-        if self.after_id is not None:
-            self.master.after_cancel(self.after_id)
-            self.after_id = None
-            self.start_collection_button.config(state=tk.NORMAL)
-            self.stop_collection_button.config(state=tk.DISABLED)
-        
-        return
+        try:
+            self.client.stop()
+        except ConnectionError as e:
+            print(e)
+        # The subscription ends when the daemon stops, see update_data.
 
     def get_latest_value(self):
-        self.data_collector.get_latest_value()
+        """
+        Latest pressure of the selected gauge, or None.
+        """
+        if self.latest is None:
+            return None
+        index = self.channels.index(find_channel(self.channels, self.channel_var.get()))
+        return self.latest[1][index]
 
     def get_latest_time(self):
-        self.data_collector.get_latest_time()
-
-    def save_to_file(self):
-        self.data_collector.save_to_file(self.data_collector.latest_value)
+        return format_time(timestamp=self.latest[0]) if self.latest is not None else None
 
     def update_data(self):
-        self.select_datetime()
-        self.start_collection_button.config(state=tk.DISABLED)
-        self.stop_collection_button.config(state=tk.NORMAL)
-        self.after_id = self.master.after(5000, self.update_data)  # Update every 5 seconds
+        """
+        Replots when the daemon has sent new readings. Runs every 200 ms while attached.
+        """
+        new_reading, detached = False, False
+        while not self.readings.empty():
+            reading = self.readings.get()
+            if reading is None:
+                detached = True
+            else:
+                self.latest, new_reading = reading, True
+
+        if new_reading:
+            self.select_datetime()
+
+        if detached:
+            print("Daemon stopped")
+            self.attached = False
+            self.client.close()
+            self.after_id = None
+            self.start_collection_button.config(state=tk.NORMAL)
+            self.stop_collection_button.config(state=tk.DISABLED)
+            return
+
+        self.after_id = self.master.after(200, self.update_data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket fan out of the HTTP API under load.
+
+Runs the collector on a simulated PL1216 at 50 readings per second, with the API
+serving many WebSocket subscribers, some of which read far too slowly. Prints the
+reading to delivery latency of the normal subscribers, and how many readings the
+slow ones received and were dropped, then fetches /range as JSON and .npy. Readings
+are only dropped once the socket buffers of a slow subscriber are full as well.
+
+Usage:
+    python benchmarks/bench_api_fanout.py [subscribers] [seconds]
+"""
+
+import io
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+
+import aiohttp
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bench_reader_latency import percentiles  # noqa: E402
+from pressurebot.alerts import AlertEngine  # noqa: E402
+from pressurebot.channels import Channel  # noqa: E402
+from pressurebot.collector import DataCollector  # noqa: E402
+from pressurebot.http_api import run_api  # noqa: E402
+from pressurebot.simulator import SimulatedPL1216  # noqa: E402
+
+PORT = 18216
+
+
+async def subscriber(url, slow, latencies, counts, dropped):
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            async for message in ws:
+                reading = message.json()
+                latencies.append(time.time() - reading["time"])
+                counts[0] += 1
+                dropped[0] += reading.get("dropped", 0)
+                if slow:
+                    await asyncio.sleep(0.5)
+
+
+async def main(n_subscribers=50, duration=5.0):
+    with tempfile.TemporaryDirectory() as folder:
+        collector = DataCollector(threading.Event(), channels=[Channel(16, 'chamber')],
+                                  sample_time=0.02, data_dir=folder, alerts=AlertEngine(),
+                                  device=SimulatedPL1216())
+        collector.storage.write = lambda *args, **kwargs: None
+        threads = [threading.Thread(target=collector.start_collection),
+                   threading.Thread(target=run_api, args=[collector, '127.0.0.1', PORT])]
+        for thread in threads:
+            thread.start()
+        await asyncio.sleep(1)
+
+        n_slow = n_subscribers // 5
+        results = {slow: ([], [0], [0]) for slow in (False, True)}
+        tasks = [asyncio.create_task(subscriber(f"http://127.0.0.1:{PORT}/ws", i < n_slow,
+                                                *results[i < n_slow]))
+                 for i in range(n_subscribers)]
+        start = time.time()
+        await asyncio.sleep(duration)
+
+        async with aiohttp.ClientSession() as session:
+            params = {"start": start, "end": time.time()}
+            async with session.get(f"http://127.0.0.1:{PORT}/range", params=params) as response:
+                as_json = await response.json()
+            async with session.get(f"http://127.0.0.1:{PORT}/range",
+                                   params=dict(params, format="npy")) as response:
+                as_npy = np.load(io.BytesIO(await response.read()))
+
+        collector.stop_collection()
+        # Slow subscribers would still be reading what the socket buffers hold.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for thread in threads:
+            thread.join()
+
+    n_readings = len(as_npy)
+    latencies, counts, dropped = results[False]
+    print(f"{n_readings} readings, {n_subscribers - n_slow} normal subscribers received "
+          f"{counts[0]} messages ({counts[0] / max(n_subscribers - n_slow, 1):.0f} each)")
+    print(f"delivery latency: {percentiles(np.array(latencies))}")
+    latencies, counts, dropped = results[True]
+    print(f"{n_slow} slow subscribers received {counts[0]} messages, {dropped[0]} dropped")
+    print(f"/range: {len(as_json['times'])} readings as JSON, {len(as_npy)} as .npy "
+          f"{as_npy.dtype.names}, threads left: {threading.active_count()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*[int(sys.argv[1])] if len(sys.argv) > 1 else [],
+                     *[float(arg) for arg in sys.argv[2:3]]))
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Size and range query latency of the compressed archive against the logs.
+
+Writes `days` (30 by default) of synthetic 1 s readings of one gauge, 12 bit ADC
+counts converted with the PTR90 calibration like live readings and time stamped
+with 50 us of scheduling jitter, as a pressure_data.txt text log and as daily
+binary logs. Converts both to archives (the text log's rounded to
+TEXT_MANTISSA_BITS, the binary logs' pressures lossless and times to the
+microsecond), checks they read back the same, then prints the bytes per sample
+of each and the latency of 1 hour, 1 day and 7 day range queries, in the middle
+and at the end of the data: the text log scanned with export.text_chunks, the
+binary logs with export.log_chunks, and the archive with Archive.read.
+
+Usage:
+    python benchmarks/bench_archive.py [days]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bench_history_load import write_text_log, write_binary_logs  # noqa: E402
+from pressurebot import archive, export  # noqa: E402
+from pressurebot.calibration import PTR90  # noqa: E402
+
+END_TIME = 1.7e9
+WINDOWS = [("1 h", 3600), ("1 d", 86400), ("7 d", 7 * 86400)]
+
+
+def write_data(folder, days):
+    """
+    Writes `days` of 1 s readings as folder/text/pressure_data.txt and as daily
+    binary logs in folder/binary. Returns [text folder, binary folder, times,
+    pressures].
+    """
+    rng = np.random.default_rng(0)
+    times = np.arange(END_TIME - days * 86400, END_TIME, 1.0)
+    times += rng.normal(0, 50e-6, len(times))
+    curve = PTR90.mbar_to_counts(10 ** (-7 + np.sin(times / 86400)))
+    counts = np.rint(curve + rng.normal(0, 2, len(times))).astype(np.int64)
+    pressures = PTR90.counts_to_mbar(counts)[0]
+
+    text, binary = os.path.join(folder, 'text'), os.path.join(folder, 'binary')
+    os.makedirs(text)
+    os.makedirs(binary)
+    write_text_log(os.path.join(text, 'pressure_data.txt'), np.rint(times), pressures)
+    write_binary_logs(binary, times, pressures)
+    return [text, binary, times, pressures]
+
+
+def timed(function, repeats=5):
+    """
+    Returns [median seconds of function(), its result].
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return [float(np.median(seconds)), result]
+
+
+def concatenate(chunks):
+    chunks = list(chunks)
+    return [np.concatenate([chunk[0] for chunk in chunks]),
+            np.concatenate([chunk[1] for chunk in chunks])]
+
+
+def main(days=30):
+    with tempfile.TemporaryDirectory() as folder:
+        text, binary, times, pressures = write_data(folder, int(days))
+        text_filename = os.path.join(text, 'pressure_data.txt')
+        text_archive = os.path.join(text, archive.ARCHIVE_NAME)
+        binary_archive = os.path.join(binary, archive.ARCHIVE_NAME)
+        print(f"{len(times)} readings of 1 gauge, {days:g} days at 1 s")
+
+        start = time.perf_counter()
+        archive.convert(text)
+        text_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        archive.convert(binary)
+        binary_seconds = time.perf_counter() - start
+
+        # Both archives read back as their source.
+        logged = concatenate(export.text_chunks(text_filename))
+        archived = archive.Archive(text_archive).read()
+        assert np.array_equal(archived[0], logged[0])
+        assert np.array_equal(np.char.mod('%.2e', archived[1]), np.char.mod('%.2e', logged[1]))
+        archived = archive.Archive(binary_archive).read()
+        # Time stamps are kept to the microsecond.
+        assert np.abs(archived[0] - times).max() <= archive.TIME_RESOLUTION
+        assert np.array_equal(archived[1][:, 0], pressures)
+
+        binary_size = sum(os.path.getsize(filename) for filename in export.logs_in_range(binary))
+        for label, size, seconds in [
+                ("text log", os.path.getsize(text_filename), None),
+                ("binary logs", binary_size, None),
+                ("archive of text", os.path.getsize(text_archive), text_seconds),
+                ("lossless archive", os.path.getsize(binary_archive), binary_seconds)]:
+            converted = f", converted in {seconds:.2f} s" if seconds is not None else ""
+            print(f"{label:>17}: {size / len(times):5.2f} bytes/sample{converted}")
+
+        for label, window in WINDOWS:
+            # Bounds half way between readings, clear of the microsecond rounding.
+            for position, end in [("middle", np.rint(times[len(times) // 2]) + 0.5),
+                                  ("end", np.rint(times[-1]) + 0.5)]:
+                begin = end - window
+                text_query = timed(lambda: concatenate(export.text_chunks(text_filename, begin, end)), 3)
+                binary_query = timed(lambda: concatenate(export.log_chunks(
+                    export.logs_in_range(binary, begin, end), begin, end)))
+                archive_query = timed(lambda: archive.Archive(binary_archive).read(begin, end))
+                assert len(archive_query[1][0]) == len(binary_query[1][0])
+                print(f"{label} query at the {position:>6}: text {text_query[0] * 1e3:8.1f} ms, "
+                      f"binary {binary_query[0] * 1e3:6.2f} ms, archive {archive_query[0] * 1e3:6.2f} ms "
+                      f"({len(archive_query[1][0])} readings)")
+
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:2]])
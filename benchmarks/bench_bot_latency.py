@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Telegram bot reply latency under load.
+
+Runs the asyncio PressureBot against a local fake Telegram server (no network or
+real token needed), in a temporary data folder. First checks the reply to every
+command, to unknown channels, and that an alert is pushed to subscribed chats only.
+Then sends bursts of commands from many chats while the latest reading keeps
+changing, and prints the command to reply latency. With "/plot 6h" every burst
+shares one chart render per reading.
+
+Usage:
+    python benchmarks/bench_bot_latency.py [chats] [commands per chat] [command]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bench_reader_latency import percentiles  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from pressurebot.alerts import AlertEngine, Above  # noqa: E402
+from pressurebot.calibration import IN_RANGE, OVER_RANGE  # noqa: E402
+from pressurebot.channels import Channel  # noqa: E402
+from pressurebot.collector import DataCollector  # noqa: E402
+from pressurebot.telegram_bot import PressureBot  # noqa: E402
+
+
+def make_collector(folder, channels, alerts=()):
+    """
+    Returns a DataCollector of channels in folder, holding a day of 5 s readings.
+    """
+    collector = DataCollector(threading.Event(), channels=channels, data_dir=folder,
+                              alerts=AlertEngine(alerts))
+    times = np.arange(time.time() - 86400, time.time(), 5.0)
+    for channel in channels:
+        collector.buffers[channel.number].extend(times, 1e-7 * (2 + np.sin(times / 3600)))
+    return collector
+
+
+async def ask(telegram, chat_id, text):
+    """
+    Sends text from chat_id and returns the content of the reply to it.
+    """
+    message_id = telegram.send_command(chat_id, text)
+    for _ in range(3000):
+        for _, content, reply_to, _ in telegram.replies:
+            if reply_to == message_id:
+                return content
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"No reply to {text}")
+
+
+async def check_replies():
+    """
+    Checks the bot's reply to every command, to unknown channels, and that alerts are
+    pushed to subscribed chats only. Raises AssertionError on a wrong reply.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        channels = [Channel(16, 'chamber'), Channel(15, 'roughing')]
+        collector = make_collector(folder, channels, [Above(channels[0], 1e-5)])
+        telegram = FakeTelegram()
+        await telegram.start()
+        bot = PressureBot(collector, "123456:FAKE-TOKEN")
+        bot_task = asyncio.create_task(bot.run())
+
+        assert await ask(telegram, 1, "/pressure") == "No Data Collected Yet"
+        collector.snapshot = (time.time(), (1.23e-7, 1000.0), (IN_RANGE, OVER_RANGE))
+        assert await ask(telegram, 1, "/pressure") == ("chamber: 1.23e-07 mbar\n"
+                                                       "roughing: > 1.00e+03 mbar")
+        assert await ask(telegram, 1, "/p chamber") == "Pressure: 1.23e-07 mbar"
+        assert await ask(telegram, 1, "/pressure 15") == "Pressure: > 1.00e+03 mbar"
+        unknown = "Unknown channel foo. Channels: chamber, roughing"
+        assert await ask(telegram, 1, "/pressure foo") == unknown
+
+        assert (await ask(telegram, 1, "/plot 6h")).startswith(b"\x89PNG")
+        assert (await ask(telegram, 1, "/plot 3d roughing")).startswith(b"\x89PNG")
+        assert await ask(telegram, 1, "/plot 6h foo") == unknown
+        assert await ask(telegram, 1, "/plot soon") == ("Usage: /plot [window] [channel], "
+                                                        "e.g. /plot 6h or /plot 3d")
+
+        assert await ask(telegram, 1, "/alerts") == "No alerts. 1 rules checked."
+        assert (await ask(telegram, 1, "/stats")).startswith("Up ")
+
+        # Alerts reach the subscribed chats, and only them.
+        assert await ask(telegram, 2, "/subscribe") == "Subscribed to pressure messages"
+        assert await ask(telegram, 3, "/subscribe") == "Subscribed to pressure messages"
+        assert await ask(telegram, 3, "/unsubscribe") == "Unsubscribed from pressure messages"
+        with open(os.path.join(folder, 'subscribers.json')) as file:
+            assert json.load(file) == [2]
+
+        # Raise the alert as the collection thread does.
+        def raise_alert():
+            for message in collector.alerts.check(16, time.time(), 2e-5):
+                for callback in list(collector.alert_callbacks):
+                    callback(message)
+        n_replies = len(telegram.replies)
+        await asyncio.to_thread(raise_alert)
+        alert = "ALERT: chamber above 1.00e-05 mbar (now 2.00e-05 mbar)"
+        for _ in range(500):
+            if len(telegram.replies) > n_replies:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        assert [reply[:3] for reply in telegram.replies[n_replies:]] == [(2, alert, None)]
+        assert await ask(telegram, 1, "/alerts") == alert
+
+        # /end stops the bot without a reply.
+        telegram.send_command(1, "/end")
+        await asyncio.wait_for(bot_task, 30)
+        assert collector.stop_event.is_set()
+        await telegram.stop()
+
+
+async def measure(n_chats=50, n_commands=20, command="/pressure"):
+    """
+    Returns [number of replies, seconds until all replies arrived, reply latencies].
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        collector = make_collector(folder, [Channel(16, 'chamber')])
+        collector.snapshot = (time.time(), (1.23e-7,), (IN_RANGE,))
+
+        telegram = FakeTelegram()
+        await telegram.start()
+        bot = PressureBot(collector, "123456:FAKE-TOKEN", subscribers_file=None)
+        bot_task = asyncio.create_task(bot.run())
+        await asyncio.sleep(0.5)
+
+        total = n_chats * n_commands
+        start = time.perf_counter()
+        for i in range(n_commands):
+            collector.snapshot = (time.time(), (1.23e-7 * (1 + i),), (IN_RANGE,))
+            for chat_id in range(1, n_chats + 1):
+                telegram.send_command(-chat_id, command)
+            await asyncio.sleep(0.01)
+
+        while len(telegram.replies) < total and time.perf_counter() - start < 60:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+        collector.stop_collection()
+        await bot_task
+        await telegram.stop()
+    return [len(telegram.replies), elapsed, np.array(telegram.latencies())]
+
+
+async def main(n_chats=50, n_commands=20, command="/pressure"):
+    await check_replies()
+    print("Replies checked")
+    n_replies, elapsed, latencies = await measure(n_chats, n_commands, command)
+    total = n_chats * n_commands
+    print(f"{n_replies}/{total} replies from {n_chats} chats in {elapsed:.2f} s "
+          f"({n_replies / elapsed:.0f} replies/s), threads: {threading.active_count()}")
+    print(f"reply latency: {percentiles(latencies)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:3]], *sys.argv[3:4]))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Cold start history loading.
+
+Writes one year of synthetic 5 s readings as a pressure_data.txt text log and as
+daily binary logs into a temporary folder, then times how long it takes to load
+the last day (and the whole year) back from each.
+
+Usage:
+    python benchmarks/bench_history_load.py [folder]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pressurebot.history import load_binary_history, load_text_history  # noqa: E402
+from pressurebot.storage import make_header, record_dtype  # noqa: E402
+
+SAMPLE_TIME = 5
+DAYS = 365
+
+
+def synthetic_year(end_time):
+    times = np.arange(end_time - DAYS * 86400, end_time, SAMPLE_TIME, dtype=np.float64)
+    pressures = 10 ** (-7 + np.sin(times / 86400) + np.random.default_rng(0).normal(0, 0.05, len(times)))
+    return times, pressures
+
+
+def write_text_log(filename, times, pressures):
+    # Build the fixed width lines with numpy rather than one f-string per line.
+    utc_offset = time.localtime(times[-1]).tm_gmtoff
+    stamps = np.datetime_as_string((times + utc_offset).astype('datetime64[s]'), unit='s')
+    stamps = stamps.astype('S19').view(np.uint8).reshape(-1, 19).copy()
+    stamps[:, [4, 7]] = ord(':')
+    stamps[:, 10] = ord(' ')
+    values = np.char.mod('%.2e', np.minimum(pressures, 1000)).astype('S8')
+
+    lines = np.empty((len(times), 29), dtype=np.uint8)
+    lines[:, :8] = values.view(np.uint8).reshape(-1, 8)
+    lines[:, 8] = ord(' ')
+    lines[:, 9:28] = stamps
+    lines[:, 28] = ord('\n')
+    lines.tofile(filename)
+
+
+def write_binary_logs(folder, times, pressures):
+    days = (times // 86400).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    header = make_header([16])
+    for start, end in zip(starts, np.r_[starts[1:], len(times)]):
+        records = np.zeros(end - start, dtype=record_dtype(1))
+        records['time'] = times[start:end]
+        records['pressure'][:, 0] = pressures[start:end]
+        day = np.datetime64(int(days[start]), 'D')
+        with open(os.path.join(folder, f'pressure_{day}.bin'), 'wb') as file:
+            file.write(header)
+            records.tofile(file)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    times, _ = function(*args, **kwargs)
+    return time.perf_counter() - start, len(times)
+
+
+def main(folder):
+    end_time = time.time()
+    times, pressures = synthetic_year(end_time)
+
+    text_filename = os.path.join(folder, 'pressure_data.txt')
+    write_text_log(text_filename, times, pressures)
+    write_binary_logs(folder, times, pressures)
+    print(f"{len(times)} readings, text log {os.path.getsize(text_filename) / 1e6:.0f} MB")
+
+    last_day = end_time - 86400
+    results = [
+        ("text, last 24 h", timed(load_text_history, text_filename, last_day)),
+        ("text, full year", timed(load_text_history, text_filename)),
+        ("binary, last 24 h", timed(load_binary_history, folder, last_day)),
+        ("binary, full year", timed(load_binary_history, folder)),
+    ]
+    for name, (seconds, n) in results:
+        print(f"{name:>18}: {seconds * 1e3:9.1f} ms  ({n} readings)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            main(folder)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Sample timing jitter with and without a heavy plotting load.
+
+Runs DataCollector on a simulated PL1216 at 20 readings per second, with acquisition
+in the collection thread and then in its own process (process=True), each time
+first idle and then with a thread in the same process drawing large charts with
+matplotlib's Agg backend non stop, like the GUI or a burst of /plot requests. Prints
+how late each reading started after its deadline and the spread of the intervals
+between readings.
+
+Usage:
+    python benchmarks/bench_jitter.py [seconds]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bench_reader_latency import percentiles  # noqa: E402
+from pressurebot.alerts import AlertEngine  # noqa: E402
+from pressurebot.collector import DataCollector  # noqa: E402
+from pressurebot.plotting import render_png  # noqa: E402
+from pressurebot.simulator import SimulatedPL1216  # noqa: E402
+
+SAMPLE_TIME = 0.05
+
+
+def plot_load(stop, n_points=200000):
+    """
+    Draws a chart of n_points readings over and over until stop is set.
+    """
+    times = time.time() - np.arange(n_points)[::-1]
+    data = 10 ** (-7 + np.sin(times / 3600) + 0.1 * np.random.default_rng(0).random(n_points))
+    while not stop.is_set():
+        render_png(times, data, "load", times[0], times[-1])
+
+
+def measure(process, load, duration):
+    """
+    Returns [lateness, interval] arrays (seconds) of the readings made over duration.
+    """
+    stamps = []
+    with tempfile.TemporaryDirectory() as folder:
+        collector = DataCollector(threading.Event(), sample_time=SAMPLE_TIME, data_dir=folder,
+                                  alerts=AlertEngine(), device=SimulatedPL1216(), process=process)
+        collector.add_reading_callback(lambda snapshot: stamps.append(snapshot[0]))
+        thread = threading.Thread(target=collector.start_collection)
+        thread.start()
+        # The acquisition process takes a moment to start.
+        while not stamps:
+            time.sleep(0.1)
+
+        # One thread only, matplotlib can't draw from several at once.
+        stop = threading.Event()
+        plotter = threading.Thread(target=plot_load, args=[stop])
+        if load:
+            plotter.start()
+        time.sleep(1)
+        first = len(stamps)
+        time.sleep(duration)
+        last = len(stamps)
+        stop.set()
+        if load:
+            plotter.join()
+        collector.stop_collection()
+        thread.join()
+
+    stamps = np.array(stamps[first:last])
+    # Deadlines are on whole multiples of the sample time.
+    lateness = stamps - np.floor(stamps / SAMPLE_TIME) * SAMPLE_TIME
+    return [lateness, np.diff(stamps)]
+
+
+def main(duration=10.0):
+    for process in (False, True):
+        for load in (False, True):
+            lateness, interval = measure(process, load, duration)
+            mode = "process" if process else "thread"
+            print(f"{mode:>7} {'with' if load else ' no'} plotting: {len(interval) + 1} readings"
+                  f" ({duration / SAMPLE_TIME:.0f} due)")
+            print(f"  start after deadline: {percentiles(lateness)}")
+            print(f"  interval jitter:      {percentiles(np.abs(interval - SAMPLE_TIME))}"
+                  f"  std {interval.std() * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Reader latency under continuous sampling.
+
+Runs DataCollector.start_collection against a simulated PL1216 (no hardware or
+picosdk driver needed), in a temporary data folder, and hammers the reader methods used
+by the Telegram bot and the GUI from a second thread, then prints the latency
+percentiles of each reader.
+
+Usage:
+    python benchmarks/bench_reader_latency.py [seconds]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pressurebot.alerts import AlertEngine  # noqa: E402
+from pressurebot.channels import Channel  # noqa: E402
+from pressurebot.collector import DataCollector  # noqa: E402
+from pressurebot.simulator import SimulatedPL1216  # noqa: E402
+
+
+def percentiles(samples):
+    us = np.asarray(samples) * 1e6
+    return "p50 {:8.1f} us  p99 {:8.1f} us  max {:8.1f} us  (n={})".format(
+        np.percentile(us, 50), np.percentile(us, 99), us.max(), len(us))
+
+
+def main(duration=5.0):
+    with tempfile.TemporaryDirectory() as folder:
+        # A slow USB transfer on every read.
+        collector = DataCollector(threading.Event(), channels=[Channel(16, 'chamber')],
+                                  sample_time=0.05, data_dir=folder, alerts=AlertEngine(),
+                                  device=SimulatedPL1216(latency=0.02))
+        collector.storage.write = lambda *args, **kwargs: time.sleep(0.005)  # Slow disk.
+
+        collection_thread = threading.Thread(target=collector.start_collection)
+        collection_thread.start()
+
+        readers = {"get_latest_value": collector.get_latest_value,
+                   "get_latest_time": collector.get_latest_time,
+                   "get_all_data": collector.get_all_data}
+        latencies = {name: [] for name in readers}
+
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            for name, reader in readers.items():
+                start = time.perf_counter()
+                reader()
+                latencies[name].append(time.perf_counter() - start)
+            time.sleep(0.001)
+
+        collector.stop_collection()
+        collection_thread.join()
+
+        print(f"Samples collected: {len(collector.get_all_data()[0])}")
+        for name, samples in latencies.items():
+            print(f"{name:>16}: {percentiles(samples)}")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Ceiling of the reading pipeline, from replayed logs.
+
+Writes a day of synthetic 1 s readings of 1, 4 and 16 gauges as daily binary logs,
+replays each as fast as possible through DataCollector (conversion, storage,
+buffers, rollups, alerts), then the 16 gauge day again with a thread drawing 1 hour
+charts non stop, and 1000 s of it at 100x the recorded pace. Prints the sustained
+readings and samples per second and the latency of each stage, see
+pressurebot.replay.report.
+
+Usage:
+    python benchmarks/bench_replay.py [hours]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pressurebot import replay  # noqa: E402
+from pressurebot.alerts import AlertEngine  # noqa: E402
+from pressurebot.storage import make_header, record_dtype  # noqa: E402
+
+END_TIME = 1.7e9
+
+
+def write_logs(folder, n_channels, hours):
+    """
+    Writes `hours` of 1 s readings of channels 16, 15, ... to daily binary logs in
+    folder. Returns the epoch time of the first reading.
+    """
+    times = np.arange(END_TIME - hours * 3600, END_TIME, 1.0)
+    rng = np.random.default_rng(0)
+    records = np.zeros(len(times), dtype=record_dtype(n_channels))
+    records['time'] = times
+    for column in range(n_channels):
+        records['pressure'][:, column] = 10 ** (-7 + np.sin(times / 3600 + column)
+                                                + rng.normal(0, 0.02, len(times)))
+
+    # Split at local midnight, like BinaryLog.
+    days = ((times + time.localtime(END_TIME).tm_gmtoff) // 86400).astype(np.int64)
+    header = make_header(list(range(16, 16 - n_channels, -1)))
+    for day in np.unique(days):
+        with open(os.path.join(folder, f'pressure_{np.datetime64(int(day), "D")}.bin'), 'wb') as file:
+            file.write(header)
+            records[days == day].tofile(file)
+    return times[0]
+
+
+def main(hours=24.0):
+    for n_channels, plot, speed in [(1, None, 0), (4, None, 0), (16, None, 0),
+                                    (16, 3600, 0), (16, None, 100)]:
+        with tempfile.TemporaryDirectory() as folder:
+            logs, output = os.path.join(folder, 'logs'), os.path.join(folder, 'replay')
+            os.makedirs(logs)
+            start = write_logs(logs, n_channels, hours)
+            end = start + 1000 if speed else None
+            print(f"{n_channels} gauge{'s' * (n_channels > 1)}, {f'{speed:g}x' if speed else 'as fast as possible'}"
+                  f"{', with 1 h charts' if plot else ''}:")
+            print(replay.report(*replay.run(logs, output, end=end, speed=speed, plot=plot,
+                                            alerts=AlertEngine())))
+
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Start up (import) time of each entry point, from python -X importtime.
+
+Imports the module behind each way of running pressurebot in a fresh interpreter a
+few times, and prints the median cumulative import time the interpreter reports for
+it, the wall time of the whole process, and which of the heavy packages it loaded.
+The headless service (`pressurebot run` without the bot or API) should load none of
+matplotlib, Tk, telebot, aiohttp or picosdk: they are imported by the bot, charts,
+API, GUI and PL1216 driver when those are first used.
+
+Usage:
+    python benchmarks/bench_startup.py [runs]
+"""
+
+import os
+import re
+import sys
+import time
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Name -> module imported.
+TARGETS = {
+    'cli': 'pressurebot.__main__',
+    'headless': 'pressurebot.daemon',
+    'bot': 'pressurebot.telegram_bot',
+    'api': 'pressurebot.http_api',
+    'gui': 'Pressure_GUI',
+}
+
+HEAVY = ['matplotlib', 'tkinter', 'telebot', 'aiohttp', 'picosdk']
+
+# "import time:  self [us] | cumulative | imported package", indented by nesting.
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_time(module):
+    """
+    Returns [cumulative import seconds of module, process wall seconds, set of the
+    top level packages imported] from one fresh interpreter.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+
+    cumulative = None
+    packages = set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        packages.add(match.group(4).split('.')[0])
+        if match.group(4) == module and len(match.group(3)) == 1:
+            cumulative = int(match.group(2)) * 1e-6
+    return [cumulative, wall, packages]
+
+
+def measure(module, runs=5):
+    """
+    Returns [median import seconds, median wall seconds, heavy packages loaded].
+    """
+    # One run to fill the bytecode cache, which a deployed install already has.
+    import_time(module)
+    results = [import_time(module) for _ in range(runs)]
+    heavy = [name for name in HEAVY if name in results[0][2]]
+    return [float(np.median([result[0] for result in results])),
+            float(np.median([result[1] for result in results])), heavy]
+
+
+def main(runs=5):
+    for name, module in TARGETS.items():
+        try:
+            seconds, wall, heavy = measure(module, runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:>8}: import {module} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{name:>8}: import {seconds * 1e3:6.1f} ms, process {wall * 1e3:6.1f} ms"
+              f"  ({module}; loads {', '.join(heavy) or 'none of ' + ', '.join(HEAVY)})")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
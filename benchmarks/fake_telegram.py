@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake of the Telegram Bot HTTP API, enough for the bot's long polling and replies.
+
+Messages are queued with FakeTelegram.send_command and served through getUpdates;
+every sendMessage and sendPhoto is recorded with the time it arrived.
+"""
+
+import json
+import time
+import asyncio
+
+from aiohttp import web
+from telebot import asyncio_helper
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_update = asyncio.Event()
+        self.sent_at = {}  # message_id -> time the command was queued.
+        self.replies = []  # (chat_id, text or PNG bytes, reply_to message_id, time received).
+        self.runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Starts the server and points telebot's asyncio API_URL at it. Returns the URL.
+        """
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        asyncio_helper.API_URL = f"http://{host}:{port}/bot{{0}}/{{1}}"
+        return asyncio_helper.API_URL
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def send_command(self, chat_id, text):
+        """
+        Queues a message from a user in chat_id. Returns its message_id.
+        """
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        command = text.split()[0]
+        self.updates.append({
+            "update_id": self.next_update_id,
+            "message": {
+                "message_id": message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "group", "title": f"chat {chat_id}"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Lab"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]}})
+        self.next_update_id += 1
+        self.sent_at[message_id] = time.perf_counter()
+        self.new_update.set()
+        return message_id
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        # telebot sends its form data as the body even of GET requests, which
+        # aiohttp's post() ignores, so parse it as if it were a POST.
+        params = dict(request.query)
+        params.update(await request.clone(method='POST').post())
+
+        if method == 'getMe':
+            result = {"id": 1, "is_bot": True, "first_name": "PressureBot", "username": "pressure_bot"}
+        elif method == 'getUpdates':
+            result = await self.get_updates(int(params.get('offset', 0)), float(params.get('timeout', 0)))
+        elif method in ('sendMessage', 'sendPhoto'):
+            received = time.perf_counter()
+            reply_to = json.loads(params.get('reply_parameters', '{}')).get('message_id')
+            chat_id = int(params['chat_id'])
+            content = params['text'] if method == 'sendMessage' else params['photo'].file.read()
+            self.replies.append((chat_id, content, reply_to, received))
+            result = {"message_id": self.next_message_id, "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "group"}, "text": params.get('text', '')}
+            self.next_message_id += 1
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_updates(self, offset, timeout):
+        if offset < 0:
+            # skip_pending: only report the last update, so it can be confirmed.
+            return self.updates[-1:]
+
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout > 0:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    def latencies(self):
+        """
+        Returns the seconds from queueing each command to receiving its reply.
+        """
+        return [received - self.sent_at[reply_to] for _, _, reply_to, received in self.replies
+                if reply_to in self.sent_at]
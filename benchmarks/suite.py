@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+End to end benchmark suite, on the simulated PL1216.
+
+Needs no hardware, picosdk, network or display, so it runs on any Linux box (e.g. in
+CI). Covers:
+
+    pipeline   readings/s through DataCollector.start_collection (acquisition,
+               conversion, storage, buffers, rollups) with a 1 ms sample time, and
+               the CPU time of each reading, for 1, 4 and 16 channels
+    get_all_data, query
+               latency of the reads used by the bot and GUI, query for windows from
+               1 hour (raw buffer) to 30 days (hourly rollups)
+    render     /plot chart time (query, decimation, Agg render) against window
+    bot        /pressure reply latency with 50 chats asking at once
+    replay     samples/s and per reading latency of logged readings replayed through
+               the pipeline as fast as possible, for 1 and 16 channels
+    archive    bytes/sample of a week of logs in the compressed archive, and the
+               latency of a 1 day range query from it
+    startup    import time of the command line, headless service, bot, API and GUI
+               (python -X importtime), to keep heavy imports out of start up
+
+Usage:
+    python benchmarks/suite.py [-k NAME] [--quick] [--json FILE] [--compare FILE] [--tolerance X]
+
+--json saves the results, and --compare checks them against saved ones: the
+exit status is 1 if any result is more than `tolerance` times worse (2 by default).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bench_startup import TARGETS, measure as measure_startup  # noqa: E402
+from bench_replay import write_logs  # noqa: E402
+from bench_archive import write_data  # noqa: E402
+from pressurebot import archive as archives, metrics, replay as replays  # noqa: E402
+from pressurebot.alerts import AlertEngine  # noqa: E402
+from pressurebot.channels import Channel  # noqa: E402
+from pressurebot.collector import DataCollector  # noqa: E402
+from pressurebot.decimate import minmax_decimate  # noqa: E402
+from pressurebot.plotting import render_png, FIGURE_SIZE, DPI  # noqa: E402
+from pressurebot.rollup import ROLLUP_DTYPE  # noqa: E402
+from pressurebot.simulator import SimulatedPL1216  # noqa: E402
+
+WINDOWS = {'1h': 3600, '6h': 6 * 3600, '1d': 86400, '7d': 7 * 86400, '30d': 30 * 86400}
+
+BENCHMARKS = []  # (name, function, parameters)
+
+
+def benchmark(*params):
+    """
+    Registers a benchmark function, run once per parameter. It returns a dict of
+    result name -> (value, unit, "lower" or "higher" is better).
+    """
+    def register(function):
+        BENCHMARKS.append((function.__name__, function, params or (None,)))
+        return function
+    return register
+
+
+def time_call(function, min_time=0.2, max_calls=100000):
+    """
+    Returns the median seconds per call of function, over at least min_time seconds.
+    """
+    times = []
+    end = time.perf_counter() + min_time
+    while (time.perf_counter() < end or len(times) < 3) and len(times) < max_calls:
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def filled_collector(folder):
+    """
+    Returns a DataCollector holding a full day of 5 s readings, and 30 days of
+    minute and 5 years of hour rollups, as after a long run.
+    """
+    collector = DataCollector(threading.Event(), channels=[Channel(16, 'chamber')],
+                              data_dir=folder, alerts=AlertEngine(),
+                              device=SimulatedPL1216())
+    now = time.time()
+    times = np.arange(now - 86400, now, 5.0)
+    collector.buffers[16].extend(times, 10 ** (-7 + np.sin(times / 3600)))
+
+    for tier in collector.rollups[16]:
+        starts = np.arange(now - tier.rows.capacity * tier.interval, now, tier.interval)
+        starts = starts[:tier.rows.capacity]
+        rows = np.zeros(len(starts), dtype=ROLLUP_DTYPE)
+        rows['time'] = starts
+        rows['mean'] = 10 ** (-7 + np.sin(starts / 3600))
+        rows['min'], rows['max'] = rows['mean'] * 0.9, rows['mean'] * 1.1
+        rows['count'] = tier.interval // 5
+        tier.rows.extend(starts, rows)
+    return collector
+
+
+@benchmark(1, 4, 16)
+def pipeline(n_channels, quick=False):
+    with tempfile.TemporaryDirectory() as folder:
+        channels = [Channel(16 - i) for i in range(n_channels)]
+        # Read as fast as possible, with 10 s of readings kept in memory.
+        collector = DataCollector(threading.Event(), channels=channels, sample_time=1e-3,
+                                  max_storage=10 / 86400, data_dir=folder,
+                                  alerts=AlertEngine(), device=SimulatedPL1216(latency=0))
+        # Count readings, and the CPU time the collection thread has used so far.
+        progress = [0, 0.0]
+
+        def on_reading(snapshot):
+            progress[:] = progress[0] + 1, time.thread_time()
+
+        collector.add_reading_callback(on_reading)
+
+        thread = threading.Thread(target=collector.start_collection)
+        thread.start()
+        time.sleep(0.5)
+        start, (n_start, cpu_start) = time.perf_counter(), list(progress)
+        time.sleep(1 if quick else 3)
+        elapsed, (n_end, cpu_end) = time.perf_counter() - start, list(progress)
+        collector.stop_collection()
+        thread.join()
+
+    n = n_end - n_start
+    return {"readings/s": (n / elapsed, "1/s", "higher"),
+            "cpu/reading": ((cpu_end - cpu_start) / n * 1e6, "us", "lower")}
+
+
+@benchmark()
+def get_all_data(_, quick=False):
+    with tempfile.TemporaryDirectory() as folder:
+        collector = filled_collector(folder)
+        return {"latency": (time_call(collector.get_all_data) * 1e6, "us", "lower")}
+
+
+@benchmark(*WINDOWS)
+def query(window, quick=False):
+    with tempfile.TemporaryDirectory() as folder:
+        collector = filled_collector(folder)
+        seconds = WINDOWS[window]
+        latency = time_call(lambda: collector.query(time.time() - seconds))
+        return {"latency": (latency * 1e6, "us", "lower")}
+
+
+@benchmark('1h', '1d', '30d')
+def render(window, quick=False):
+    with tempfile.TemporaryDirectory() as folder:
+        collector = filled_collector(folder)
+        seconds = WINDOWS[window]
+
+        def chart():
+            end_time = time.time()
+            data, times = collector.query(end_time - seconds, end_time)
+            times, data = minmax_decimate(times, data, FIGURE_SIZE[0] * DPI,
+                                          end_time - seconds, end_time)
+            return render_png(times, data, window, end_time - seconds, end_time)
+
+        return {"time": (time_call(chart, min_time=0.5 if quick else 2) * 1e3, "ms", "lower")}
+
+
+@benchmark()
+def bot(_, quick=False):
+    from bench_bot_latency import measure
+
+    n_replies, elapsed, latencies = asyncio.run(measure(50, 4 if quick else 10))
+    return {"p50": (np.percentile(latencies, 50) * 1e3, "ms", "lower"),
+            "p99": (np.percentile(latencies, 99) * 1e3, "ms", "lower"),
+            "replies/s": (n_replies / elapsed, "1/s", "higher")}
+
+
+@benchmark(1, 16)
+def replay(n_channels, quick=False):
+    with tempfile.TemporaryDirectory() as folder:
+        logs = os.path.join(folder, 'logs')
+        os.makedirs(logs)
+        write_logs(logs, n_channels, 1 if quick else 6)
+        source, elapsed = replays.run(logs, os.path.join(folder, 'replay'), alerts=AlertEngine())
+    processing = metrics.find('pressurebot_reading_processing_seconds')
+    return {"samples/s": (source.count * n_channels / elapsed, "1/s", "higher"),
+            "p99": (processing.quantile(0.99) * 1e6, "us", "lower")}
+
+
+@benchmark()
+def archive(_, quick=False):
+    with tempfile.TemporaryDirectory() as folder:
+        _, binary, times, _ = write_data(folder, 2 if quick else 7)
+        archives.convert(binary)
+        filename = os.path.join(binary, archives.ARCHIVE_NAME)
+        end = np.rint(times[-1]) + 0.5
+        latency = time_call(lambda: archives.Archive(filename).read(end - 86400, end))
+        return {"bytes/sample": (os.path.getsize(filename) / len(times), "B", "lower"),
+                "1d query": (latency * 1e3, "ms", "lower")}
+
+
+@benchmark(*TARGETS)
+def startup(target, quick=False):
+    seconds, wall, heavy = measure_startup(TARGETS[target], 3 if quick else 7)
+    return {"import": (seconds * 1e3, "ms", "lower"),
+            "process": (wall * 1e3, "ms", "lower")}
+
+
+def run(pattern=None, quick=False):
+    results = {}
+    for name, function, params in BENCHMARKS:
+        for param in params:
+            full_name = name if param is None else f"{name}[{param}]"
+            if pattern and not re.search(pattern, full_name):
+                continue
+            for metric, (value, unit, better) in function(param, quick=quick).items():
+                key = f"{full_name} {metric}"
+                results[key] = {"value": value, "unit": unit, "better": better}
+                print(f"{key:<32} {value:12.1f} {unit}", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the results that are more than tolerance times worse than baseline, and
+    returns how many there are.
+    """
+    regressions = 0
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old, new = baseline[key]["value"], result["value"]
+        ratio = new / old if result["better"] == "lower" else old / new
+        if ratio > tolerance:
+            regressions += 1
+            print(f"REGRESSION {key}: {old:.1f} -> {new:.1f} {result['unit']} ({ratio:.1f}x worse)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks matching this regex")
+    parser.add_argument("--quick", action="store_true", help="shorter runs")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--compare", help="results file to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="how many times worse counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern, args.quick)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            if compare(results, json.load(file), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
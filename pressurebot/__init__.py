@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Data handling for the PicoLog 1216 pressure logger.
+"""
+
+from pressurebot.ring_buffer import RingBuffer
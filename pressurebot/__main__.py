@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point:
+
+    python -m pressurebot run [--data-dir DIR] [--sample-time SECONDS] [--retention DAYS]
+                              [--catch-up] [--acquisition-process] [--port PORT]
+                              [--api-port PORT] [--no-api] [--no-bot] [--simulate]
+                              [--replay LOG_DIR [--replay-speed X]]
+    python -m pressurebot export OUTPUT [--start TIME] [--end TIME] [--channel NAME ...]
+                                 [--format csv|parquet|hdf5] [--data-dir DIR]
+    python -m pressurebot stats [--start TIME] [--end TIME] [--channel NAME ...]
+                                [--threshold MBAR] [--pumpdown-start MBAR]
+                                [--pumpdown-window SECONDS] [--data-dir DIR]
+    python -m pressurebot replay OUTPUT_DIR [--speed X] [--start-at TIME] [--plot WINDOW]
+                                 [--start TIME] [--end TIME] [--channel NAME ...]
+                                 [--data-dir DIR]
+    python -m pressurebot archive [OUTPUT] [--mantissa-bits N] [--start TIME] [--end TIME]
+                                  [--channel NAME ...] [--data-dir DIR]
+
+TIME is epoch seconds, a local ISO date or time (2024-02-26, 2024-02-26T15:30), or a
+window before now (7d).
+"""
+
+import os
+import sys
+import argparse
+
+from pressurebot.ipc import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_API_PORT
+from pressurebot.scheduler import SKIP, CATCHUP
+
+
+def main(argv=None):
+    from pressurebot.export import parse_time
+
+    parser = argparse.ArgumentParser(prog="python -m pressurebot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run collection, storage and the bot headless")
+    run.add_argument("--data-dir", default=".", help="folder of the log and rollup files")
+    run.add_argument("--sample-time", type=float, default=5, help="seconds between readings")
+    run.add_argument("--retention", type=float, default=1, metavar="DAYS",
+                     help="days of readings kept in memory at full resolution, "
+                          "older charts use the rollups")
+    run.add_argument("--catch-up", action="store_true",
+                     help="make readings missed while one overran at once, rather than skip them")
+    run.add_argument("--acquisition-process", action="store_true",
+                     help="read the PL1216 in a separate process, clear of the bot and API")
+    run.add_argument("--host", default=DEFAULT_HOST, help="address the GUI connects to")
+    run.add_argument("--port", type=int, default=DEFAULT_PORT, help="port the GUI connects to")
+    run.add_argument("--api-port", type=int, default=DEFAULT_API_PORT,
+                     help="port of the HTTP/WebSocket API")
+    run.add_argument("--no-api", action="store_true", help="don't run the HTTP/WebSocket API")
+    run.add_argument("--env", default="BOT_TOKEN.env", help="file with the BOT_TOKEN")
+    run.add_argument("--no-bot", action="store_true", help="don't run the Telegram bot")
+    run.add_argument("--simulate", action="store_true",
+                     help="read a simulated PL1216 instead of the hardware")
+    run.add_argument("--replay", metavar="LOG_DIR",
+                     help="replay the logs in LOG_DIR instead of reading the PL1216")
+    run.add_argument("--replay-speed", type=float, default=1,
+                     help="times the recorded pace to replay at, 0 for as fast as possible")
+
+    def add_range_arguments(command):
+        command.add_argument("--start", type=parse_time, help="first time to include")
+        command.add_argument("--end", type=parse_time, help="last time to include, now by default")
+        command.add_argument("--channel", action="append", dest="channels",
+                             help="gauge name or number, all by default (repeat for several)")
+        command.add_argument("--data-dir", default=".", help="folder of the log files")
+
+    export = commands.add_parser("export", help="export logged readings to CSV, Parquet or HDF5")
+    export.add_argument("output", help="output file, or - for CSV to stdout")
+    export.add_argument("--format", choices=["csv", "parquet", "hdf5"],
+                        help="output format, from the file extension by default")
+    add_range_arguments(export)
+
+    stats = commands.add_parser("stats", help="summarise logged readings")
+    stats.add_argument("--threshold", type=float, default=1e-6,
+                       help="pressure (mbar) to total the time below")
+    stats.add_argument("--max-gap", type=float, default=60,
+                       help="longest gap (s) between readings counted as continuous")
+    stats.add_argument("--pumpdown-start", type=float, default=100,
+                       help="pressure (mbar) a pump-down starts at")
+    stats.add_argument("--pumpdown-window", type=float, default=600,
+                       help="seconds of each pump-down fitted for its time constant")
+    add_range_arguments(stats)
+
+    replay = commands.add_parser(
+        "replay", help="replay logged readings through conversion, storage and alerts, "
+                       "and report the throughput and latency of each stage")
+    replay.add_argument("output", help="folder to write the replayed logs and rollups to")
+    replay.add_argument("--speed", type=float, default=0,
+                        help="times the recorded pace, 0 (the default) for as fast as possible")
+    replay.add_argument("--start-at", type=parse_time,
+                        help="time stamp of the first reading, as recorded by default")
+    replay.add_argument("--plot", metavar="WINDOW",
+                        help="meanwhile draw the chart of this window (e.g. 1h) non stop")
+    add_range_arguments(replay)
+
+    archive = commands.add_parser(
+        "archive", help="migrate logged readings to the compressed, time indexed archive")
+    archive.add_argument("output", nargs="?",
+                         help="archive file, pressure_archive.pba in the data folder by default")
+    archive.add_argument("--mantissa-bits", type=int, metavar="N",
+                         help="round pressures to N mantissa bits (of 52), lossless by default "
+                              "(12 for the text log)")
+    add_range_arguments(archive)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        from pressurebot import daemon
+
+        if args.retention <= 0:
+            parser.error("--retention must be more than 0 days")
+
+        source = None
+        if args.replay:
+            from pressurebot.export import select_gauges
+            from pressurebot.replay import Replay, check_data_dir
+
+            try:
+                check_data_dir(args.replay, args.data_dir)
+                chunks, channels = select_gauges(args.replay)
+                source = Replay(channels, chunks, args.replay_speed)
+            except (ValueError, KeyError) as error:
+                parser.error(str(error).strip("'\""))
+        token = None if args.no_bot else daemon.read_token(args.env)
+        api_port = None if args.no_api else args.api_port
+        return daemon.run(args.data_dir, args.sample_time, args.host, args.port, token, api_port,
+                          args.simulate, CATCHUP if args.catch_up else SKIP,
+                          args.acquisition_process, source, args.retention)
+
+    if args.command == "replay":
+        from pressurebot import replay
+        from pressurebot.plotting import parse_window
+
+        try:
+            plot = parse_window(args.plot)[0] if args.plot else None
+            print(replay.report(*replay.run(args.data_dir, args.output, args.start, args.end,
+                                            args.channels, args.speed, args.start_at, plot)))
+        except (ValueError, KeyError) as error:
+            parser.error(str(error).strip("'\""))
+        return 0
+
+    if args.command == "archive":
+        from pressurebot import archive
+
+        try:
+            n_rows = archive.convert(args.data_dir, args.output, args.start, args.end,
+                                     args.channels, args.mantissa_bits)
+        except (ValueError, KeyError) as error:
+            parser.error(str(error).strip("'\""))
+        print(f"Archived {n_rows} readings", file=sys.stderr)
+        return 0
+
+    if args.command in ("export", "stats"):
+        from pressurebot import export
+
+        try:
+            if args.command == "export":
+                n_rows = export.export(args.data_dir, args.output, args.start, args.end,
+                                       args.channels, args.format)
+                print(f"Exported {n_rows} readings to {args.output}", file=sys.stderr)
+            else:
+                summaries = export.summarize(
+                    args.data_dir, args.start, args.end, args.channels, threshold=args.threshold,
+                    max_gap=args.max_gap, pumpdown_start=args.pumpdown_start,
+                    pumpdown_window=args.pumpdown_window)
+                print("\n".join(summary.describe() for summary in summaries))
+        except (ValueError, KeyError, ImportError) as error:
+            parser.error(str(error).strip("'\""))
+        except BrokenPipeError:
+            # e.g. "export - | head". Stop quietly, without a second error at exit.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 1
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+The PL1216 acquisition loop, in the collection thread or in a process of its own.
+
+acquire() reads and converts the PL1216 on the schedule of pressurebot.scheduler and
+yields one reading per deadline. DataCollector runs it in its collection thread by
+default. With AcquisitionProcess it runs in a separate process instead, which has
+its own interpreter and GIL, so a burst of bot or API traffic in the daemon can't
+delay pl1000GetValues or its time stamps. That process appends the readings to a
+SharedRing in shared memory, and the daemon maps the ring read-only and picks the
+readings up from there for storage, the buffers, alerts and clients.
+"""
+
+import time
+import signal
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pressurebot.pl1216 import StreamingReader
+from pressurebot.scheduler import Scheduler, SKIP
+from pressurebot import metrics
+
+RING_MAGIC = 0x50424e47  # "PBNG"
+HEADER_SIZE = 64  # Bytes: magic, number of channels, capacity, count, as int64.
+
+CONVERSION = metrics.histogram('pressurebot_conversion_seconds',
+                               'Time to convert the ADC counts of one reading to mbar')
+
+# Readings kept in the ring. The daemon picks them up within a sample time, so this
+# only has to cover it being held up for a while.
+RING_CAPACITY = 4096
+
+
+def reading_dtype(n_channels):
+    """
+    Returns the numpy dtype of one reading of n_channels gauges.
+
+    deadline, start, end are epoch seconds: when the reading was due, and when its
+    acquisition from the PL1216 started and ended. n_samples is 0 when no samples
+    were ready, overrun is 1 when the samples filled the read buffer, and skipped
+    the number of deadlines skipped just before this one.
+    """
+    return np.dtype([('deadline', '<f8'), ('start', '<f8'), ('end', '<f8'),
+                     ('n_samples', '<u4'), ('overrun', 'u1'), ('skipped', '<u4'),
+                     ('pressure', '<f8', (n_channels,)), ('flag', 'i1', (n_channels,))])
+
+
+def acquire(channels, sample_time, stop_event, missed=SKIP, device=None):
+    """
+    Reads the PL1216 every sample_time seconds until stop_event is set. Yields a
+    reading_dtype record per deadline, the pressures in channel order. It is the same
+    array every time, so copy it to keep it.
+
+    Parameters
+    ----------
+    channels : list of pressurebot.channels.Channel
+
+    sample_time : float
+
+    stop_event : threading.Event or multiprocessing.Event
+
+    missed : str, optional
+        'skip' or 'catchup', see pressurebot.scheduler.
+
+    device : optional
+        PL1216 driver functions, the picosdk driver by default.
+    """
+    # Keep the PL1216 streaming all channels, and average everything it captured
+    # since the last reading. No sleeps, and no gaps between readings.
+    reader = StreamingReader([channel.number for channel in channels],
+                             max_period=max(2 * sample_time, 1), device=device)
+    reader.open()
+    record = np.zeros((), dtype=reading_dtype(len(channels)))
+
+    try:
+        # Readings are due every sample_time on the monotonic clock, however long each
+        # takes, and time stamped in epoch seconds through the schedule's anchor.
+        scheduler = Scheduler(sample_time, missed)
+        while True:
+            deadline = scheduler.wait(stop_event)
+            if deadline is None:
+                break
+
+            start = time.monotonic()
+            counts, n_samples = reader.read()
+            end = time.monotonic()
+
+            record['deadline'] = scheduler.to_epoch(deadline)
+            record['start'] = scheduler.to_epoch(start)
+            record['end'] = scheduler.to_epoch(end)
+            record['n_samples'] = n_samples
+            record['overrun'] = n_samples >= reader.buffer_size
+            record['skipped'] = scheduler.skipped
+
+            if counts is not None:
+                # Mean ADC counts to mbar, through each gauge's lookup table.
+                with CONVERSION.time():
+                    for index, (channel, count) in enumerate(zip(channels, counts)):
+                        pressure, flag = channel.calibration.counts_to_mbar(count)
+                        record['pressure'][index] = pressure
+                        record['flag'][index] = flag
+            yield record
+    finally:
+        reader.close()
+        print(reader.status["closeUnit"])
+
+
+class SharedRing:
+    """
+    Ring buffer of readings in shared memory, with one writing process.
+
+    A 64 byte header (magic, number of channels, capacity, count of readings ever
+    written) is followed by `capacity` reading_dtype records. The writer fills in a
+    record before it increments the count, and readers check the count again after
+    copying records out, to drop any that were overwritten while they copied.
+
+    Create it with SharedRing.create in the process that owns it (and unlinks it),
+    and attach to it by name with SharedRing(name) elsewhere.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block.
+
+    readonly : bool, optional
+        Map the header and records as read-only numpy arrays.
+    """
+
+    def __init__(self, name, readonly=True, _memory=None):
+        self.memory = _memory or shared_memory.SharedMemory(name)
+        self.name = self.memory.name
+        header = np.ndarray(4, dtype='<i8', buffer=self.memory.buf)
+        if header[0] != RING_MAGIC:
+            self.memory.close()
+            raise ValueError(f"{name} is not a pressure reading ring")
+
+        self.n_channels, self.capacity = int(header[1]), int(header[2])
+        self.dtype = reading_dtype(self.n_channels)
+        self.header = header
+        self.records = np.ndarray(self.capacity, dtype=self.dtype, buffer=self.memory.buf,
+                                  offset=HEADER_SIZE)
+        if readonly:
+            self.header.flags.writeable = False
+            self.records.flags.writeable = False
+
+    @classmethod
+    def create(cls, n_channels, capacity=RING_CAPACITY):
+        dtype = reading_dtype(n_channels)
+        memory = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * dtype.itemsize)
+        header = np.ndarray(4, dtype='<i8', buffer=memory.buf)
+        header[:] = RING_MAGIC, n_channels, capacity, 0
+        del header
+        return cls(memory.name, readonly=True, _memory=memory)
+
+    @property
+    def count(self):
+        """
+        Number of readings ever written.
+        """
+        return int(self.header[3])
+
+    def append(self, record):
+        """
+        Writes one reading. Only one process may write.
+        """
+        count = int(self.header[3])
+        self.records[count % self.capacity] = record
+        self.header[3] = count + 1
+
+    def read(self, since):
+        """
+        Returns [copy of the readings written after the first `since`, new count]. If
+        more than capacity readings were written since, the oldest are lost.
+        """
+        count = self.count
+        since = max(since, count - self.capacity)
+        index = np.arange(since, count) % self.capacity
+        records = self.records[index]
+
+        # Readings the writer may have overwritten while they were copied, including
+        # the one it may be writing now.
+        overwritten = self.count - self.capacity + 1 - since
+        if overwritten > 0:
+            records = records[overwritten:]
+        return [records, count]
+
+    def close(self):
+        # Drop the numpy views first, SharedMemory.close fails while they exist.
+        self.header = self.records = None
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+def run_acquisition(ring_name, channels, sample_time, stop_event, missed=SKIP, device=None,
+                    ready=None):
+    """
+    Main function of the acquisition process: appends every reading of acquire() to
+    the SharedRing ring_name, releasing the semaphore `ready` after each.
+    """
+    # Ctrl+C and SIGTERM reach the whole process group. Leave stopping to the daemon,
+    # which sets stop_event, so the process is never killed while it holds the lock
+    # of stop_event. Stop by ourselves if the daemon dies.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    parent = multiprocessing.parent_process()
+    threading.Thread(target=lambda: (parent.join(), stop_event.set()), daemon=True).start()
+
+    ring = SharedRing(ring_name, readonly=False)
+    try:
+        for record in acquire(channels, sample_time, stop_event, missed, device):
+            ring.append(record)
+            if ready is not None:
+                ready.release()
+    finally:
+        ring.close()
+
+
+class AcquisitionProcess:
+    """
+    Runs acquire() in a child process, publishing through a SharedRing.
+
+    Parameters
+    ----------
+    channels, sample_time, missed, device :
+        As acquire(). The device must be picklable (e.g. a SimulatedPL1216), or None
+        for the picosdk driver, which the process loads itself.
+    """
+
+    def __init__(self, channels, sample_time, missed=SKIP, device=None):
+        # Spawn rather than fork, the daemon has threads running.
+        context = multiprocessing.get_context('spawn')
+        self.ring = SharedRing.create(len(channels))
+        self.stop_event = context.Event()
+        self.ready = context.Semaphore(0)
+        self.process = context.Process(
+            target=run_acquisition, name="acquisition",
+            args=[self.ring.name, channels, sample_time, self.stop_event, missed, device,
+                  self.ready])
+        self.seen = 0  # Count of the readings returned so far.
+
+    def start(self):
+        self.process.start()
+
+    def readings(self, stop_event, timeout=0.5):
+        """
+        Yields the readings of the process as they arrive, until stop_event is set,
+        then stops the process. Raises RuntimeError if the process ends first (e.g.
+        the driver failed to load), so the service doesn't go on without readings.
+        """
+        try:
+            while not stop_event.is_set() and self.process.is_alive():
+                if not self.ready.acquire(timeout=timeout):
+                    continue
+                records, self.seen = self.ring.read(self.seen)
+                for record in records:
+                    yield record
+            if not stop_event.is_set():
+                # The readings it published before it ended.
+                records, self.seen = self.ring.read(self.seen)
+                for record in records:
+                    yield record
+                self.process.join()
+                raise RuntimeError(f"Acquisition process ended with code {self.process.exitcode}")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        if self.process.exitcode:
+            print(f"Acquisition process exited with code {self.process.exitcode}")
+        if self.ring.header is not None:
+            self.ring.close()
+            self.ring.unlink()
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Pressure alert rules, checked on every new reading.
+
+Rules are read from a JSON file (alerts.json by default), e.g.
+
+    [
+        {"channel": "chamber", "type": "above", "limit": 1e-5},
+        {"channel": "chamber", "type": "below", "limit": 1e-9, "cooldown": 3600},
+        {"channel": "chamber", "type": "rate", "limit": 1e-8, "window": 300},
+        {"channel": "roughing", "type": "pumpdown", "limit": 1e-2, "within": 30, "start": 100}
+    ]
+
+    above     pressure over limit (mbar)
+    below     pressure under limit (mbar)
+    rate      pressure rising faster than limit (mbar/s), fitted over the last
+              `window` seconds
+    pumpdown  pressure not back under limit within `within` minutes of the pump
+              starting, i.e. of the pressure falling through `start` (mbar)
+
+Every rule takes "hysteresis" (0.1 by default): once raised, an alert only clears
+when the value is that fraction back inside the limit, or at "clear" if given. So a
+reading hovering around the limit does not flap. An alert raised again within
+"cooldown" seconds (600 by default) of the last notification is only notified once
+the cooldown is over, and only if it is still raised then.
+If the file does not exist, there are no rules.
+"""
+
+import os
+import json
+from collections import deque
+
+from pressurebot.channels import find_channel
+
+
+class SlidingWindow:
+    """
+    Samples of the last `seconds`, with their mean and least squares slope.
+
+    Running sums are updated as samples enter and leave, so adding a sample is O(1)
+    (amortised) however long the window is, and nothing is rescanned. Times are
+    summed relative to an anchor near the window, and the sums are rebuilt from the
+    samples once per window length, so rounding errors do not build up.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self.anchor = None
+        self.evicted = 0
+        self.n = self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, time, value):
+        if self.anchor is None:
+            self.anchor = time
+        self.samples.append((time, value))
+        self.accumulate(time - self.anchor, value, 1)
+
+        while self.samples[0][0] < time - self.seconds:
+            old_time, old_value = self.samples.popleft()
+            self.accumulate(old_time - self.anchor, old_value, -1)
+            self.evicted += 1
+
+        # Every sample has been replaced since the last rebuild.
+        if self.evicted >= len(self.samples):
+            self.rebuild()
+
+    def accumulate(self, t, value, sign):
+        self.n += sign
+        self.sum_t += sign * t
+        self.sum_v += sign * value
+        self.sum_tt += sign * t * t
+        self.sum_tv += sign * t * value
+
+    def rebuild(self):
+        self.anchor = self.samples[0][0]
+        self.evicted = 0
+        self.n = self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        for time, value in self.samples:
+            self.accumulate(time - self.anchor, value, 1)
+
+    def span(self):
+        """
+        Seconds between the oldest and newest sample.
+        """
+        return self.samples[-1][0] - self.samples[0][0] if self.samples else 0
+
+    def mean(self):
+        return self.sum_v / self.n if self.n else None
+
+    def slope(self):
+        """
+        Least squares slope of value against time (value per second), or None
+        without two distinct sample times.
+        """
+        denominator = self.n * self.sum_tt - self.sum_t ** 2
+        if self.n < 2 or denominator <= 0:
+            return None
+        return (self.n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+
+class Rule:
+    """
+    Base alert rule, with hysteresis and de-duplication of notifications.
+
+    Subclasses implement check(time, value), returning True when the value breaks
+    the rule, False when it is clear (back inside the hysteresis band), and None
+    when it is in between or cannot be judged yet.
+
+    Parameters
+    ----------
+    channel : pressurebot.channels.Channel
+        Gauge the rule applies to.
+
+    limit : float
+        Limit of the rule.
+
+    hysteresis : float, optional
+        Fraction of the limit the value must come back by, to clear the alert.
+
+    clear : float, optional
+        Level that clears the alert, instead of using hysteresis.
+
+    cooldown : float, optional
+        Seconds after a notification before the alert is notified again.
+    """
+
+    kind = None
+
+    def __init__(self, channel, limit, hysteresis=0.1, clear=None, cooldown=600):
+        self.channel = channel
+        self.limit = float(limit)
+        self.hysteresis = hysteresis
+        self.clear = clear
+        self.cooldown = cooldown
+        self.active = False  # Rule currently broken.
+        self.notified = False  # The current alert was notified.
+        self.last_notified = None
+        self.value = None  # Value of the last check, for messages.
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.channel.name!r}, {self.limit:.2e})"
+
+    def check(self, time, value):
+        raise NotImplementedError
+
+    def describe(self):
+        """
+        Returns a description of the rule, e.g. "chamber above 1.00e-05 mbar".
+        """
+        raise NotImplementedError
+
+    def update(self, time, value):
+        """
+        Checks a new reading. Returns the alert or all clear message to send, if any.
+        """
+        broken = self.check(time, value)
+
+        if broken and not self.notified:
+            # Newly raised, or raised during the cooldown and not notified yet.
+            self.active = True
+            if self.last_notified is None or time - self.last_notified >= self.cooldown:
+                self.notified = True
+                self.last_notified = time
+                return f"ALERT: {self.describe()} ({self.state()})"
+
+        elif broken is False and self.active:
+            self.active = False
+            if self.notified:
+                self.notified = False
+                return f"Cleared: {self.describe()} ({self.state()})"
+
+        return None
+
+    def state(self):
+        return f"now {self.value:.2e} mbar"
+
+
+class Above(Rule):
+    kind = 'above'
+
+    def check(self, time, value):
+        self.value = value
+        clear = self.limit * (1 - self.hysteresis) if self.clear is None else self.clear
+        return True if value > self.limit else False if value < clear else None
+
+    def describe(self):
+        return f"{self.channel.name} above {self.limit:.2e} mbar"
+
+
+class Below(Rule):
+    kind = 'below'
+
+    def check(self, time, value):
+        self.value = value
+        clear = self.limit * (1 + self.hysteresis) if self.clear is None else self.clear
+        return True if value < self.limit else False if value > clear else None
+
+    def describe(self):
+        return f"{self.channel.name} below {self.limit:.2e} mbar"
+
+
+class Rate(Rule):
+    """
+    Pressure rising faster than limit (mbar/s), over a sliding window of `window` seconds.
+    """
+
+    kind = 'rate'
+
+    def __init__(self, channel, limit, window=300, **kwargs):
+        super().__init__(channel, limit, **kwargs)
+        self.window = SlidingWindow(window)
+
+    def check(self, time, value):
+        self.window.add(time, value)
+        # Don't judge the rate on the first few samples of a window.
+        if self.window.span() < self.window.seconds / 2:
+            return None
+
+        self.value = self.window.slope()
+        if self.value is None:
+            return None
+        clear = self.limit * (1 - self.hysteresis) if self.clear is None else self.clear
+        return True if self.value > self.limit else False if self.value < clear else None
+
+    def describe(self):
+        return (f"{self.channel.name} rising faster than {self.limit:.2e} mbar/s "
+                f"over {self.window.seconds:g} s")
+
+    def state(self):
+        return f"now {self.value:.2e} mbar/s"
+
+
+class PumpDown(Rule):
+    """
+    Pressure not under limit within `within` minutes of the pressure falling through
+    `start` (mbar), i.e. of the pump starting.
+    """
+
+    kind = 'pumpdown'
+
+    def __init__(self, channel, limit, within=30, start=100, **kwargs):
+        super().__init__(channel, limit, **kwargs)
+        self.within = within
+        self.start = start
+        self.started = None  # Time the pump down began.
+        self.previous = None
+
+    def check(self, time, value):
+        self.value = value
+        if self.previous is not None and self.previous >= self.start > value:
+            self.started = time
+        elif value >= self.start:
+            # Vented (again). The next fall through start is a new pump down.
+            self.started = None
+        self.previous = value
+
+        if value < (self.limit if self.clear is None else self.clear):
+            self.started = None
+            return False
+        if self.started is not None and time - self.started > self.within * 60:
+            return True
+        return None
+
+    def describe(self):
+        return (f"{self.channel.name} not under {self.limit:.2e} mbar within "
+                f"{self.within:g} min of pumping")
+
+
+RULES = {rule.kind: rule for rule in (Above, Below, Rate, PumpDown)}
+
+
+class AlertEngine:
+    """
+    Checks each new reading against the rules of its channel.
+
+    Parameters
+    ----------
+    rules : list of Rule
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.by_channel = {}
+        for rule in self.rules:
+            self.by_channel.setdefault(rule.channel.number, []).append(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def check(self, channel_number, time, value):
+        """
+        Checks a reading of one channel. Returns the list of messages to send.
+        """
+        messages = []
+        for rule in self.by_channel.get(channel_number, ()):
+            message = rule.update(time, value)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def active(self):
+        """
+        Returns the rules currently broken.
+        """
+        return [rule for rule in self.rules if rule.active]
+
+
+def load_alerts(channels, filename='alerts.json'):
+    """
+    Returns an AlertEngine with the rules in filename, or with none if it doesn't exist.
+    """
+    if not os.path.exists(filename):
+        return AlertEngine()
+
+    rules = []
+    with open(filename) as file:
+        for entry in json.load(file):
+            entry = dict(entry)
+            kind = entry.pop('type')
+            if kind not in RULES:
+                raise ValueError(f"Unknown alert type {kind!r} in {filename}, "
+                                 f"expected one of {', '.join(RULES)}")
+            channel = find_channel(channels, entry.pop('channel', None))
+            rules.append(RULES[kind](channel, **entry))
+    return AlertEngine(rules)
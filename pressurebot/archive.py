@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed long term archive of pressure readings, with a time index.
+
+Readings are written in closed chunks of CHUNK_ROWS readings, each compressed the
+Gorilla way (Pelkonen et al., VLDB 2015):
+
+    time stamps  integer microseconds, as the delta of the delta to the previous
+                 reading, zig-zag encoded: 0 bits for a regular interval, 12 bits
+                 for scheduling jitter up to 2 ms, 24 bits up to 8 s (a missed
+                 reading), else 64 bits
+    pressures    per gauge, the XOR of the float64 bits with the previous reading:
+                 nothing if it is unchanged, else only the bits between the
+                 leading and trailing zeros of the XOR, in the window of the
+                 previous reading when they fit it (so no window is stored), or
+                 with a new 11 bit window (5 bits of leading zeros, 6 of length)
+
+Unlike Gorilla, the 2 bit control code of each time stamp and value and the windows
+are kept in streams of their own, apart from the variable width bits, so a chunk
+decodes with a few vectorized NumPy operations rather than bit by bit. Time stamps
+on the monotonic schedule have near constant intervals and slowly varying
+pressures change in few bits, so a reading of one gauge takes about 2 bytes from
+the text log (pressures of 3 significant figures, see TEXT_MANTISSA_BITS) and 8
+losslessly from the binary logs, instead of 29 and 16.
+
+The archive file (pressure_archive.pba) has a 64 byte header like the binary logs
+(magic, number of channels, PL1216 channel numbers) followed by the chunks. The
+index file next to it (pressure_archive.pba.idx) has a fixed width record per
+chunk, its first and last time, offset and size, so a query reads and decompresses
+only the chunks overlapping its time range, however long the archive.
+
+    python -m pressurebot archive [OUTPUT] [--data-dir DIR] [--start TIME] [--end TIME]
+
+migrates the binary logs (or pressure_data.txt) in DIR to an archive, and
+export.select_channels reads the archive up to its last reading and the logs after.
+"""
+
+import os
+
+import numpy as np
+
+ARCHIVE_MAGIC = b'PBARC1'
+HEADER_SIZE = 64
+ARCHIVE_NAME = 'pressure_archive.pba'
+CHUNK_ROWS = 4096
+
+TIME_RESOLUTION = 1e-6  # Seconds per unit of the stored time stamps.
+TIME_WIDTHS = np.array([0, 12, 24, 64])  # Bits of the zig-zag delta of delta, by code.
+TIME_LIMITS = np.array([1, 1 << 12, 1 << 24], dtype=np.uint64)  # Smallest value of codes 1-3.
+
+# Value codes.
+UNCHANGED = 0
+SAME_WINDOW = 1
+NEW_WINDOW = 2
+
+# Mantissa bits kept of text log pressures, which only have 3 significant figures.
+# Rounded to 12 bits (1.2e-4 relative, under half the 1e-3 step of 3 figures) they
+# always print as the same text again.
+TEXT_MANTISSA_BITS = 12
+
+INDEX_DTYPE = np.dtype([('first', '<f8'), ('last', '<f8'), ('offset', '<u8'), ('size', '<u4'),
+                        ('rows', '<u4')])
+
+
+def pack_bits(values, widths):
+    """
+    Returns the bytes of the low widths[i] bits of each values[i] (uint64), one after
+    the other, most significant bit first.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.broadcast_to(np.asarray(widths, dtype=np.int64), values.shape)
+    starts = np.cumsum(widths) - widths
+    n_bytes = (int(widths.sum()) + 7) // 8
+
+    # Each field left aligned in 64 bits, then shifted right by its offset in its first
+    # byte, spans 9 bytes: 8 as a big endian uint64 and the bits shifted out.
+    aligned = values << (64 - np.maximum(widths, 1)).astype(np.uint64)
+    aligned[widths == 0] = 0
+    offset = (starts & 7).astype(np.uint64)
+    spread = np.empty((len(values), 9), dtype=np.uint8)
+    spread[:, :8] = (aligned >> offset).astype('>u8')[:, None].view(np.uint8)
+    spill = np.where(offset > 0, aligned << (np.uint64(64) - np.maximum(offset, np.uint64(1))),
+                     np.uint64(0))
+    spread[:, 8] = spill >> np.uint64(56)
+
+    # Fields never share bits, so adding up the bytes they touch is the same as OR.
+    indices = (starts >> 3)[:, None] + np.arange(9)
+    packed = np.bincount(indices.ravel(), weights=spread.ravel(), minlength=n_bytes + 9)
+    return packed[:n_bytes].astype(np.uint8).tobytes()
+
+
+def unpack_bits(data, widths):
+    """
+    Inverse of pack_bits: returns the uint64 fields of widths bits packed in data.
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    starts = np.cumsum(widths) - widths
+    # Padded, so the 9 bytes any field can span are always there.
+    padded = np.frombuffer(data + bytes(9), dtype=np.uint8)
+
+    # The 64 bits from the start of each field: the 8 bytes it starts in as a big
+    # endian uint64, shifted left by the field's offset in its first byte, and the
+    # start of the 9th byte shifted in.
+    first = starts >> 3
+    words = np.lib.stride_tricks.sliding_window_view(padded, 8)[first]
+    words = words.view('>u8').ravel().astype(np.uint64)
+    offset = (starts & 7).astype(np.uint64)
+    words = (words << offset) | (padded[first + 8].astype(np.uint64) >> (np.uint64(8) - offset))
+    fields = words >> (64 - np.maximum(widths, 1)).astype(np.uint64)
+    fields[widths == 0] = 0
+    return fields
+
+
+def pack_codes(codes):
+    """
+    pack_bits(codes, 2) of 2 bit codes, four to a byte.
+    """
+    padded = np.zeros((len(codes) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    return (padded.reshape(-1, 4) << np.array([6, 4, 2, 0], dtype=np.uint8)).sum(
+        axis=1, dtype=np.uint8).tobytes()
+
+
+def unpack_codes(data, n_codes):
+    """
+    Inverse of pack_codes: returns n_codes 2 bit codes.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    return ((data[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3).ravel()[:n_codes]
+
+
+def leading_zeros(values):
+    """
+    Returns the number of leading zero bits of each uint64 (64 for 0).
+    """
+    values = np.array(values, dtype=np.uint64)
+    count = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = (values >> np.uint64(64 - shift)) == 0
+        count += shift * empty
+        values[empty] <<= np.uint64(shift)
+    return count + (values == 0)
+
+
+def trailing_zeros(values):
+    """
+    Returns the number of trailing zero bits of each uint64 (64 for 0).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lowest = values & (~values + np.uint64(1))
+    return np.where(values == 0, 64, 63 - leading_zeros(lowest))
+
+
+def round_mantissa(pressures, mantissa_bits):
+    """
+    Returns the float64 bits of pressures rounded to mantissa_bits bits of mantissa
+    (of 52), so the XORs of similar values end in zeros. NaN and inf are kept.
+    """
+    bits = np.ascontiguousarray(pressures, dtype=np.float64).view(np.uint64).copy()
+    dropped = 52 - mantissa_bits
+    if dropped > 0:
+        finite = np.isfinite(pressures)
+        half, mask = np.uint64(1 << (dropped - 1)), ~np.uint64((1 << dropped) - 1)
+        bits[finite] = (bits[finite] + half) & mask
+    return bits
+
+
+def encode_times(times):
+    """
+    Returns [first time stamp (microseconds), codes, bits] of a chunk's times.
+    """
+    ticks = np.rint(np.asarray(times) / TIME_RESOLUTION).astype(np.int64)
+    dods = np.diff(np.diff(ticks), prepend=0)
+    zigzag = ((dods << 1) ^ (dods >> 63)).view(np.uint64)
+    codes = np.searchsorted(TIME_LIMITS, zigzag, 'right')
+    return [int(ticks[0]), pack_codes(codes), pack_bits(zigzag, TIME_WIDTHS[codes])]
+
+
+def decode_times(first, n_rows, codes, bits):
+    codes = unpack_codes(codes, n_rows - 1)
+    zigzag = unpack_bits(bits, TIME_WIDTHS[codes])
+    dods = ((zigzag >> np.uint64(1)) ^ (np.uint64(0) - (zigzag & np.uint64(1)))).view(np.int64)
+    ticks = first + np.concatenate([[0], np.cumsum(np.cumsum(dods))])
+    return ticks * TIME_RESOLUTION
+
+
+def encode_values(bits):
+    """
+    Returns [codes, windows, bits] of the float64 bits (uint64) of one gauge's
+    pressures in a chunk.
+    """
+    xor = bits ^ np.concatenate([[np.uint64(0)], bits[:-1]])
+    lead = np.minimum(leading_zeros(xor), 31)  # 5 bits.
+    trail = trailing_zeros(xor)
+
+    # Gorilla's choice of window depends on the windows chosen before, so it is the
+    # one sequential step. It only runs over the changed values, and only notes
+    # those that need a new window.
+    changed = np.flatnonzero(xor)
+    new = []
+    current_lead = current_trail = 64
+    for position, (row_lead, row_trail) in enumerate(zip(lead[changed].tolist(),
+                                                         trail[changed].tolist())):
+        if row_lead < current_lead or row_trail < current_trail:
+            new.append(position)
+            current_lead, current_trail = row_lead, row_trail
+    new = changed[new]
+
+    codes = np.zeros(len(bits), dtype=np.uint8)
+    codes[changed] = SAME_WINDOW
+    codes[new] = NEW_WINDOW
+    # Every value's window is that of the latest new window at or before it.
+    latest = np.full(len(bits), -1)
+    latest[new] = new
+    latest = np.maximum.accumulate(latest)
+    windows = np.where(codes[:, None] == UNCHANGED, 0,
+                       np.column_stack([lead[latest], trail[latest]]))
+
+    widths = np.where(codes == UNCHANGED, 0, 64 - windows[:, 0] - windows[:, 1])
+    # Lengths are 1 to 64, stored mod 64 in 6 bits.
+    headers = (windows[new, 0] << 6) | (widths[new] & 63)
+    shifted = xor >> windows[:, 1].astype(np.uint64)
+    return [pack_codes(codes), pack_bits(headers, 11), pack_bits(shifted, widths)]
+
+
+def decode_values(n_rows, codes, windows, bits):
+    codes = unpack_codes(codes, n_rows)
+    new = np.flatnonzero(codes == NEW_WINDOW)
+    headers = unpack_bits(windows, np.full(len(new), 11)).astype(np.int64)
+    lengths = headers & 63
+    lengths[lengths == 0] = 64
+    # A last, empty window for the unchanged values before the first new one.
+    lengths, leads = np.append(lengths, 0), np.append(headers >> 6, 64)
+
+    # The window of every value: that of the latest NEW_WINDOW value at or before it.
+    latest = np.full(n_rows, -1)
+    latest[new] = np.arange(len(new))
+    latest = np.maximum.accumulate(latest)
+    width = np.where(codes == UNCHANGED, 0, lengths[latest])
+    trail = np.where(codes == UNCHANGED, 0, 64 - leads[latest] - lengths[latest])
+
+    xor = unpack_bits(bits, width) << trail.astype(np.uint64)
+    return np.bitwise_xor.accumulate(xor).view(np.float64)
+
+
+def encode_chunk(times, pressures, mantissa_bits=None):
+    """
+    Returns the bytes of a chunk of readings: times, and pressures (readings x gauges).
+    """
+    first, *streams = encode_times(times)
+    for column in range(pressures.shape[1]):
+        if mantissa_bits is None:
+            bits = np.ascontiguousarray(pressures[:, column], dtype=np.float64).view(np.uint64)
+        else:
+            bits = round_mantissa(pressures[:, column], mantissa_bits)
+        streams += encode_values(bits)
+
+    parts = [np.array([len(times)], dtype='<u4').tobytes(), np.array([first], dtype='<i8').tobytes()]
+    for stream in streams:
+        parts += [np.array([len(stream)], dtype='<u4').tobytes(), stream]
+    return b''.join(parts)
+
+
+def decode_chunk(data, n_channels, columns=None):
+    """
+    Returns [times, pressures] of a chunk, pressures (readings x gauges) of the gauge
+    columns given (all by default). The other gauges are skipped, not decoded.
+    """
+    n_rows = int(np.frombuffer(data, dtype='<u4', count=1)[0])
+    first = int(np.frombuffer(data, dtype='<i8', count=1, offset=4)[0])
+
+    streams, position = [], 12
+    for _ in range(2 + 3 * n_channels):
+        size = int(np.frombuffer(data, dtype='<u4', count=1, offset=position)[0])
+        streams.append(data[position + 4:position + 4 + size])
+        position += 4 + size
+
+    times = decode_times(first, n_rows, *streams[:2])
+    columns = range(n_channels) if columns is None else columns
+    pressures = np.empty((n_rows, len(columns)))
+    for output, column in enumerate(columns):
+        pressures[:, output] = decode_values(n_rows, *streams[2 + 3 * column:5 + 3 * column])
+    return [times, pressures]
+
+
+def make_header(channels):
+    numbers = np.array([len(channels)] + list(channels), dtype='<u2')
+    return (ARCHIVE_MAGIC + numbers.tobytes()).ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(filename):
+    """
+    Returns the list of PL1216 channel numbers of an archive, in column order.
+    """
+    with open(filename, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or not header.startswith(ARCHIVE_MAGIC):
+        raise ValueError(f"{filename} is not a pressure archive")
+    numbers = np.frombuffer(header, dtype='<u2', offset=len(ARCHIVE_MAGIC))
+    return [int(number) for number in numbers[1:numbers[0] + 1]]
+
+
+def read_index(filename):
+    """
+    Returns the chunk index of an archive, INDEX_DTYPE records. A partly written last
+    record, or chunks beyond the end of the archive, are left out.
+    """
+    index_filename = filename + '.idx'
+    if not os.path.exists(index_filename):
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    n_records = os.path.getsize(index_filename) // INDEX_DTYPE.itemsize
+    index = np.fromfile(index_filename, dtype=INDEX_DTYPE, count=n_records)
+    return index[index['offset'] + index['size'] <= os.path.getsize(filename)]
+
+
+class ArchiveWriter:
+    """
+    Appends readings to an archive, a chunk at a time.
+
+    Readings are buffered until there are chunk_rows of them, then compressed and
+    written, the chunk first and then its index record, so a crash leaves at most a
+    chunk that no index record points to, which is dropped on the next open.
+
+    Parameters
+    ----------
+    filename : str
+        Archive file. Created if it doesn't exist.
+
+    channels : list of int
+        PL1216 channel numbers of the pressure columns.
+
+    chunk_rows : int, optional
+        Readings per chunk.
+
+    mantissa_bits : int, optional
+        Round pressures to this many mantissa bits (of 52) for better compression,
+        e.g. TEXT_MANTISSA_BITS. Lossless by default.
+    """
+
+    def __init__(self, filename, channels, chunk_rows=CHUNK_ROWS, mantissa_bits=None):
+        if mantissa_bits is not None and not 1 <= mantissa_bits <= 52:
+            raise ValueError("mantissa_bits must be 1 to 52")
+        self.filename = filename
+        self.channels = list(channels)
+        self.chunk_rows = chunk_rows
+        self.mantissa_bits = mantissa_bits
+        self.pending = []  # [times, pressures] blocks not yet written.
+        self.n_pending = 0
+
+        if os.path.exists(filename) and os.path.getsize(filename) >= HEADER_SIZE:
+            if read_header(filename) != self.channels:
+                raise ValueError(f"{filename} was written with different channels")
+            # Drop what a crash left behind: a chunk without an index record, or the
+            # reverse.
+            index = read_index(filename)
+            end = int(index['offset'][-1] + index['size'][-1]) if len(index) else HEADER_SIZE
+            os.truncate(filename, end)
+            with open(filename + '.idx', 'ab') as file:
+                file.truncate(len(index) * INDEX_DTYPE.itemsize)
+            self.last_time = float(index['last'].max()) if len(index) else None
+            self.file = open(filename, 'ab')
+        else:
+            self.file = open(filename, 'wb')
+            self.file.write(make_header(self.channels))
+            self.last_time = None
+        self.index_file = open(filename + '.idx', 'ab')
+
+    def write(self, times, pressures):
+        """
+        Adds readings: times (epoch seconds) and pressures (readings x channels, mbar).
+        """
+        pressures = np.asarray(pressures, dtype=np.float64).reshape(len(times), len(self.channels))
+        self.pending.append([np.asarray(times, dtype=np.float64), pressures])
+        self.n_pending += len(times)
+        if self.n_pending >= self.chunk_rows:
+            times = np.concatenate([block[0] for block in self.pending])
+            pressures = np.concatenate([block[1] for block in self.pending])
+            full = len(times) - len(times) % self.chunk_rows
+            for start in range(0, full, self.chunk_rows):
+                self.write_chunk(times[start:start + self.chunk_rows],
+                                 pressures[start:start + self.chunk_rows])
+            self.pending = [[times[full:], pressures[full:]]]
+            self.n_pending = len(times) - full
+
+    def write_chunk(self, times, pressures):
+        data = encode_chunk(times, pressures, self.mantissa_bits)
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['first'], record['last'] = times.min(), times.max()
+        record['offset'] = self.file.tell()
+        record['size'], record['rows'] = len(data), len(times)
+        self.file.write(data)
+        self.file.flush()
+        self.index_file.write(record.tobytes())
+        last = float(record['last'][0])
+        self.last_time = last if self.last_time is None else max(self.last_time, last)
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.n_pending:
+            self.write_chunk(np.concatenate([block[0] for block in self.pending]),
+                             np.concatenate([block[1] for block in self.pending]))
+            self.pending, self.n_pending = [], 0
+        for file in (self.file, self.index_file):
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+        self.file = self.index_file = None
+
+
+class Archive:
+    """
+    Reads an archive written by ArchiveWriter.
+
+    Parameters
+    ----------
+    filename : str
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.channels = read_header(filename)
+        self.index = read_index(filename)
+
+    def __len__(self):
+        return int(self.index['rows'].sum())
+
+    def chunks(self, start=None, end=None, numbers=None):
+        """
+        Yields [times, pressures] of every chunk with readings between start and end
+        (epoch seconds, end included), pressures with a column per channel number
+        (all by default), NaN for channels not in the archive. Like
+        export.log_chunks, only readings in range are kept.
+        """
+        numbers = self.channels if numbers is None else numbers
+        present = [output for output, number in enumerate(numbers) if number in self.channels]
+        columns = [self.channels.index(numbers[output]) for output in present]
+
+        touched = np.ones(len(self.index), dtype=bool)
+        if start is not None:
+            touched &= self.index['last'] >= start
+        if end is not None:
+            touched &= self.index['first'] <= end
+
+        with open(self.filename, 'rb') as file:
+            for record in self.index[touched]:
+                file.seek(int(record['offset']))
+                times, decoded = decode_chunk(file.read(int(record['size'])),
+                                              len(self.channels), columns)
+                if len(present) == len(numbers):
+                    pressures = decoded
+                else:
+                    pressures = np.full((len(times), len(numbers)), np.nan)
+                    pressures[:, present] = decoded
+                keep = np.ones(len(times), dtype=bool)
+                if start is not None:
+                    keep &= times >= start
+                if end is not None:
+                    keep &= times <= end
+                if keep.all():
+                    yield [times, pressures]
+                elif keep.any():
+                    yield [times[keep], pressures[keep]]
+
+    def read(self, start=None, end=None, numbers=None):
+        """
+        Returns [times, pressures] between start and end, see chunks.
+        """
+        numbers = self.channels if numbers is None else numbers
+        chunks = list(self.chunks(start, end, numbers))
+        if not chunks:
+            return [np.zeros(0), np.zeros((0, len(numbers)))]
+        return [np.concatenate([chunk[0] for chunk in chunks]),
+                np.concatenate([chunk[1] for chunk in chunks])]
+
+
+def convert(folder, filename=None, start=None, end=None, keys=None, mantissa_bits=None,
+            chunk_rows=CHUNK_ROWS):
+    """
+    Appends the readings of the gauges keys (all by default) between start and end
+    in the logs in folder (binary, or else pressure_data.txt) to an archive,
+    folder/pressure_archive.pba by default. Readings up to the last one already in
+    the archive are skipped, so it can be run again to add new ones. Text log
+    pressures are kept to TEXT_MANTISSA_BITS unless mantissa_bits is given.
+    Returns the number of readings added.
+    """
+    from pressurebot.export import select_gauges, logs_in_range
+
+    if filename is None:
+        filename = os.path.join(folder, ARCHIVE_NAME)
+    if os.path.exists(filename):
+        # Only what comes after the archive's last reading.
+        index = read_index(filename)
+        if len(index):
+            after = np.nextafter(index['last'].max(), np.inf)
+            start = after if start is None else max(after, start)
+    if mantissa_bits is None and not logs_in_range(folder, start, end):
+        mantissa_bits = TEXT_MANTISSA_BITS
+
+    chunks, channels = select_gauges(folder, start, end, keys)
+    writer = ArchiveWriter(filename, [channel.number for channel in channels], chunk_rows,
+                           mantissa_bits)
+    n_rows = 0
+    try:
+        for times, pressures in chunks:
+            writer.write(times, pressures)
+            n_rows += len(times)
+    finally:
+        writer.close()
+    return n_rows
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized conversion of PL1216 readings to pressure.
+
+A Calibration turns the voltage measured by the PL1216 (after the channel's potential
+divider) into mbar, for whole numpy arrays at once. Pressures outside the gauge's
+measuring range are clipped to it and flagged UNDER_RANGE or OVER_RANGE.
+
+For every calibration a 4096 entry lookup table over the 12 bit ADC counts is built
+once, so raw counts convert to mbar by indexing (see Calibration.counts_to_mbar).
+"""
+
+import numpy as np
+
+MAX_ADC = 4095  # 12 bit ADC.
+INPUT_RANGE = 2.5  # Volts at MAX_ADC.
+
+# Range flags.
+IN_RANGE = 0
+UNDER_RANGE = 1
+OVER_RANGE = 2
+
+
+# Every ADC count, the x axis of the lookup tables.
+ADC_COUNTS = np.arange(MAX_ADC + 1, dtype=np.float64)
+
+
+def adc2volts(counts, out=None):
+    """
+    Converts ADC counts to Volts. Works on scalars and on whole numpy arrays, in
+    place if out is given.
+    """
+    return np.multiply(counts, INPUT_RANGE / MAX_ADC, out=out)
+
+
+class Calibration:
+    """
+    Base class of the gauge calibrations.
+
+    Parameters
+    ----------
+    divider : float, optional
+        Potential divider ratio (gauge volts / PL1216 volts).
+
+    min_pressure, max_pressure : float, optional
+        Measuring range of the gauge in mbar.
+    """
+
+    def __init__(self, divider=4.16, min_pressure=0, max_pressure=1000):
+        self.divider = divider
+        self.min_pressure = min_pressure
+        self.max_pressure = max_pressure
+        self._lut = None
+        self._log_lut = None
+
+    def gauge_log10_mbar(self, gauge_volts, out):
+        """
+        Writes log10(pressure in mbar) of the gauge output voltages into out.
+        """
+        raise NotImplementedError
+
+    def convert(self, volts, out=None, flags=None):
+        """
+        Converts PL1216 voltages to mbar.
+
+        Parameters
+        ----------
+        volts : float or numpy array
+            Voltages measured by the PL1216.
+
+        out : numpy float64 array, optional
+            Array to write the pressures to. May be volts itself, for in place conversion.
+
+        flags : numpy uint8 array, optional
+            Array to write the range flags to.
+
+        Returns
+        -------
+        pressure, flags : numpy arrays (or numpy scalars for a scalar input)
+        """
+        volts = np.asarray(volts, dtype=np.float64)
+        if out is None:
+            out = np.empty_like(volts)
+        if flags is None:
+            flags = np.empty(volts.shape, dtype=np.uint8)
+
+        np.multiply(volts, self.divider, out=out)
+        self.gauge_log10_mbar(out, out)
+        np.power(10.0, out, out=out)
+
+        # Flag, then clip to the measuring range of the gauge.
+        flags[...] = IN_RANGE
+        flags[out < self.min_pressure] = UNDER_RANGE
+        flags[out > self.max_pressure] = OVER_RANGE
+        np.clip(out, self.min_pressure, self.max_pressure, out=out)
+
+        if out.ndim == 0:
+            return out[()], flags[()]
+        return out, flags
+
+    def lookup_table(self):
+        """
+        Returns (pressure, flags) arrays for each of the 4096 ADC counts.
+        """
+        if self._lut is None:
+            self._lut = self.convert(adc2volts(ADC_COUNTS))
+        return self._lut
+
+    def log_lookup_table(self):
+        """
+        Returns log10 of the pressure for each of the 4096 ADC counts.
+        """
+        if self._log_lut is None:
+            self._log_lut = np.log10(self.lookup_table()[0])
+        return self._log_lut
+
+    def counts_to_mbar(self, counts):
+        """
+        Converts ADC counts to mbar with the lookup table. Integer counts are looked up
+        directly. Fractional counts (e.g. averages) are interpolated in log10(pressure).
+
+        Returns
+        -------
+        pressure, flags : numpy arrays (or numpy scalars for a scalar input)
+        """
+        pressure, flags = self.lookup_table()
+        counts = np.asarray(counts)
+
+        if np.issubdtype(counts.dtype, np.integer):
+            # np.minimum/maximum rather than np.clip, which costs several us more on the
+            # scalar counts of a reading.
+            counts = np.minimum(np.maximum(counts, 0), MAX_ADC)
+            return pressure[counts], flags[counts]
+
+        log_pressure = np.interp(counts, ADC_COUNTS, self.log_lookup_table())
+        nearest = np.minimum(np.maximum(np.rint(counts).astype(np.intp), 0), MAX_ADC)
+        return np.power(10.0, log_pressure), flags[nearest]
+
+    def mbar_to_counts(self, pressure):
+        """
+        Inverse of counts_to_mbar: returns the fractional ADC counts that convert to
+        pressure (mbar), e.g. to feed logged readings through the conversion again.
+        Pressures beyond the range of the table give its first or last count, and NaN
+        gives NaN.
+        """
+        table, counts = self.log_lookup_table(), ADC_COUNTS
+        if table[-1] < table[0]:
+            table, counts = table[::-1], counts[::-1]
+        # Only the counts where the pressure still changes, clipped ones repeat it.
+        keep = np.concatenate([[True], np.diff(table) > 0])
+        return np.interp(np.log10(pressure), table[keep], counts[keep])
+
+
+class LogLinear(Calibration):
+    """
+    Gauges with a log-linear output, pressure = 10**(slope*V - offset) mbar.
+    """
+
+    def __init__(self, slope, offset, divider=4.16, min_pressure=0, max_pressure=1000):
+        super().__init__(divider, min_pressure, max_pressure)
+        self.slope = slope
+        self.offset = offset
+
+    def gauge_log10_mbar(self, gauge_volts, out):
+        np.multiply(gauge_volts, self.slope, out=out)
+        np.subtract(out, self.offset, out=out)
+
+
+class Table(Calibration):
+    """
+    Gauges given by a table of (gauge volts, mbar) points, interpolated linearly in
+    log10(pressure) between the points.
+    """
+
+    def __init__(self, points, divider=4.16, min_pressure=None, max_pressure=None):
+        points = np.asarray(sorted(points), dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 2 or len(points) < 2:
+            raise ValueError("A calibration table needs at least two [volts, mbar] points")
+
+        super().__init__(divider,
+                         points[:, 1].min() if min_pressure is None else min_pressure,
+                         points[:, 1].max() if max_pressure is None else max_pressure)
+        self.volts = points[:, 0]
+        self.log10_mbar = np.log10(points[:, 1])
+
+    def gauge_log10_mbar(self, gauge_volts, out):
+        volts, log10_mbar = self.volts, self.log10_mbar
+        # At least 1d, as np.interp returns a numpy scalar for a 0d (scalar) input.
+        gauge_volts = np.atleast_1d(np.asarray(gauge_volts, dtype=np.float64))
+        result = np.interp(gauge_volts, volts, log10_mbar)
+
+        # Extrapolate past the ends of the table, so that out of range readings get flagged.
+        below = gauge_volts < volts[0]
+        above = gauge_volts > volts[-1]
+        low_slope = (log10_mbar[1] - log10_mbar[0]) / (volts[1] - volts[0])
+        high_slope = (log10_mbar[-1] - log10_mbar[-2]) / (volts[-1] - volts[-2])
+        result[below] = log10_mbar[0] + low_slope * (gauge_volts[below] - volts[0])
+        result[above] = log10_mbar[-1] + high_slope * (gauge_volts[above] - volts[-1])
+        out[...] = result.reshape(np.shape(out))
+
+
+# Gauge curves known by name. Pressures in mbar.
+GAUGES = {
+    # Leybold PENNINGVAC PTR 90 and Pfeiffer PKR 251: 10**(1.667*U - 11.33).
+    'PTR90': dict(slope=1.667, offset=11.33, min_pressure=5e-9, max_pressure=1000),
+    'PKR251': dict(slope=1.667, offset=11.33, min_pressure=5e-9, max_pressure=1000),
+    # Leybold THERMOVAC TTR 91: 10**((U - 6.143)/1.286).
+    'TTR91': dict(slope=1 / 1.286, offset=6.143 / 1.286, min_pressure=5e-4, max_pressure=1000),
+}
+
+
+def make_calibration(gauge='PTR90', divider=4.16, slope=None, offset=None, table=None,
+                     min_pressure=None, max_pressure=None):
+    """
+    Builds a Calibration from the channel settings of channels.json: a named gauge, a
+    custom log-linear curve (slope and offset), or a table of [volts, mbar] points.
+    """
+    limits = {key: value for key, value in
+              (('min_pressure', min_pressure), ('max_pressure', max_pressure)) if value is not None}
+
+    if table is not None:
+        return Table(table, divider, **limits)
+
+    if slope is not None or offset is not None:
+        curve = dict(GAUGES['PTR90'], **limits)
+        curve.update({key: value for key, value in (('slope', slope), ('offset', offset))
+                      if value is not None})
+        return LogLinear(divider=divider, **curve)
+
+    if gauge not in GAUGES:
+        raise ValueError(f"Unknown gauge {gauge}. Known gauges: {', '.join(GAUGES)}")
+    return LogLinear(divider=divider, **dict(GAUGES[gauge], **limits))
+
+
+PTR90 = make_calibration('PTR90')
+
+
+def volts2mbar(voltage, calibration=PTR90):
+    """
+    Voltage - Volts measured by the PL1216. A float, or a numpy array.
+
+    Returns
+    -------
+    Pressure (mbar), clipped to the gauge range.
+    """
+    return calibration.convert(voltage)[0]
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+PL1216 input channels and the gauge calibration of each.
+
+Channels are read from a JSON file (channels.json by default), e.g.
+
+    [
+        {"number": 16, "name": "chamber"},
+        {"number": 15, "name": "roughing", "divider": 4.1, "gauge": "TTR91"},
+        {"number": 14, "name": "loadlock", "slope": 1.667, "offset": 11.33},
+        {"number": 13, "name": "foreline", "table": [[1.0, 1e-3], [5.0, 1.0], [9.0, 1000]]}
+    ]
+
+Every key other than "number" is optional. The gauge is one of calibration.GAUGES
+(PTR90 by default), a custom log-linear curve, or a table of [gauge volts, mbar]
+points. If the file does not exist, the single chamber gauge on channel 16 is used.
+"""
+
+import os
+import json
+
+from pressurebot.calibration import make_calibration
+
+
+class Channel:
+    """
+    One gauge, wired to one PL1216 input.
+
+    Parameters
+    ----------
+    number : int
+        Data Logger input channel, 1 to 16.
+
+    name : str, optional
+        Name used in the bot and the plot. "ch<number>" by default.
+
+    divider : float, optional
+        Potential divider ratio (gauge volts / PL1216 volts).
+
+    gauge, slope, offset, table, min_pressure, max_pressure : optional
+        Gauge calibration, see calibration.make_calibration. PTR90 by default.
+    """
+
+    def __init__(self, number, name=None, divider=4.16, gauge='PTR90', slope=None,
+                 offset=None, table=None, min_pressure=None, max_pressure=None):
+        if not 1 <= number <= 16:
+            raise ValueError(f"PL1216 channel {number} does not exist")
+
+        self.number = number
+        self.name = name if name is not None else f"ch{number}"
+        self.calibration = make_calibration(gauge, divider, slope, offset, table,
+                                            min_pressure, max_pressure)
+
+    def __repr__(self):
+        return f"Channel({self.number}, {self.name!r})"
+
+    def to_mbar(self, voltage):
+        """
+        Returns the pressure (mbar) of a PL1216 voltage, or of a numpy array of them.
+        """
+        return self.calibration.convert(voltage)[0]
+
+
+def load_channels(filename='channels.json'):
+    """
+    Returns the list of Channels in filename, or the default channel 16 gauge.
+    """
+    if not os.path.exists(filename):
+        return [Channel(16, 'chamber')]
+
+    with open(filename) as file:
+        channels = [Channel(**entry) for entry in json.load(file)]
+
+    if len({channel.number for channel in channels}) != len(channels):
+        raise ValueError(f"{filename} lists a channel more than once")
+    if len({channel.name for channel in channels}) != len(channels):
+        raise ValueError(f"{filename} uses a channel name more than once")
+    return channels
+
+
+def find_channel(channels, key):
+    """
+    Returns the channel matching key, which is a channel name or number (int or str).
+    None returns the first channel. Raises KeyError if there is no match.
+    """
+    if key is None:
+        return channels[0]
+    for channel in channels:
+        if str(key).lower() in (channel.name.lower(), str(channel.number)):
+            return channel
+    raise KeyError(key)
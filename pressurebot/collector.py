@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition, storage and queries of the PL1216 pressure readings.
+
+DataCollector owns the ring buffers, rollups and log files, reads the PL1216 in
+start_collection, and serves the bot, the daemon's clients and the GUI.
+"""
+
+import os
+import time
+import threading
+import traceback
+
+from pressurebot.ring_buffer import RingBuffer
+from pressurebot.rollup import RollupTier, envelope
+from pressurebot.storage import BinaryLog, format_time
+from pressurebot.history import load_binary_history, load_text_history
+from pressurebot.channels import load_channels, find_channel
+from pressurebot.calibration import IN_RANGE
+from pressurebot.alerts import load_alerts
+from pressurebot.scheduler import SKIP
+from pressurebot.acquisition import acquire, AcquisitionProcess
+from pressurebot import metrics
+
+ACQUISITION = metrics.histogram('pressurebot_acquisition_seconds',
+                                'Time to read and average the PL1216 samples of one reading')
+LATENESS = metrics.histogram('pressurebot_schedule_lateness_seconds',
+                             'Time readings started after their deadline')
+MISSED = metrics.counter('pressurebot_missed_deadlines_total',
+                         'Reading deadlines skipped because a reading overran')
+DISK_WRITE = metrics.histogram('pressurebot_disk_write_seconds',
+                               'Time to write one reading to the binary log, flushes included')
+LOCK_WAIT = metrics.histogram('pressurebot_lock_wait_seconds',
+                              'Time spent waiting for the collector lock')
+LOCK_HOLD = metrics.histogram('pressurebot_lock_hold_seconds',
+                              'Time the collector lock was held')
+INTERVAL = metrics.histogram('pressurebot_reading_interval_seconds',
+                             'Time between consecutive readings')
+LATE = metrics.counter('pressurebot_late_readings_total',
+                       'Readings more than 1.5 sample times after the previous one')
+EMPTY = metrics.counter('pressurebot_empty_reads_total',
+                        'Reads with no PL1216 samples ready, so no reading was made')
+OVERRUN = metrics.counter('pressurebot_overrun_reads_total',
+                          'Reads that filled the read buffer, leaving samples behind or lost')
+CALLBACKS = metrics.histogram('pressurebot_reading_callbacks_seconds',
+                              'Time to call the reading callbacks (clients, GUI) of one reading')
+ROLLUP = metrics.histogram('pressurebot_rollup_seconds',
+                           'Time to add one reading to the minute and hour rollups')
+ALERT_CHECK = metrics.histogram('pressurebot_alert_check_seconds',
+                                'Time to check the alert rules on one reading and notify')
+PROCESSING = metrics.histogram('pressurebot_reading_processing_seconds',
+                               'Time to store, publish, roll up and check one reading')
+
+
+class DataCollector:
+    def __init__(self, stop_event, channels=None, sample_time=5, max_storage=1, data_dir='.',
+                 text_log=False, alerts=None, device=None, missed=SKIP, process=False,
+                 replay=None):
+        """
+        stop_event : threading.Event
+            Set by stop_collection, to end collection and the bot.
+
+        channels : list of pressurebot.channels.Channel, optional
+            Gauges to read, all in one scan. Read from channels.json by default.
+
+        sample_time : float, optional
+            Seconds between readings. Each reading averages the whole period.
+
+        max_storage : float, optional
+            Number of days of readings to keep in memory. 1 day by default.
+
+        data_dir : str, optional
+            Folder of the binary log and the per minute and per hour rollup files.
+
+        text_log : bool, optional
+            Also append readings of the first channel to pressure_data.txt, in the
+            old text format.
+
+        alerts : pressurebot.alerts.AlertEngine, optional
+            Alert rules checked on every reading. Read from alerts.json by default.
+
+        device : optional
+            PL1216 driver functions, the picosdk driver by default. Pass a
+            pressurebot.simulator.SimulatedPL1216 to run without the hardware.
+
+        missed : str, optional
+            'skip' (the default) or 'catchup': what to do about readings due while the
+            previous one was still being made, see pressurebot.scheduler.
+
+        process : bool, optional
+            Read the PL1216 in a process of its own, which hands the readings over
+            through shared memory, see pressurebot.acquisition. The device must
+            then be picklable, or None for the picosdk driver.
+
+        replay : pressurebot.replay.Replay, optional
+            Replay logged readings instead of reading the PL1216.
+        """
+        self.channels = load_channels() if channels is None else channels
+        self.latest_value = None  # Of the first channel.
+        self.latest_values = {channel.number: None for channel in self.channels}
+        self.latest_flags = {channel.number: IN_RANGE for channel in self.channels}
+        self.latest_time = None  # Epoch seconds.
+        # (start, end) epoch seconds of the latest acquisition from the PL1216.
+        self.acquisition = None
+        # Records its wait and hold times, see pressurebot.metrics.
+        self.lock = metrics.LockTimer(threading.Lock(), LOCK_WAIT, LOCK_HOLD)
+        self.stop_event = stop_event
+        self.stop_callbacks = []
+        self.device = device
+
+        # Alert rules, and the functions their messages are passed to (e.g. the bot's).
+        self.alerts = load_alerts(self.channels) if alerts is None else alerts
+        self.alert_callbacks = []
+
+        # Functions called with every new snapshot, e.g. to stream readings to clients.
+        self.reading_callbacks = []
+
+        # (epoch time, pressures, range flags) of the latest reading, in channel order.
+        # Replaced as a whole after every reading, so it can be read without the lock.
+        self.snapshot = None
+        self.sample_time = sample_time
+        self.missed = missed
+        self.process = process
+        self.replay = replay
+
+        # Pressure readings against epoch time, stored in preallocated numpy arrays.
+        self.buffers = {channel.number: RingBuffer(int(max_storage*86400/self.sample_time))
+                        for channel in self.channels}
+
+        # Min/mean/max per minute (kept 30 days) and per hour (kept 5 years), saved to disk.
+        self.rollups = {channel.number: [
+            RollupTier(60, 30*1440, os.path.join(data_dir, f'pressure_ch{channel.number}_1min.bin')),
+            RollupTier(3600, 5*8760, os.path.join(data_dir, f'pressure_ch{channel.number}_1h.bin'))]
+            for channel in self.channels}
+
+        # Daily binary log files, one column per channel, kept open and flushed in batches.
+        text_filename = os.path.join(data_dir, 'pressure_data.txt') if text_log else None
+        self.data_dir = data_dir
+        self.storage = BinaryLog(data_dir, channels=[channel.number for channel in self.channels],
+                                 text_filename=text_filename)
+
+    def channel(self, key=None):
+        """
+        Returns the Channel with name or number key, the first channel by default.
+        """
+        return find_channel(self.channels, key)
+
+    def load_history(self, hours=None):
+        """
+        Refills the ring buffers with the last `hours` of readings saved on disk (as many
+        as fit by default), from the binary logs or else from pressure_data.txt.
+        """
+        if hours is None:
+            hours = self.buffers[self.channel().number].capacity * self.sample_time / 3600
+        since = time.time() - hours * 3600
+        text_filename = os.path.join(self.data_dir, 'pressure_data.txt')
+        n_loaded, last_time = 0, 0
+
+        for channel in self.channels:
+            times, data = load_binary_history(self.data_dir, since, channel.number)
+            # The text log only ever held the first channel.
+            if not len(times) and channel is self.channel() and os.path.exists(text_filename):
+                times, data = load_text_history(text_filename, since)
+
+            if not len(times):
+                continue
+
+            with self.lock:
+                self.buffers[channel.number].extend(times, data)
+                self.latest_values[channel.number] = data[-1]
+                if channel is self.channel():
+                    self.latest_value = data[-1]
+                    self.latest_time = float(times[-1])
+            n_loaded += len(times)
+            last_time = max(last_time, times[-1])
+
+        if n_loaded:
+            self.snapshot = (last_time, tuple(self.latest_values[channel.number]
+                                                for channel in self.channels),
+                             (IN_RANGE,) * len(self.channels))
+            print(f"Loaded {n_loaded} readings from disk")
+        return n_loaded
+
+    def stop_collection(self):
+        self.stop_event.set()
+        for callback in list(self.stop_callbacks):
+            callback()
+
+    def start_collection(self):
+        """
+        Reads the PL1216 every sample_time seconds (or replays logged readings) until
+        stop_collection is called.
+        """
+        if self.replay is not None:
+            readings = self.replay.readings(self.stop_event)
+        elif self.process:
+            acquisition = AcquisitionProcess(self.channels, self.sample_time, self.missed,
+                                             self.device)
+            acquisition.start()
+            readings = acquisition.readings(self.stop_event)
+        else:
+            readings = acquire(self.channels, self.sample_time, self.stop_event, self.missed,
+                               self.device)
+
+        last_stamp = None
+        try:
+            for record in readings:
+                # Save and publish outside of the lock. Only this thread writes the readings,
+                # so readers never have to wait on the PL1216 or the disk.
+                start, end = float(record['start']), float(record['end'])
+                self.acquisition = (start, end)
+                ACQUISITION.observe(end - start)
+                LATENESS.observe(start - float(record['deadline']))
+                if record['skipped']:
+                    MISSED.inc(int(record['skipped']))
+                if not record['n_samples']:
+                    EMPTY.inc()
+                    continue
+                if record['overrun']:
+                    OVERRUN.inc()
+                processing = time.perf_counter()
+
+                pressure_readings = [float(pressure) for pressure in record['pressure']]
+                flags = [int(flag) for flag in record['flag']]
+
+                # Time of reading: when the samples it averages were taken off the PL1216.
+                time_stamp = start
+                if last_stamp is not None:
+                    INTERVAL.observe(time_stamp - last_stamp)
+                    if time_stamp - last_stamp > 1.5 * self.sample_time:
+                        LATE.inc()
+                last_stamp = time_stamp
+
+                with DISK_WRITE.time():
+                    self.storage.write(time_stamp, pressure_readings)
+
+                # Publish the new readings. Keep this block short, it is all readers wait on.
+                with self.lock:
+                    self.latest_value = pressure_readings[0]
+                    self.latest_time = time_stamp
+                    for channel, pressure_reading, flag in zip(self.channels, pressure_readings,
+                                                               flags):
+                        self.latest_values[channel.number] = pressure_reading
+                        self.latest_flags[channel.number] = flag
+                        self.buffers[channel.number].append(time_stamp, pressure_reading)
+                self.snapshot = (time_stamp, tuple(pressure_readings), tuple(flags))
+                with CALLBACKS.time():
+                    for callback in list(self.reading_callbacks):
+                        callback(self.snapshot)
+
+                with ROLLUP.time():
+                    for channel, pressure_reading in zip(self.channels, pressure_readings):
+                        for tier in self.rollups[channel.number]:
+                            tier.add(time_stamp, pressure_reading)
+
+                with ALERT_CHECK.time():
+                    for channel, pressure_reading in zip(self.channels, pressure_readings):
+                        for message in self.alerts.check(channel.number, time_stamp,
+                                                         pressure_reading):
+                            print(message)
+                            for callback in list(self.alert_callbacks):
+                                callback(message)
+                PROCESSING.observe(time.perf_counter() - processing)
+        except Exception as error:
+            # Stop the whole service rather than have the bot, GUI socket and API go on
+            # serving the last readings as if they were current.
+            print(f"Collection failed, stopping: {type(error).__name__}: {error}")
+            traceback.print_exc()
+            self.stop_collection()
+            return 1
+        finally:
+            readings.close()
+            self.storage.close()
+            for tiers in self.rollups.values():
+                for tier in tiers:
+                    tier.close()
+        return 0
+
+    def bot(self, token):
+        """
+        Runs the asyncio Telegram bot until stop_collection is called.
+        """
+        # Imported here, so collection alone never loads telebot and matplotlib.
+        from pressurebot.telegram_bot import run_bot
+
+        run_bot(self, token)
+
+    def add_stop_callback(self, callback):
+        """
+        Registers a function that stop_collection calls, e.g. to end the bot's event loop.
+        """
+        self.stop_callbacks.append(callback)
+
+    def remove_stop_callback(self, callback):
+        if callback in self.stop_callbacks:
+            self.stop_callbacks.remove(callback)
+
+    def add_alert_callback(self, callback):
+        """
+        Registers a function called with the text of every alert and all clear message.
+        It is called from the collection thread, so it must not block.
+        """
+        self.alert_callbacks.append(callback)
+
+    def remove_alert_callback(self, callback):
+        if callback in self.alert_callbacks:
+            self.alert_callbacks.remove(callback)
+
+    def add_reading_callback(self, callback):
+        """
+        Registers a function called with the (time, pressures, flags) snapshot of every
+        new reading. It is called from the collection thread, so it must not block.
+        """
+        self.reading_callbacks.append(callback)
+
+    def remove_reading_callback(self, callback):
+        if callback in self.reading_callbacks:
+            self.reading_callbacks.remove(callback)
+
+    def get_all_data(self, channel=None):
+        """
+        Returns list with copies of the stored pressure data and epoch times of a channel
+        (name or number, the first channel by default).
+        """
+        times, data = self.buffers[self.channel(channel).number].window()
+        return [data, times]
+
+    def get_range(self, start_time, end_time=None, channel=None):
+        """
+        Returns list with copies of the pressure data and epoch times of a channel between
+        start_time and end_time (epoch seconds).
+        """
+        times, data = self.buffers[self.channel(channel).number].get_range(start_time, end_time)
+        return [data, times]
+
+    def query(self, start_time, end_time=None, channel=None, max_rows=20000):
+        """
+        Returns list with the pressure data and epoch times of a channel between
+        start_time and end_time, from the finest resolution that covers the range in at
+        most max_rows rows: the raw readings, the per minute or the per hour rollup.
+
+        Rollup rows are returned as their min/max envelope, see rollup.envelope.
+        """
+        number = self.channel(channel).number
+        buffer = self.buffers[number]
+
+        # Oldest sample time of each resolution that has any, finest first.
+        tiers = [(buffer.oldest_time(), None)]
+        tiers += [(tier.oldest(), tier) for tier in self.rollups[number]]
+        tiers = [(oldest, tier) for oldest, tier in tiers if oldest is not None]
+        if not tiers:
+            return self.get_range(start_time, end_time, number)
+
+        # Finest resolution which reaches back to start_time, or holds all there is
+        # (e.g. just after a restart), and is small enough.
+        earliest = min(oldest for oldest, _ in tiers)
+        for oldest, tier in tiers:
+            if oldest > max(start_time, earliest):
+                continue
+            if tier is None:
+                times, data = buffer.get_range(start_time, end_time)
+                if len(data) <= max_rows:
+                    return [data, times]
+            else:
+                rows = tier.get_range(start_time, end_time)
+                if len(rows) <= max_rows:
+                    return envelope(rows, tier.interval)
+
+        # Otherwise fall back to the one reaching furthest back in time.
+        tier = min(tiers, key=lambda item: item[0])[1]
+        if tier is None:
+            return self.get_range(start_time, end_time, number)
+        return envelope(tier.get_range(start_time, end_time), tier.interval)
+
+    def get_latest_value(self, channel=None):
+        """
+        Returns the latest pressure of channel (name or number), the first by default.
+        """
+        with self.lock:
+            return self.latest_values[self.channel(channel).number]
+
+    def get_latest_time(self):
+        """
+        Returns the time of the latest reading, formatted by format_time.
+        """
+        with self.lock:
+            latest_time = self.latest_time
+        return None if latest_time is None else format_time(timestamp=latest_time)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Headless service: acquisition, storage, the Telegram bot, the local socket for the
+GUI and the HTTP/WebSocket API, without Tk. Started with
+
+    python -m pressurebot run
+
+and stopped with SIGTERM, Ctrl+C, the bot's /end or the GUI's stop button.
+"""
+
+import os
+import signal
+import threading
+
+from pressurebot.collector import DataCollector
+from pressurebot.pl1216 import load_device
+from pressurebot.ipc import DaemonServer, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_API_PORT
+from pressurebot.scheduler import SKIP
+
+
+def read_token(env_file='BOT_TOKEN.env'):
+    """
+    Returns the Telegram bot token from the BOT_TOKEN environment variable or env_file.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=env_file)
+    return os.getenv('BOT_TOKEN')
+
+
+def run(data_dir='.', sample_time=5, host=DEFAULT_HOST, port=DEFAULT_PORT, token=None,
+        api_port=DEFAULT_API_PORT, simulate=False, missed=SKIP, process=False, replay=None,
+        max_storage=1):
+    """
+    Runs the collector, the bot (if there is a token), the socket server and the
+    HTTP API (unless api_port is None) until stopped, on a simulated PL1216 if
+    simulate is True. missed is 'skip' or 'catchup', see pressurebot.scheduler. With
+    process, the PL1216 is read in a process of its own, see pressurebot.acquisition.
+    With a pressurebot.replay.Replay, its logged readings are replayed instead, on
+    its gauges and at its sample time. max_storage is the days of readings kept in
+    memory at full resolution. Returns 0 once everything has shut down.
+    """
+    stop_event = threading.Event()
+    channels = None
+    if replay is not None:
+        channels, sample_time, device = replay.channels, replay.sample_time, None
+    else:
+        # The acquisition process loads the picosdk driver itself.
+        device = load_device(simulate) if simulate or not process else None
+    collector = DataCollector(stop_event, channels=channels, sample_time=sample_time,
+                              max_storage=max_storage, data_dir=data_dir, device=device, missed=missed, process=process,
+                              replay=replay)
+    collector.load_history()
+
+    server = DaemonServer(collector, host, port)
+    collector.add_stop_callback(server.stop)
+
+    threads = [threading.Thread(target=collector.start_collection, name="collection"),
+               threading.Thread(target=server.serve_forever, name="socket server")]
+    if token:
+        threads.append(threading.Thread(target=collector.bot, args=[token], name="bot"))
+    else:
+        print("No BOT_TOKEN, running without the Telegram bot")
+    if api_port is not None:
+        from pressurebot import http_api
+
+        threads.append(threading.Thread(target=http_api.run_api, args=[collector, host, api_port],
+                                        name="http api"))
+
+    def on_signal(signum, frame):
+        print(f"Received signal {signum}, stopping")
+        collector.stop_collection()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, 'SIGBREAK'):  # Ctrl+Break, and closing the console on Windows.
+        signal.signal(signal.SIGBREAK, on_signal)
+
+    for thread in threads:
+        thread.start()
+    print(f"Serving on {host}:{port}")
+
+    # Join with a timeout, so the main thread stays free to run the signal handlers.
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+
+    server.server_close()
+    print("Stopped")
+    return 0
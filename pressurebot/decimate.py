@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Min/max decimation of time series for plotting.
+"""
+
+import numpy as np
+
+
+def minmax_decimate(times, values, n_bins, start_time=None, end_time=None):
+    """
+    Reduces a time series to at most 2 * n_bins points for plotting.
+
+    The time range is split into n_bins equal bins (one per pixel column), and the
+    minimum and maximum sample of each bin are kept in time order. Unlike taking
+    every n-th sample, this never hides a short pressure spike or a dip, which
+    matters on a log axis.
+
+    Parameters
+    ----------
+    times : numpy array
+        Sorted sample times.
+
+    values : numpy array
+        Sample values, same length as times.
+
+    n_bins : int
+        Number of bins, normally the axis width in pixels.
+
+    start_time, end_time : float, optional
+        Time range covered by the bins. Defaults to the first and last sample.
+
+    Returns
+    -------
+    times, values : numpy arrays
+        The decimated samples. The inputs are returned unchanged if they already
+        have no more than 2 * n_bins points.
+    """
+    n_bins = max(int(n_bins), 1)
+    if len(times) <= 2 * n_bins:
+        return times, values
+
+    start_time = times[0] if start_time is None else start_time
+    end_time = times[-1] if end_time is None else end_time
+
+    # Index of the first sample in each non-empty bin.
+    edges = np.linspace(start_time, end_time, n_bins + 1)[1:-1]
+    starts = np.unique(np.r_[0, np.searchsorted(times, edges, side='left')])
+    starts = starts[starts < len(times)]
+    counts = np.diff(np.r_[starts, len(times)])
+    bin_id = np.repeat(np.arange(len(starts)), counts)
+
+    def first_match(extreme):
+        # Position of the first sample in each bin equal to that bin's extreme.
+        matches = np.flatnonzero(values == np.repeat(extreme, counts))
+        matched_bins = bin_id[matches]
+        return matches[np.r_[True, matched_bins[1:] != matched_bins[:-1]]]
+
+    index = np.union1d(first_match(np.minimum.reduceat(values, starts)),
+                       first_match(np.maximum.reduceat(values, starts)))
+    return times[index], values[index]
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+"""
+Export and offline analysis of the pressure logs.
+
+The daily binary logs are memory mapped and read in chunks of CHUNK_ROWS readings,
+so a time range of any length is exported or summarised in bounded memory, and
+only the files of the days in range are opened. Exports keep the full float64
+precision of the logs, as
+
+    CSV      time (epoch seconds) and one column of mbar per gauge
+    Parquet  time (UTC timestamp) and one column per gauge, needs pyarrow
+    HDF5     "time" and "pressure" (readings x gauges) datasets, needs h5py
+
+Summaries (summarize) are computed chunk by chunk with vectorized NumPy: per gauge
+the min, max and mean, the time spent below a threshold, and the exponential time
+constant of every pump-down. Without binary logs, the old text log
+(pressure_data.txt) is read instead, for the first gauge. Readings migrated to
+the compressed archive (pressure_archive.pba) are read from it.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from pressurebot.storage import log_files, read_header, read_log, format_time
+from pressurebot.history import parse_text
+from pressurebot.channels import Channel, load_channels, find_channel
+from pressurebot.archive import ARCHIVE_NAME, Archive
+
+CHUNK_ROWS = 1 << 20  # Readings per chunk, 8 MB per column of float64.
+TEXT_CHUNK_SIZE = 1 << 24  # Bytes of the text log parsed at a time.
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.h5': 'hdf5', '.hdf5': 'hdf5'}
+
+
+def parse_time(text, now=None):
+    """
+    Parses a time given as epoch seconds, an ISO date or date and time in local time
+    (e.g. "2024-02-26" or "2024-02-26T15:30"), or a window before now (e.g. "7d").
+    Returns epoch seconds. Raises ValueError otherwise.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    from pressurebot.plotting import parse_window
+
+    seconds, _ = parse_window(text)
+    return (datetime.now().timestamp() if now is None else now) - seconds
+
+
+def log_day(filename):
+    """
+    Returns the date of a daily log file, from its name.
+    """
+    return datetime.strptime(os.path.basename(filename)[-14:-4], '%Y-%m-%d').date()
+
+
+def describe_range(start=None, end=None):
+    """
+    Returns e.g. "between 2024-02-26 00:00:00 and 2024-02-27 00:00:00" (local time),
+    for messages.
+    """
+    start, end = [None if value is None else datetime.fromtimestamp(value).isoformat(' ', 'seconds')
+                  for value in (start, end)]
+    if start is not None and end is not None:
+        return f"between {start} and {end}"
+    return f"since {start}" if start is not None else f"until {end}"
+
+
+def logs_in_range(folder, start=None, end=None):
+    """
+    Returns the binary log files in folder that can hold readings between start and
+    end (epoch seconds), oldest first.
+    """
+    # Files are named after the local day of their readings. Allow a day either side.
+    first = None if start is None else (datetime.fromtimestamp(start) - timedelta(days=1)).date()
+    last = None if end is None else (datetime.fromtimestamp(end) + timedelta(days=1)).date()
+    return [filename for filename in log_files(folder)
+            if (first is None or log_day(filename) >= first)
+            and (last is None or log_day(filename) <= last)]
+
+
+def log_channels(filenames):
+    """
+    Returns the PL1216 channel numbers of a list of log files, in order of first
+    appearance.
+    """
+    numbers = []
+    for filename in filenames:
+        numbers += [number for number in read_header(filename) if number not in numbers]
+    return numbers
+
+
+def log_chunks(filenames, start=None, end=None, numbers=None, chunk_rows=CHUNK_ROWS):
+    """
+    Yields [times, pressures] chunks of the readings between start and end (epoch
+    seconds, end included) in binary log files. pressures has a column per channel
+    number, NaN in files without that channel. All channels by default.
+    """
+    if numbers is None:
+        numbers = log_channels(filenames)
+
+    for filename in filenames:
+        file_numbers = read_header(filename)
+        columns = [file_numbers.index(number) if number in file_numbers else None
+                   for number in numbers]
+        if all(column is None for column in columns):
+            continue
+
+        records = read_log(filename)
+        first = 0 if start is None else np.searchsorted(records['time'], start)
+        last = len(records) if end is None else np.searchsorted(records['time'], end, 'right')
+
+        for index in range(first, last, chunk_rows):
+            block = records[index:min(index + chunk_rows, last)]
+            pressures = np.full((len(block), len(numbers)), np.nan)
+            for output, column in enumerate(columns):
+                if column is not None:
+                    pressures[:, output] = block['pressure'][:, column]
+            yield [np.array(block['time']), pressures]
+        del records
+
+
+def text_chunks(filename, start=None, end=None, chunk_size=TEXT_CHUNK_SIZE):
+    """
+    Yields [times, pressures] chunks of the readings between start and end in the
+    text log, pressures with one column. Values are as written, 3 significant
+    figures and clipped to 1000 mbar.
+    """
+    with open(filename, 'rb') as file:
+        remainder = b''
+        while True:
+            data = file.read(chunk_size)
+            chunk = remainder + data
+            # Keep the partial last line for the next chunk.
+            split = chunk.rfind(b'\n') + 1 if data else len(chunk)
+            chunk, remainder = chunk[:split], chunk[split:]
+            if chunk.strip():
+                times, pressures = parse_text(chunk)
+                keep = np.ones(len(times), dtype=bool)
+                if start is not None:
+                    keep &= times >= start
+                if end is not None:
+                    keep &= times <= end
+                if end is not None and len(times) and times[0] > end:
+                    return
+                if keep.any():
+                    yield [times[keep], pressures[keep, None]]
+            if not data:
+                return
+
+
+def select_channels(folder, start=None, end=None, keys=None, channels_file='channels.json'):
+    """
+    Returns [reading chunks, gauge names] of the logs in folder between start and
+    end, for the gauges keys (names or numbers, all by default). Names come from
+    channels_file, or are "ch<number>". If folder has an archive (see
+    pressurebot.archive), readings up to its last come from the archive, and the
+    logs only add the readings after it.
+
+    Raises ValueError if folder does not exist, has no logs or no readings between
+    start and end, or KeyError for an unknown gauge.
+    """
+    text_filename = os.path.join(folder, 'pressure_data.txt')
+    archive_filename = os.path.join(folder, ARCHIVE_NAME)
+    known = load_channels(channels_file) if os.path.exists(channels_file) else []
+
+    archive = Archive(archive_filename) if os.path.exists(archive_filename) else None
+    after = start
+    if archive is not None and len(archive):
+        after = np.nextafter(archive.index['last'].max(), np.inf)
+        after = after if start is None else max(after, start)
+    else:
+        archive = None
+    filenames = logs_in_range(folder, after, end)
+
+    if not filenames and archive is None:
+        if not os.path.exists(text_filename):
+            if not os.path.isdir(folder):
+                raise ValueError(f"No folder {folder}")
+            if log_files(folder):
+                raise ValueError(f"No readings in {folder} {describe_range(start, end)}")
+            raise ValueError(f"No pressure logs in {folder}")
+        name = known[0].name if known else 'pressure'
+        if keys and [find_channel(known, key).name if known else key for key in keys] != [name]:
+            raise KeyError(f"{text_filename} only has the first gauge")
+        return [text_chunks(text_filename, start, end), [name]]
+
+    numbers = log_channels(filenames)
+    if archive is not None:
+        numbers = archive.channels + [number for number in numbers if number not in archive.channels]
+    if keys:
+        selected = []
+        for key in keys:
+            if known:
+                selected.append(find_channel(known, key).number)
+            elif str(key).isdigit() and int(key) in numbers:
+                selected.append(int(key))
+            else:
+                raise KeyError(f"Unknown channel {key}")
+        numbers = selected
+    names = {channel.number: channel.name for channel in known}
+    if archive is None:
+        chunks = log_chunks(filenames, start, end, numbers)
+    else:
+        chunks = archive_chunks(archive, start, end, numbers, filenames, after, text_filename,
+                                load_channels(channels_file)[0].number)
+    return [chunks, [names.get(number, f"ch{number}") for number in numbers]]
+
+
+def archive_chunks(archive, start, end, numbers, filenames, after, text_filename, text_number):
+    """
+    Yields the [times, pressures] chunks of the archive between start and end, then
+    those of the binary log files (or else the text log, of channel text_number)
+    from after on.
+    """
+    yield from archive.chunks(start, end, numbers)
+    if filenames:
+        yield from log_chunks(filenames, after, end, numbers)
+    elif os.path.exists(text_filename) and text_number in numbers:
+        for times, pressures in text_chunks(text_filename, after, end):
+            columns = np.full((len(times), len(numbers)), np.nan)
+            columns[:, numbers.index(text_number)] = pressures[:, 0]
+            yield [times, columns]
+
+
+def select_gauges(folder, start=None, end=None, keys=None, channels_file='channels.json'):
+    """
+    Returns [reading chunks, Channels] of the gauges keys (all by default) in the logs
+    in folder between start and end, see select_channels, with the calibrations of
+    channels_file. Gauges not in it are PTR90s.
+    """
+    chunks, names = select_channels(folder, start, end, keys, channels_file)
+    known = {channel.name: channel for channel in load_channels(channels_file)}
+    channels = []
+    for name in names:
+        if name in known:
+            channels.append(known[name])
+        elif name.startswith('ch') and name[2:].isdigit():
+            channels.append(Channel(int(name[2:])))
+        else:
+            # The one gauge of the text log.
+            channels.append(next(iter(known.values())))
+    return [chunks, channels]
+
+
+class CSVWriter:
+    """
+    Writes readings as CSV: time in epoch seconds, then mbar per gauge, full precision.
+    """
+
+    ROWS = 10000  # Formatted at a time.
+
+    def __init__(self, filename, names):
+        self.file = sys.stdout if filename == '-' else open(filename, 'w', newline='')
+        self.file.write(",".join(['time'] + list(names)) + "\n")
+        # %r of a float is the shortest text that reads back as the same float.
+        self.row = ",".join(['%.6f'] + ['%r'] * len(names)) + "\n"
+
+    def write(self, times, pressures):
+        # One % per block of rows, rather than per row as np.savetxt does.
+        values = np.column_stack([times, pressures])
+        for index in range(0, len(values), self.ROWS):
+            block = values[index:index + self.ROWS]
+            self.file.write((self.row * len(block)) % tuple(block.ravel().tolist()))
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes readings to Parquet, one row group per chunk.
+    """
+
+    def __init__(self, filename, names):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from None
+
+        self.pa = pa
+        self.names = list(names)
+        self.schema = pa.schema([('time', pa.timestamp('us', tz='UTC'))]
+                                + [(name, pa.float64()) for name in self.names])
+        self.writer = pq.ParquetWriter(filename, self.schema, compression='zstd')
+
+    def write(self, times, pressures):
+        pa = self.pa
+        columns = [pa.array(np.round(times * 1e6).astype('datetime64[us]'),
+                            type=self.schema.field('time').type)]
+        columns += [pa.array(pressures[:, column]) for column in range(len(self.names))]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class HDF5Writer:
+    """
+    Writes readings to HDF5: a "time" dataset of epoch seconds, and a "pressure"
+    dataset of readings x gauges in mbar, with the gauge names as an attribute.
+    """
+
+    def __init__(self, filename, names):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("HDF5 export needs h5py: pip install h5py") from None
+
+        self.file = h5py.File(filename, 'w')
+        n = len(names)
+        self.time = self.file.create_dataset('time', shape=(0,), maxshape=(None,), dtype='<f8',
+                                             chunks=(65536,), compression='gzip')
+        self.pressure = self.file.create_dataset('pressure', shape=(0, n), maxshape=(None, n),
+                                                 dtype='<f8', chunks=(65536, n),
+                                                 compression='gzip')
+        self.time.attrs['units'] = 'seconds since 1970-01-01 00:00 UTC'
+        self.pressure.attrs['units'] = 'mbar'
+        self.pressure.attrs['gauges'] = list(names)
+
+    def write(self, times, pressures):
+        n = len(self.time)
+        self.time.resize((n + len(times),))
+        self.time[n:] = times
+        self.pressure.resize((n + len(times), pressures.shape[1]))
+        self.pressure[n:] = pressures
+
+    def close(self):
+        self.file.close()
+
+
+WRITERS = {'csv': CSVWriter, 'parquet': ParquetWriter, 'hdf5': HDF5Writer}
+
+
+def export(folder, filename, start=None, end=None, keys=None, format=None):
+    """
+    Writes the readings of the gauges keys (all by default) between start and end
+    (epoch seconds) in the logs in folder to filename ('-' for CSV to stdout), as
+    format ('csv', 'parquet' or 'hdf5', from the file extension by default).
+    Returns the number of readings written.
+    """
+    if format is None:
+        format = FORMATS.get(os.path.splitext(filename)[1].lower(), 'csv')
+    chunks, names = select_channels(folder, start, end, keys)
+
+    writer = WRITERS[format](filename, names)
+    n_rows = 0
+    try:
+        for times, pressures in chunks:
+            writer.write(times, pressures)
+            n_rows += len(times)
+    finally:
+        writer.close()
+    return n_rows
+
+
+class PumpDown:
+    """
+    Least squares fit of ln(pressure) against time over the first `window` seconds
+    after a gauge fell through the pump-down start pressure. The time constant is
+    -1 / slope.
+    """
+
+    def __init__(self, start_time, window):
+        self.start_time = start_time
+        self.end_time = start_time + window
+        self.n = 0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        self.reached = None  # Seconds until the pressure got below the threshold.
+
+    def add(self, times, log_pressures):
+        t = times - self.start_time
+        self.n += len(t)
+        self.sum_t += t.sum()
+        self.sum_v += log_pressures.sum()
+        self.sum_tt += (t * t).sum()
+        self.sum_tv += (t * log_pressures).sum()
+
+    def time_constant(self):
+        denominator = self.n * self.sum_tt - self.sum_t ** 2
+        if self.n < 3 or denominator <= 0:
+            return None
+        slope = (self.n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+        return -1 / slope if slope < 0 else None
+
+
+class Summary:
+    """
+    Statistics of one gauge, accumulated chunk by chunk.
+
+    Parameters
+    ----------
+    name : str
+
+    threshold : float
+        Pressure (mbar) to total the time spent below.
+
+    max_gap : float
+        Longest time between readings (seconds) taken as continuous. Longer gaps, e.g.
+        when collection was stopped, count as no data.
+
+    pumpdown_start : float
+        Pressure (mbar) a pump-down starts at, when the gauge falls through it.
+
+    pumpdown_window : float
+        Seconds after the start fitted for the pump-down time constant.
+    """
+
+    def __init__(self, name, threshold=1e-6, max_gap=60, pumpdown_start=100, pumpdown_window=600):
+        self.name = name
+        self.threshold = threshold
+        self.max_gap = max_gap
+        self.pumpdown_start = pumpdown_start
+        self.pumpdown_window = pumpdown_window
+
+        self.count = 0
+        self.first_time = self.last_time = None
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum = 0.0
+        self.covered = 0.0  # Seconds with readings.
+        self.below = 0.0  # Of which below threshold.
+        self.pumpdowns = []
+        self.previous = None  # (time, pressure) of the last reading of the previous chunk.
+
+    def add(self, times, pressures):
+        valid = ~np.isnan(pressures)
+        times, pressures = times[valid], pressures[valid]
+        if not len(times):
+            return
+
+        self.count += len(times)
+        if self.first_time is None:
+            self.first_time = times[0]
+        self.last_time = times[-1]
+        self.min = min(self.min, pressures.min())
+        self.max = max(self.max, pressures.max())
+        self.sum += pressures.sum()
+
+        # Join on to the previous chunk, so intervals and crossings between them count.
+        joined = self.previous is not None
+        if joined:
+            times = np.concatenate([[self.previous[0]], times])
+            pressures = np.concatenate([[self.previous[1]], pressures])
+        self.previous = (times[-1], pressures[-1])
+
+        # Each reading holds until the next one, unless the gap is too long.
+        intervals = np.diff(times)
+        intervals[intervals > self.max_gap] = 0
+        self.covered += intervals.sum()
+        self.below += intervals[pressures[:-1] < self.threshold].sum()
+
+        # Pump-downs start where the pressure falls through pumpdown_start.
+        crossings = np.flatnonzero((pressures[:-1] >= self.pumpdown_start)
+                                   & (pressures[1:] < self.pumpdown_start)) + 1
+        self.pumpdowns += [PumpDown(times[index], self.pumpdown_window) for index in crossings]
+
+        below = np.flatnonzero(pressures < self.threshold)
+        for pumpdown in self.pumpdowns:
+            if pumpdown.end_time < times[0] and pumpdown.reached is not None:
+                continue
+            # The joined reading of the previous chunk was fitted with that chunk.
+            first = max(np.searchsorted(times, pumpdown.start_time), int(joined))
+            last = np.searchsorted(times, pumpdown.end_time)
+            if last > first:
+                pumpdown.add(times[first:last], np.log(np.maximum(pressures[first:last], 1e-300)))
+            if pumpdown.reached is None:
+                index = np.searchsorted(below, first)
+                if index < len(below):
+                    pumpdown.reached = times[below[index]] - pumpdown.start_time
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def describe(self):
+        """
+        Returns a few lines of text describing the statistics.
+        """
+        if not self.count:
+            return f"{self.name}: no readings"
+        lines = [f"{self.name}: {self.count} readings from {format_time(timestamp=self.first_time)}"
+                 f" to {format_time(timestamp=self.last_time)}",
+                 f"  min {self.min:.3e}  max {self.max:.3e}  mean {self.mean():.3e} mbar",
+                 f"  below {self.threshold:g} mbar for {timedelta(seconds=round(self.below))}"
+                 f" of {timedelta(seconds=round(self.covered))} with readings"]
+        for pumpdown in self.pumpdowns:
+            tau = pumpdown.time_constant()
+            reached = ("not reached" if pumpdown.reached is None
+                       else f"after {timedelta(seconds=round(pumpdown.reached))}")
+            lines.append(f"  pump-down at {format_time(timestamp=pumpdown.start_time)}: time constant "
+                         f"{'-' if tau is None else f'{tau:.1f} s'}, {self.threshold:g} mbar {reached}")
+        return "\n".join(lines)
+
+
+def summarize(folder, start=None, end=None, keys=None, **options):
+    """
+    Returns a Summary of each of the gauges keys (all by default) between start and
+    end (epoch seconds) in the logs in folder. options are passed to Summary.
+    """
+    chunks, names = select_channels(folder, start, end, keys)
+    summaries = [Summary(name, **options) for name in names]
+    for times, pressures in chunks:
+        for column, summary in enumerate(summaries):
+            summary.add(times, pressures[:, column])
+    return summaries
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Fast loading of the recent pressure history from disk, used to refill the in-memory
+buffers on start up.
+
+Binary logs are memory mapped. The text log (pressure_data.txt) is read backwards
+from its end in large chunks, and each chunk is parsed with vectorized numpy
+operations instead of line by line, so only the requested tail is ever read.
+"""
+
+import os
+from datetime import datetime
+
+import numpy as np
+
+from pressurebot.storage import log_files, read_header, read_log
+
+CHUNK_SIZE = 1 << 22  # Bytes read from the text log at a time.
+LINE_LENGTH = 29  # Length of a "1.23e-07 2024:02:26 15:33:10\n" line.
+
+
+def local2epoch(local_seconds):
+    """
+    Converts naive local time (seconds since 1970-01-01 00:00 local) to epoch seconds.
+    The UTC offset is looked up once per day, not once per sample.
+    """
+    days, index = np.unique(local_seconds // 86400, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(day * 86400 + 43200).astimezone()
+                        .utcoffset().total_seconds() for day in days])
+    return local_seconds - offsets[index.ravel()]
+
+
+def parse_text(chunk):
+    """
+    Parses whole lines of the text log format. Returns (times, pressures) arrays.
+    """
+    data = np.frombuffer(chunk, dtype=np.uint8)
+
+    if len(data) % LINE_LENGTH == 0 and np.all(data[LINE_LENGTH - 1::LINE_LENGTH] == 10):
+        # Every line has the standard fixed width: slice the fields straight out.
+        lines = data.reshape(-1, LINE_LENGTH)
+        pressures = np.ascontiguousarray(lines[:, :8]).view('S8').ravel()
+        stamps = np.array(lines[:, 9:28])  # A writable copy, even for a single line.
+    else:
+        # Fall back to splitting lines, e.g. for values written without the 1000 mbar clip.
+        # Lines cut short (by a crash or power cut while writing) are skipped.
+        fields = [line.split() for line in chunk.splitlines() if line.count(b' ') == 2]
+        fields = np.array([line for line in fields if len(line) == 3 and len(line[1]) == 10
+                           and len(line[2]) == 8], dtype='S19').reshape(-1, 3)
+        pressures = fields[:, 0]
+        stamps = np.char.add(np.char.add(fields[:, 1], b' '), fields[:, 2])
+        stamps = stamps.astype('S19').view(np.uint8).reshape(-1, 19).copy()
+
+    # 'YYYY:MM:DD HH:MM:SS' -> 'YYYY-MM-DDTHH:MM:SS', which numpy parses directly.
+    stamps[:, [4, 7]] = ord('-')
+    stamps[:, 10] = ord('T')
+    local_seconds = stamps.view('S19').ravel().astype('datetime64[s]').astype(np.int64)
+    return local2epoch(local_seconds).astype(np.float64), pressures.astype(np.float64)
+
+
+def load_text_history(filename, since=None):
+    """
+    Reads the readings newer than since (epoch seconds) from the end of a text log.
+
+    Returns
+    -------
+    times, pressures : numpy arrays
+    """
+    times, pressures = [], []
+
+    with open(filename, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        remainder = b''
+
+        while position > 0:
+            size = min(CHUNK_SIZE, position)
+            position -= size
+            file.seek(position)
+            chunk = file.read(size) + remainder
+
+            # Keep the partial first line for the next (earlier) chunk.
+            if position > 0:
+                split = chunk.index(b'\n') + 1 if b'\n' in chunk else len(chunk)
+                remainder, chunk = chunk[:split], chunk[split:]
+            if not chunk.strip():
+                continue
+
+            chunk_times, chunk_pressures = parse_text(chunk)
+            if not len(chunk_times):
+                # Only lines cut short, e.g. by a crash while writing.
+                continue
+            times.append(chunk_times)
+            pressures.append(chunk_pressures)
+
+            if since is not None and chunk_times[0] < since:
+                break
+
+    if not times:
+        return np.zeros(0), np.zeros(0)
+
+    times = np.concatenate(times[::-1])
+    pressures = np.concatenate(pressures[::-1])
+    first = 0 if since is None else np.searchsorted(times, since)
+    return times[first:], pressures[first:]
+
+
+def load_binary_history(folder='.', since=None, channel=None):
+    """
+    Reads the readings of one channel (PL1216 channel number, the first column by
+    default) newer than since (epoch seconds) from the daily binary logs. Only the
+    files of the days in range are opened.
+
+    Returns
+    -------
+    times, pressures : numpy arrays
+    """
+    times, pressures = [], []
+
+    for filename in reversed(log_files(folder)):
+        channels = read_header(filename)
+        if channel is not None and channel not in channels:
+            continue
+        column = 0 if channel is None else channels.index(channel)
+
+        records = read_log(filename)
+        if not len(records):
+            continue
+
+        first = 0 if since is None else np.searchsorted(records['time'], since)
+        times.append(np.array(records['time'][first:]))
+        pressures.append(np.array(records['pressure'][first:, column]))
+
+        if first > 0:
+            break
+
+    if not times:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(times[::-1]), np.concatenate(pressures[::-1])
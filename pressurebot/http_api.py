@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP and WebSocket API of the pressure data, for other lab tools.
+
+    GET /channels     [{"number": 16, "name": "chamber"}, ...]
+    GET /latest       {"time": ..., "pressures": {"chamber": ...}, "flags": {"chamber": 0}}
+    GET /range?start=...&end=...&channel=...&bins=...&format=json|npy
+                      Readings of one channel between two epoch times (end defaults
+                      to now), optionally min/max decimated to `bins`. format=npy
+                      returns a NumPy .npy file of a structured array with "time"
+                      and "pressure" fields, e.g. np.load(io.BytesIO(response.content)).
+    GET /ws           WebSocket. Sends {"time", "pressures", "flags"} for every new
+                      reading, as /latest.
+    GET /metrics      Timings and counters of the daemon in the Prometheus text format,
+                      see pressurebot.metrics.
+
+Pressures that are not finite (NaN, e.g. of a failed reading) are sent as null,
+as JSON has no NaN.
+
+Every reading is read from the PL1216 once, by the collection thread, and fanned out
+to the WebSocket subscribers from one event loop. Each subscriber has a bounded queue:
+when a client reads too slowly, its oldest readings are dropped (and counted in a
+"dropped" field of the next message), so a slow client never holds up the others,
+the collector, or the server's memory.
+"""
+
+import io
+import json
+import time
+import asyncio
+import functools
+
+import numpy as np
+from aiohttp import web, WSMsgType, WSCloseCode
+
+from pressurebot.decimate import minmax_decimate
+from pressurebot.ipc import DEFAULT_HOST, DEFAULT_API_PORT as DEFAULT_PORT
+from pressurebot import metrics
+
+# Readings queued per WebSocket subscriber before the oldest are dropped.
+SUBSCRIBER_QUEUE = 100
+
+RANGE_DTYPE = np.dtype([('time', '<f8'), ('pressure', '<f8')])
+
+# Raises on NaN rather than send invalid JSON, see json_values.
+JSON_DUMPS = functools.partial(json.dumps, allow_nan=False)
+
+DROPPED = metrics.counter('pressurebot_api_dropped_readings_total',
+                          'Readings dropped from the queues of slow WebSocket subscribers')
+
+
+def json_values(values):
+    """
+    Returns values as a list, with None (null) in place of NaN and infinite values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = values.tolist()
+    for index in np.flatnonzero(~np.isfinite(values)):
+        result[index] = None
+    return result
+
+
+class Subscriber:
+    """
+    One WebSocket client, with its own bounded queue of readings.
+    """
+
+    def __init__(self, ws, size=SUBSCRIBER_QUEUE):
+        self.ws = ws
+        self.queue = asyncio.Queue(size)
+        self.dropped = 0
+
+    def put(self, message):
+        # Drop the oldest reading rather than block the fan out or grow without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            DROPPED.inc()
+        self.queue.put_nowait(message)
+
+
+class PressureAPI:
+    """
+    HTTP and WebSocket server of a DataCollector.
+
+    Parameters
+    ----------
+    collector : DataCollector
+
+    host, port : optional
+        Address to listen on. Only localhost by default.
+    """
+
+    def __init__(self, collector, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.collector = collector
+        self.host = host
+        self.port = port
+        self.subscribers = set()
+        self.loop = None
+        self.stopped = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/channels', self.channels)
+        self.app.router.add_get('/latest', self.latest)
+        self.app.router.add_get('/range', self.range)
+        self.app.router.add_get('/ws', self.websocket)
+        self.app.router.add_get('/metrics', self.prometheus)
+
+    def reading_json(self, snapshot):
+        if snapshot is None:
+            return None
+        time_stamp, pressures, flags = snapshot
+        names = [channel.name for channel in self.collector.channels]
+        return {"time": time_stamp, "pressures": dict(zip(names, json_values(pressures))),
+                "flags": dict(zip(names, flags))}
+
+    async def channels(self, request):
+        return web.json_response([{"number": channel.number, "name": channel.name}
+                                  for channel in self.collector.channels])
+
+    async def latest(self, request):
+        return web.json_response(self.reading_json(self.collector.snapshot), dumps=JSON_DUMPS)
+
+    async def prometheus(self, request):
+        return web.Response(text=metrics.prometheus_text(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def range(self, request):
+        query = request.query
+        try:
+            start_time = float(query['start'])
+            end_time = float(query['end']) if 'end' in query else time.time()
+            channel = self.collector.channel(query.get('channel'))
+            bins = int(query['bins']) if 'bins' in query else None
+        except KeyError as e:
+            raise web.HTTPBadRequest(text=f"Missing or unknown {e}")
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        data, times = self.collector.query(start_time, end_time, channel.number)
+        if bins:
+            times, data = minmax_decimate(times, data, bins, start_time, end_time)
+
+        if query.get('format', 'json') == 'npy':
+            readings = np.empty(len(times), dtype=RANGE_DTYPE)
+            readings['time'], readings['pressure'] = times, data
+            body = io.BytesIO()
+            np.save(body, readings)
+            return web.Response(body=body.getvalue(), content_type='application/octet-stream')
+
+        return web.json_response({"channel": channel.name, "times": np.asarray(times).tolist(),
+                                  "pressures": json_values(data)}, dumps=JSON_DUMPS)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        subscriber = Subscriber(ws)
+        self.subscribers.add(subscriber)
+        # Only this task reads from the client, to notice it closing.
+        receiving = asyncio.ensure_future(ws.receive())
+        try:
+            while not ws.closed:
+                sending = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait([sending, receiving], return_when=asyncio.FIRST_COMPLETED)
+                if receiving in done:
+                    sending.cancel()
+                    if receiving.result().type in (WSMsgType.CLOSE, WSMsgType.CLOSING,
+                                                   WSMsgType.CLOSED, WSMsgType.ERROR):
+                        break
+                    receiving = asyncio.ensure_future(ws.receive())
+                    continue
+
+                message = sending.result()
+                if subscriber.dropped:
+                    message = dict(message, dropped=subscriber.dropped)
+                    subscriber.dropped = 0
+                await ws.send_json(message, dumps=JSON_DUMPS)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            receiving.cancel()
+            await ws.close()
+        return ws
+
+    def publish(self, snapshot):
+        """
+        Reading callback of the collector: hands the reading to the event loop.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.fan_out, snapshot)
+
+    def fan_out(self, snapshot):
+        message = self.reading_json(snapshot)
+        for subscriber in self.subscribers:
+            subscriber.put(message)
+
+    def stop(self):
+        """
+        Stops run(). Safe to call from any thread.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def run(self):
+        """
+        Serves until stop() is called (DataCollector.stop_collection calls it).
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.collector.add_stop_callback(self.stop)
+        self.collector.add_reading_callback(self.publish)
+        if self.collector.stop_event.is_set():
+            self.stopped.set()
+
+        runner = web.AppRunner(self.app, shutdown_timeout=1)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+            print(f"HTTP API on http://{self.host}:{self.port}")
+            await self.stopped.wait()
+        finally:
+            self.collector.remove_reading_callback(self.publish)
+            self.collector.remove_stop_callback(self.stop)
+            for subscriber in list(self.subscribers):
+                await subscriber.ws.close(code=WSCloseCode.GOING_AWAY, message=b"Server stopping")
+            await runner.cleanup()
+
+
+def run_api(collector, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Runs a PressureAPI in a new event loop, until the collector is stopped.
+    """
+    asyncio.run(PressureAPI(collector, host, port).run())
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Local socket interface of the daemon, used by the GUI.
+
+Clients connect over TCP to localhost and exchange one JSON object per line. Each
+request line gets one response line:
+
+    {"cmd": "info"}      channels, sample time and whether collection is running
+    {"cmd": "latest"}    {"time": ..., "pressures": [...], "flags": [...]} or null
+    {"cmd": "query", "start": ..., "end": ..., "channel": ..., "bins": ...}
+                         {"times": [...], "data": [...]}, min/max decimated to
+                         `bins` if given (see DataCollector.query)
+    {"cmd": "stop"}      stops collection, the bot and the daemon
+    {"cmd": "subscribe"} {"ok": true}, then a line like "latest" for every new reading
+
+Errors are returned as {"error": "..."}.
+"""
+
+import json
+import queue
+import socket
+import threading
+import socketserver
+
+import numpy as np
+
+from pressurebot.decimate import minmax_decimate
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 51216
+# Of the HTTP API (pressurebot.http_api), kept here so the daemon and command line
+# don't import aiohttp unless the API is run.
+DEFAULT_API_PORT = 8216
+
+# Readings queued for a slow subscriber before the oldest are dropped.
+SUBSCRIBER_QUEUE = 1000
+
+
+def snapshot_to_json(snapshot):
+    if snapshot is None:
+        return None
+    time_stamp, pressures, flags = snapshot
+    return {"time": time_stamp, "pressures": list(pressures), "flags": list(flags)}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                command = request.pop("cmd")
+                if command == "subscribe":
+                    self.stream()
+                    return
+                response = self.server.respond(command, **request)
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+
+            try:
+                self.send(response)
+            except OSError:
+                return
+
+    def send(self, response):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+        self.wfile.flush()
+
+    def stream(self):
+        """
+        Sends every new reading until the client disconnects or the daemon stops.
+        """
+        readings = queue.Queue(SUBSCRIBER_QUEUE)
+
+        def on_reading(snapshot):
+            # Called from the collection thread: never block it on a slow client.
+            while True:
+                try:
+                    readings.put_nowait(snapshot)
+                    return
+                except queue.Full:
+                    try:
+                        readings.get_nowait()
+                    except queue.Empty:
+                        pass
+
+        collector = self.server.collector
+        collector.add_reading_callback(on_reading)
+        try:
+            self.send({"ok": True})
+            while not self.server.stopped.is_set():
+                try:
+                    snapshot = readings.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.send(snapshot_to_json(snapshot))
+        except OSError:
+            pass
+        finally:
+            collector.remove_reading_callback(on_reading)
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    """
+    Serves a DataCollector to local clients, one thread per connection.
+
+    Parameters
+    ----------
+    collector : DataCollector
+
+    host, port : optional
+        Address to listen on. Only localhost by default.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, collector, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super().__init__((host, port), RequestHandler)
+        self.collector = collector
+        self.stopped = threading.Event()
+
+    def respond(self, command, **params):
+        collector = self.collector
+        if command == "info":
+            return {"channels": [{"number": channel.number, "name": channel.name}
+                                 for channel in collector.channels],
+                    "sample_time": collector.sample_time,
+                    "running": not collector.stop_event.is_set()}
+
+        if command == "latest":
+            return snapshot_to_json(collector.snapshot)
+
+        if command == "query":
+            return self.query(**params)
+
+        if command == "stop":
+            collector.stop_collection()
+            return {"ok": True}
+
+        raise ValueError(f"Unknown command {command!r}")
+
+    def query(self, start, end=None, channel=None, bins=None):
+        data, times = self.collector.query(start, end, channel)
+        if bins and len(times):
+            end = times[-1] if end is None else end
+            times, data = minmax_decimate(times, data, bins, start, end)
+        return {"times": np.asarray(times).tolist(), "data": np.asarray(data).tolist()}
+
+    def stop(self):
+        """
+        Stops serve_forever, from any thread other than the one running it.
+        """
+        self.stopped.set()
+        threading.Thread(target=self.shutdown).start()
+
+
+class DaemonClient:
+    """
+    Connection to a running daemon.
+
+    Requests raise ConnectionError if the daemon is not running (any more), and
+    RuntimeError if it returns an error.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.file = None
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        return sock.makefile('rwb')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def request(self, command, **params):
+        with self.lock:
+            try:
+                if self.file is None:
+                    self.file = self.connect()
+                self.file.write(json.dumps(dict(cmd=command, **params)).encode() + b"\n")
+                self.file.flush()
+                line = self.file.readline()
+            except OSError as e:
+                self.file = None
+                raise ConnectionError(f"Daemon not running at {self.address}") from e
+
+            if not line:
+                self.file = None
+                raise ConnectionError(f"Daemon at {self.address} closed the connection")
+
+        response = json.loads(line)
+        if isinstance(response, dict) and "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def info(self):
+        return self.request("info")
+
+    def latest(self):
+        """
+        Returns the latest (time, pressures, flags) snapshot, or None.
+        """
+        response = self.request("latest")
+        return None if response is None else (
+            response["time"], tuple(response["pressures"]), tuple(response["flags"]))
+
+    def query(self, start_time, end_time=None, channel=None, bins=None):
+        """
+        Returns list of the pressure data and epoch times between start_time and
+        end_time, decimated to `bins` min/max pairs if given.
+        """
+        response = self.request("query", start=start_time, end=end_time, channel=channel, bins=bins)
+        return [np.array(response["data"]), np.array(response["times"])]
+
+    def stop(self):
+        return self.request("stop")
+
+    def subscribe(self, callback):
+        """
+        Calls callback with the (time, pressures, flags) snapshot of every new reading,
+        from a background thread, and with None once the daemon has gone.
+        Raises ConnectionError if the daemon is not running.
+        """
+        try:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            file = sock.makefile('rwb')
+            file.write(b'{"cmd": "subscribe"}\n')
+            file.flush()
+            file.readline()
+        except OSError as e:
+            raise ConnectionError(f"Daemon not running at {self.address}") from e
+
+        # Readings can be sample_time apart, so wait for them indefinitely.
+        sock.settimeout(None)
+
+        def receive():
+            try:
+                for line in file:
+                    snapshot = json.loads(line)
+                    callback((snapshot["time"], tuple(snapshot["pressures"]),
+                              tuple(snapshot["flags"])))
+            except OSError:
+                pass
+            finally:
+                file.close()
+                callback(None)
+
+        threading.Thread(target=receive, daemon=True).start()
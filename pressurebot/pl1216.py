@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+PicoLog Data Logger 1216 (PL1216) acquisition.
+
+The device is any object with the pl1000* functions of picosdk.pl1000.pl1000: the
+picosdk driver by default, or simulator.SimulatedPL1216 to run without the hardware.
+"""
+
+import ctypes
+
+import numpy as np
+
+PICO_OK = 0
+
+
+def picosdk_device():
+    """
+    Returns the picosdk PL1000 driver. Imported on first use, so the rest of the
+    package (and the simulator) works without picosdk installed.
+    """
+    from picosdk.pl1000 import pl1000
+
+    return pl1000
+
+
+def load_device(simulate=False):
+    """
+    Returns the PL1216 driver, or a simulated PL1216.
+    """
+    if simulate:
+        from pressurebot.simulator import SimulatedPL1216
+
+        return SimulatedPL1216()
+    return picosdk_device()
+
+
+def assert_pico_ok(status):
+    """
+    Raises RuntimeError if a pl1000 function returned an error status.
+    """
+    if status != PICO_OK:
+        raise RuntimeError(f"PL1216 returned status {status}")
+
+
+class StreamingReader:
+    """
+    Continuous streaming acquisition from one or more PL1216 channels.
+
+    The device is started once in BM_STREAM mode and keeps scanning all channels.
+    Every call to read() drains all the samples captured since the previous call
+    into the same preallocated buffer with a single pl1000GetValues call, and
+    returns the mean ADC count of each channel, so there is no dead time between
+    readings and no sleep waiting for a block to finish.
+
+    Parameters
+    ----------
+    channels : list of int, optional
+        Data Logger input channels, each between 1 and 16. [16] by default.
+
+    sample_rate : int, optional
+        Device samples per second, per channel.
+
+    max_period : float, optional
+        Longest expected time between read() calls, in seconds. Sets the size of
+        the read buffer. Samples beyond it are left for the next read().
+
+    device : optional
+        pl1000 functions to use, the picosdk driver by default. See load_device.
+    """
+
+    def __init__(self, channels=(16,), sample_rate=1000, max_period=10, device=None):
+        self.device = picosdk_device() if device is None else device
+        self.channels = list(channels)
+        self.sample_rate = sample_rate
+        self.chandle = ctypes.c_int16()
+        self.status = {}
+
+        # Read buffer of interleaved channel samples, also seen by numpy without a copy.
+        self.buffer_size = int(sample_rate * max_period)  # Samples per channel.
+        self.values = (ctypes.c_uint16 * (self.buffer_size * len(self.channels)))()
+        self.counts = np.ctypeslib.as_array(self.values).reshape(-1, len(self.channels))
+        self.noOfValues = ctypes.c_uint32(self.buffer_size)
+        self.overflow = ctypes.c_uint16()
+
+    def open(self):
+        """
+        Opens the PL1216 and starts streaming.
+        """
+        pl = self.device
+        self.status["openUnit"] = pl.pl1000OpenUnit(ctypes.byref(self.chandle))
+        assert_pico_ok(self.status["openUnit"])
+
+        # One second blocks of sample_rate scans of all channels.
+        usForBlock = ctypes.c_uint32(1000000)
+        channels = (ctypes.c_int16 * len(self.channels))(*self.channels)
+        self.status["setInterval"] = pl.pl1000SetInterval(
+            self.chandle, ctypes.byref(usForBlock), self.sample_rate, channels, len(self.channels))
+        assert_pico_ok(self.status["setInterval"])
+
+        # The driver keeps up to buffer_size scans between reads.
+        mode = pl.PL1000_BLOCK_METHOD["BM_STREAM"]
+        self.status["run"] = pl.pl1000Run(self.chandle, self.buffer_size, mode)
+        assert_pico_ok(self.status["run"])
+
+    def read(self):
+        """
+        Returns [mean ADC count of each channel (numpy array), number of scans] of the
+        samples captured since the last read. The counts are None if no samples
+        were ready yet.
+        """
+        self.noOfValues.value = self.buffer_size
+        self.status["getValues"] = self.device.pl1000GetValues(
+            self.chandle, ctypes.byref(self.values), ctypes.byref(self.noOfValues),
+            ctypes.byref(self.overflow), None)
+        assert_pico_ok(self.status["getValues"])
+
+        n = self.noOfValues.value
+        if n == 0:
+            return [None, 0]
+        return [self.counts[:n].mean(axis=0), n]
+
+    def close(self):
+        self.status["stop"] = self.device.pl1000Stop(self.chandle)
+        self.status["closeUnit"] = self.device.pl1000CloseUnit(self.chandle)
+        assert_pico_ok(self.status["closeUnit"])
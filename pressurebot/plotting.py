@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Headless pressure charts for the bot.
+
+render_png draws the same log scale chart as the GUI with the Agg backend, without
+Tk or pyplot, so it can run in a worker process. ChartCache renders each chart once
+per reading of the collector, however many chats ask for it.
+"""
+
+import io
+import re
+import time
+import asyncio
+from datetime import datetime
+
+import numpy as np
+
+from pressurebot.decimate import minmax_decimate
+from pressurebot import metrics
+
+# Chart size in inches, and resolution. 8 x 5 in at 100 dpi matches the GUI.
+FIGURE_SIZE = (8, 5)
+DPI = 100
+
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+WINDOW_NAMES = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+PLOT_RENDER = metrics.histogram('pressurebot_plot_render_seconds',
+                                'Time to query, decimate and draw a /plot chart')
+
+
+def utc_offsets(times):
+    """
+    Returns the local UTC offset in seconds at each of times (epoch seconds), so that
+    times either side of a DST change each get their own. Looked up once per quarter
+    hour, on which DST changes fall.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    quarters = np.floor(times / 900)
+    valid = np.isfinite(quarters)
+    if not valid.any():
+        return np.zeros(times.shape)
+    if not valid.all():
+        quarters = np.where(valid, quarters, quarters[valid][0])
+    first, last = quarters.min(), quarters.max()
+    if last - first < quarters.size:
+        # Every quarter hour of the span, without sorting many readings.
+        index = (quarters - first).astype(np.int64)
+        quarters = np.arange(first, last + 1)
+    else:
+        quarters, index = np.unique(quarters, return_inverse=True)
+    offsets = np.array([time.localtime(quarter * 900).tm_gmtoff for quarter in quarters],
+                       dtype=np.float64)
+    return offsets[index].reshape(times.shape)
+
+
+def epoch2num(times):
+    """
+    Converts epoch seconds to local time Matplotlib date numbers, for plotting.
+    """
+    import matplotlib.dates
+
+    times = np.asarray(times, dtype=np.float64)
+    return matplotlib.dates.date2num(((times + utc_offsets(times)) * 1e3).astype('datetime64[ms]'))
+
+
+def num2epoch(nums):
+    """
+    Converts local time Matplotlib date numbers back to epoch seconds.
+    """
+    import matplotlib.dates
+
+    zero = matplotlib.dates.date2num(np.datetime64(0, 'ms'))
+    local = (np.asarray(nums, dtype=np.float64) - zero) * 86400
+    # The offset at the local time taken as epoch seconds is off by an hour around a
+    # DST change, the offset at that first guess is not.
+    return local - utc_offsets(local - utc_offsets(local))
+
+
+def parse_window(text):
+    """
+    Parses a time window such as "90s", "30m", "6h", "3d" or "2w".
+
+    Returns
+    -------
+    seconds, label : float, str
+        The window length, and a description e.g. "6 hours".
+
+    Raises ValueError if text is not a positive number followed by a unit.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([smhdw])\s*', text.lower())
+    if match is None or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid time window {text!r}")
+    value, unit = match.groups()
+    return float(value) * WINDOW_UNITS[unit], f"{float(value):g} {WINDOW_NAMES[unit]}"
+
+
+def render_png(times, data, label, start_time, end_time):
+    """
+    Draws pressure against time on a log axis and returns the chart as PNG bytes.
+
+    Parameters
+    ----------
+    times, data : numpy arrays
+        Epoch seconds and pressures in mbar, already decimated for the chart width.
+
+    label : str
+        Legend text.
+
+    start_time, end_time : float
+        Epoch seconds of the x axis limits.
+    """
+    # matplotlib takes a few hundred ms to import, only pay for it on the first chart.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=FIGURE_SIZE, dpi=DPI)
+    FigureCanvasAgg(figure)
+    ax = figure.gca()
+
+    ax.plot(epoch2num(times), data, marker='o', label=label)
+    ax.xaxis_date()
+    ax.set_yscale('log')
+    ax.set_xlim(*epoch2num([start_time, end_time]))
+    ax.set_ylim(0.9*np.amin(data), 1.1*min(1e3, np.amax(data)))
+    ax.set_ylabel('Pressure (mbar)')
+    ax.legend(loc='upper right')
+    figure.autofmt_xdate()
+    figure.tight_layout(pad=3)
+
+    png = io.BytesIO()
+    figure.savefig(png, format='png')
+    return png.getvalue()
+
+
+class ChartCache:
+    """
+    PNG charts of a DataCollector, rendered in a worker pool and cached per reading.
+
+    A chart is keyed on (window, channel, time of the last sample). Requests for the
+    same chart within one sample interval share a single render, including requests
+    arriving while that render is still running. Charts of older readings are
+    dropped when a new reading arrives.
+
+    Parameters
+    ----------
+    collector : DataCollector
+        Source of the data.
+
+    executor : concurrent.futures.Executor
+        Pool the charts are rendered in, normally a ProcessPoolExecutor.
+    """
+
+    def __init__(self, collector, executor):
+        self.collector = collector
+        self.executor = executor
+        self.last_time = None
+        self.charts = {}  # (window, channel number) -> asyncio future of the PNG bytes.
+
+    async def chart(self, seconds, label, key=None):
+        """
+        Returns the PNG bytes of the last `seconds` of one channel (name or number,
+        default the first), or None if there is no data in that window.
+        Raises KeyError for an unknown channel.
+        """
+        channel = self.collector.channel(key)
+        snapshot = self.collector.snapshot
+        last_time = None if snapshot is None else snapshot[0]
+        if last_time != self.last_time:
+            self.last_time, self.charts = last_time, {}
+
+        cache_key = (seconds, channel.number)
+        future = self.charts.get(cache_key)
+        if future is None:
+            future = self.charts[cache_key] = asyncio.ensure_future(
+                self.render(seconds, f"{channel.name} Pressure Over Last {label}", channel.number,
+                            last_time or datetime.now().timestamp()))
+            future.add_done_callback(lambda done: self.discard_failed(cache_key, done))
+        return await asyncio.shield(future)
+
+    def discard_failed(self, cache_key, future):
+        # Don't keep failed renders, so the next request tries again.
+        if future.cancelled() or future.exception() is not None:
+            if self.charts.get(cache_key) is future:
+                del self.charts[cache_key]
+
+    async def render(self, seconds, label, channel, end_time):
+        with PLOT_RENDER.time():
+            return await self.render_chart(seconds, label, channel, end_time)
+
+    async def render_chart(self, seconds, label, channel, end_time):
+        start_time = end_time - seconds
+
+        # Query and decimate here, then only ship ~2 points per pixel to the worker.
+        data, times = self.collector.query(start_time, end_time, channel)
+        if not len(data):
+            return None
+        times, data = minmax_decimate(times, data, FIGURE_SIZE[0] * DPI, start_time, end_time)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, render_png, times, data, label, start_time, end_time)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Replay of logged readings through the live pipeline.
+
+A Replay turns the readings of the daily binary logs (or of pressure_data.txt) back
+into the records acquire() yields, for DataCollector(replay=...) to take in place
+of the PL1216. The pressures are mapped back to the ADC counts of each gauge and
+converted again reading by reading, so a replay goes through the same conversion,
+storage, buffers, rollups, alerts and reading callbacks (GUI, bot, API clients) as
+live readings. It runs at the recorded pace times `speed` (1, 100, ...), or as fast
+as possible with speed 0. Readings keep their recorded time stamps, shifted as a
+whole if start_at is given, so replaying the same logs always gives the same data.
+
+    python -m pressurebot replay OUTPUT_DIR [--speed 100] [--plot 1h] ...
+
+replays into OUTPUT_DIR and reports the sustained samples/s and the latency of each
+stage, and `python -m pressurebot run --replay LOG_DIR` runs the whole service,
+bot and GUI socket included, on replayed readings.
+"""
+
+import os
+import time
+import itertools
+import threading
+
+import numpy as np
+
+from pressurebot.acquisition import reading_dtype, CONVERSION
+from pressurebot.calibration import IN_RANGE
+from pressurebot.export import select_gauges
+from pressurebot import metrics
+
+# Stages reported by report(): label, histogram name.
+STAGES = [
+    ("conversion", 'pressurebot_conversion_seconds'),
+    ("disk write", 'pressurebot_disk_write_seconds'),
+    ("lock hold", 'pressurebot_lock_hold_seconds'),
+    ("callbacks", 'pressurebot_reading_callbacks_seconds'),
+    ("rollups", 'pressurebot_rollup_seconds'),
+    ("alerts", 'pressurebot_alert_check_seconds'),
+    ("whole reading", 'pressurebot_reading_processing_seconds'),
+    ("chart render", 'pressurebot_plot_render_seconds'),
+]
+
+
+def check_data_dir(folder, data_dir):
+    """
+    Raises ValueError if data_dir, where a replay is written, is the folder replayed.
+    """
+    if os.path.realpath(folder) == os.path.realpath(data_dir):
+        raise ValueError(f"Replay into a folder other than {folder}, it would append to its logs")
+
+
+class Replay:
+    """
+    Logged readings as a reading source of DataCollector.
+
+    Parameters
+    ----------
+    channels : list of pressurebot.channels.Channel
+        Gauge of each column of the chunks.
+
+    chunks : iterable of [times, pressures]
+        Epoch seconds and mbar (readings x channels), e.g. from export.select_gauges().
+
+    speed : float, optional
+        Times the recorded pace, 0 (the default) for as fast as possible.
+
+    start_at : float, optional
+        Epoch seconds to time stamp the first reading with, the recorded time by
+        default. The rest keep their recorded spacing.
+    """
+
+    def __init__(self, channels, chunks, speed=0, start_at=None):
+        self.channels = channels
+        self.speed = speed
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is None or not len(first[0]):
+            raise ValueError("No readings to replay")
+        self.chunks = itertools.chain([first], chunks)
+        self.first_time = float(first[0][0])
+        self.last_time = None  # Recorded time of the latest reading replayed.
+        self.shift = 0.0 if start_at is None else start_at - self.first_time
+        self.count = 0  # Readings replayed so far.
+
+        # Sample time of the log, for sizing the collector's buffers.
+        intervals = np.diff(first[0])
+        self.sample_time = float(np.median(intervals)) if len(intervals) else 5.0
+
+    def readings(self, stop_event):
+        """
+        Yields a reading_dtype record per logged reading until they run out or
+        stop_event is set. It is the same array every time, like acquire().
+        """
+        record = np.zeros((), dtype=reading_dtype(len(self.channels)))
+        record['n_samples'] = 1
+        pace = None  # (monotonic time, recorded time) of the first reading.
+
+        for times, pressures in self.chunks:
+            # Back to ADC counts for the whole chunk, to convert again one by one below.
+            # Gauges missing from a log file are NaN, and stay NaN.
+            counts = np.column_stack([channel.calibration.mbar_to_counts(pressures[:, column])
+                                      for column, channel in enumerate(self.channels)])
+            stamps = times + self.shift
+
+            for index in range(len(times)):
+                if self.speed:
+                    if pace is None:
+                        pace = (time.monotonic(), times[index])
+                    delay = pace[0] + (times[index] - pace[1]) / self.speed - time.monotonic()
+                    if delay > 0 and stop_event.wait(delay):
+                        return
+                if stop_event.is_set():
+                    return
+
+                record['deadline'] = record['start'] = record['end'] = stamps[index]
+                with CONVERSION.time():
+                    for column, channel in enumerate(self.channels):
+                        count = counts[index, column]
+                        if count != count:
+                            pressure, flag = np.nan, IN_RANGE
+                        else:
+                            pressure, flag = channel.calibration.counts_to_mbar(count)
+                        record['pressure'][column] = pressure
+                        record['flag'][column] = flag
+                self.count += 1
+                self.last_time = float(times[index])
+                yield record
+
+
+def render_charts(collector, seconds, stop_event):
+    """
+    Draws the chart of the last `seconds` of the first channel over and over, like
+    the GUI or a stream of /plot requests, until stop_event is set.
+    """
+    from pressurebot.decimate import minmax_decimate
+    from pressurebot.plotting import render_png, PLOT_RENDER, FIGURE_SIZE, DPI
+
+    while not stop_event.is_set():
+        snapshot = collector.snapshot
+        if snapshot is None:
+            stop_event.wait(0.01)
+            continue
+        with PLOT_RENDER.time():
+            end_time = snapshot[0]
+            data, times = collector.query(end_time - seconds, end_time)
+            if len(data):
+                times, data = minmax_decimate(times, data, FIGURE_SIZE[0] * DPI,
+                                              end_time - seconds, end_time)
+                render_png(times, data, "replay", end_time - seconds, end_time)
+
+
+def report(replay, elapsed):
+    """
+    Returns a text report of a replay that took elapsed seconds: the sustained rate,
+    and the median, 99th percentile and maximum time of each stage.
+    """
+    n_channels = len(replay.channels)
+    span = 0 if replay.last_time is None else replay.last_time - replay.first_time
+    lines = [f"Replayed {replay.count} readings of {n_channels} gauge{'s' * (n_channels > 1)} "
+             f"in {elapsed:.2f} s: {replay.count / elapsed:.0f} readings/s, "
+             f"{replay.count * n_channels / elapsed:.0f} samples/s, "
+             f"{span / elapsed:.0f}x the recorded pace"]
+    for label, name in STAGES:
+        histogram = metrics.find(name)
+        if histogram is None or not histogram.count:
+            continue
+        lines.append(f"  {label:<14} p50 {metrics.format_seconds(histogram.quantile(0.5)):>9}"
+                     f"  p99 {metrics.format_seconds(histogram.quantile(0.99)):>9}"
+                     f"  max {metrics.format_seconds(histogram.max):>9}  (n={histogram.count})")
+    return "\n".join(lines)
+
+
+def run(folder, data_dir, start=None, end=None, keys=None, speed=0, start_at=None, plot=None,
+        alerts=None):
+    """
+    Replays the logs in folder (the gauges keys between start and end) into a
+    DataCollector writing to data_dir, with a thread drawing charts of the last `plot`
+    seconds meanwhile if plot is given. Returns [the Replay, elapsed seconds], for
+    report().
+    """
+    from pressurebot.collector import DataCollector
+
+    check_data_dir(folder, data_dir)
+    chunks, channels = select_gauges(folder, start, end, keys)
+    os.makedirs(data_dir, exist_ok=True)
+    replay = Replay(channels, chunks, speed, start_at)
+    collector = DataCollector(threading.Event(), channels=replay.channels,
+                              sample_time=replay.sample_time, data_dir=data_dir,
+                              alerts=alerts, replay=replay)
+    metrics.reset()
+
+    threads = [threading.Thread(target=collector.start_collection, name="collection")]
+    stop = threading.Event()
+    if plot:
+        threads.append(threading.Thread(target=render_charts, args=[collector, plot, stop],
+                                        name="charts"))
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        # Join with a timeout, so Ctrl+C reaches the main thread and ends the replay early.
+        while threads[0].is_alive():
+            threads[0].join(0.5)
+    except KeyboardInterrupt:
+        collector.stop_collection()
+        threads[0].join()
+    elapsed = time.perf_counter() - start_time
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return [replay, elapsed]
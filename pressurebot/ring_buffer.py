@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Preallocated NumPy ring buffer for timestamped pressure readings.
+"""
+
+import threading
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of (epoch seconds, value) samples.
+
+    Samples are written once, at index count % capacity, so the buffer holds at most
+    two runs of samples in time order: from the oldest to the end of the backing
+    arrays, then from their start to the newest. get_range is a binary search of
+    each run's (sorted) times.
+
+    Writes and reads take the buffer's lock, and reads return copies: the next
+    append overwrites the oldest sample in place, so a view would change under a
+    reader in another thread (and lose its time order).
+
+    Parameters
+    ----------
+    capacity : int
+        Number of samples to keep.
+
+    dtype : numpy dtype, optional
+        Dtype of the value column. float64 by default.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = int(capacity)
+        self._times = np.zeros(self.capacity, dtype=np.float64)
+        self._values = np.zeros(self.capacity, dtype=dtype)
+        self._count = 0  # Total number of samples ever appended.
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, time_value, value):
+        """
+        Add one sample. Times must be appended in increasing order.
+        """
+        with self._lock:
+            index = self._count % self.capacity
+            self._times[index] = time_value
+            self._values[index] = value
+            self._count += 1
+
+    def extend(self, times, values):
+        """
+        Add many samples at once. Only the last `capacity` of them are kept.
+        """
+        times, values = np.asarray(times), np.asarray(values)
+        keep = min(len(times), self.capacity)
+        times, values = times[len(times) - keep:], values[len(values) - keep:]
+        with self._lock:
+            index = (self._count + np.arange(len(times))) % self.capacity
+            self._times[index] = times
+            self._values[index] = values
+            self._count += len(times)
+
+    def _runs(self):
+        """
+        Returns the [start, end] indices in the backing arrays of the runs of samples,
+        oldest first.
+        """
+        if self._count <= self.capacity:
+            return [[0, self._count]]
+        head = self._count % self.capacity  # Index of the oldest sample.
+        return [[head, self.capacity], [0, head]]
+
+    def _search(self, time_value, side):
+        """
+        Returns the position of time_value among the samples, oldest first, as
+        np.searchsorted.
+        """
+        position = 0
+        for start, end in self._runs():
+            found = int(np.searchsorted(self._times[start:end], time_value, side=side))
+            position += found
+            if found < end - start:
+                break
+        return position
+
+    def _take(self, first, last):
+        """
+        Returns copies of the times and values of the samples first to last (not
+        included), oldest first.
+        """
+        oldest = self._runs()[0][0]
+        start, stop = oldest + first, oldest + last
+        if stop <= self.capacity:
+            return self._times[start:stop].copy(), self._values[start:stop].copy()
+        index = np.arange(start, stop) % self.capacity
+        return self._times[index], self._values[index]
+
+    def window(self, n=None):
+        """
+        Returns copies of the times and values of the latest n samples (all by default).
+        """
+        with self._lock:
+            size = len(self)
+            return self._take(size - min(size, size if n is None else n), size)
+
+    def get_range(self, start_time, end_time=None):
+        """
+        Returns copies of the times and values with start_time <= time <= end_time.
+        """
+        with self._lock:
+            first = self._search(start_time, 'left')
+            last = len(self) if end_time is None else self._search(end_time, 'right')
+            return self._take(first, max(first, last))
+
+    def oldest_time(self):
+        """
+        Returns the time of the oldest sample, or None if the buffer is empty.
+        """
+        with self._lock:
+            return self._times[self._runs()[0][0]] if self._count else None
+
+    def latest(self):
+        """
+        Returns (time, value) of the newest sample, or None if the buffer is empty.
+        """
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return None
+            index = (count - 1) % self.capacity
+            return self._times[index], self._values[index]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampled (rollup) tiers of the pressure history.
+
+Each tier keeps one row of min/mean/max/count per fixed interval (e.g. per minute
+or per hour), in memory and appended to a binary file so it survives restarts.
+The row still being accumulated is saved too when the tier is closed, and taken up
+again on the next start, so a restart within a minute or hour loses none of it.
+"""
+
+import os
+import math
+
+import numpy as np
+
+from pressurebot.ring_buffer import RingBuffer
+
+ROLLUP_DTYPE = np.dtype([('time', '<f8'), ('min', '<f8'), ('mean', '<f8'),
+                         ('max', '<f8'), ('count', '<i8')])
+
+
+class RollupTier:
+    """
+    Min/mean/max/count of the samples in each `interval` seconds.
+
+    Parameters
+    ----------
+    interval : float
+        Length of one row in seconds, e.g. 60 or 3600.
+
+    capacity : int
+        Number of rows to keep in memory.
+
+    filename : str, optional
+        Binary file the finished rows are appended to (raw ROLLUP_DTYPE records).
+        The last `capacity` rows are loaded from it on start up. None to not persist.
+    """
+
+    def __init__(self, interval, capacity, filename=None):
+        self.interval = interval
+        self.filename = filename
+        self.rows = RingBuffer(capacity, dtype=ROLLUP_DTYPE)
+
+        # Row currently being accumulated: (start, min, sum, max, count).
+        # Replaced as a whole, so readers never see a half updated row.
+        self.current = None
+        # Time of the first sample added, or the start of the first row loaded.
+        self.first_time = None
+        # The last row of the file is (an earlier state of) current, to overwrite.
+        self.current_saved = False
+
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        """
+        Fill the in-memory rows from the tail of the tier file.
+        """
+        n_rows = os.path.getsize(self.filename) // ROLLUP_DTYPE.itemsize
+        # Drop a partly written row, left by a crash.
+        os.truncate(self.filename, n_rows * ROLLUP_DTYPE.itemsize)
+        first = max(n_rows - self.rows.capacity, 0)
+        rows = np.fromfile(self.filename, dtype=ROLLUP_DTYPE, count=n_rows - first,
+                           offset=first * ROLLUP_DTYPE.itemsize)
+        if not len(rows):
+            return
+        self.first_time = rows['time'][0]
+
+        # The last row may have been saved part way by close(). Carry on accumulating
+        # it, so samples of the same interval merge into it rather than a second row.
+        last = rows[-1]
+        self.current = (float(last['time']), float(last['min']),
+                        float(last['mean']) * int(last['count']), float(last['max']),
+                        int(last['count']))
+        self.current_saved = True
+        self.rows.extend(rows['time'][:-1], rows[:-1])
+
+    def add(self, time_value, value):
+        """
+        Add one sample. Closes (and saves) the current row when the sample starts a new one.
+        """
+        start = math.floor(time_value / self.interval) * self.interval
+        current = self.current
+        if self.first_time is None:
+            self.first_time = time_value
+
+        if current is not None and current[0] == start:
+            self.current = (start, min(current[1], value), current[2] + value,
+                            max(current[3], value), current[4] + 1)
+            return
+
+        if current is not None:
+            self.close_row(current)
+        self.current = (start, value, value, value, 1)
+
+    def close_row(self, current):
+        start, low, total, high, count = current
+        row = np.array([(start, low, total / count, high, count)], dtype=ROLLUP_DTYPE)
+        self.rows.append(start, row[0])
+        self.save_row(row)
+        self.current_saved = False
+
+    def save_row(self, row):
+        """
+        Appends a row to the tier file, or overwrites the last one if that is an
+        earlier state of the same row.
+        """
+        if self.filename is None:
+            return
+        with open(self.filename, 'r+b' if self.current_saved else 'ab') as file:
+            if self.current_saved:
+                file.seek(-ROLLUP_DTYPE.itemsize, os.SEEK_END)
+            file.write(row.tobytes())
+
+    def close(self):
+        """
+        Saves the row still being accumulated, to be taken up again by the next load.
+        """
+        current = self.current
+        if current is None:
+            return
+        start, low, total, high, count = current
+        self.save_row(np.array([(start, low, total / count, high, count)], dtype=ROLLUP_DTYPE))
+        self.current_saved = True
+
+    def get_range(self, start_time, end_time=None):
+        """
+        Returns the rows starting between start_time and end_time, including the
+        row still being accumulated.
+        """
+        times, rows = self.rows.get_range(start_time - self.interval, end_time)
+        current = self.current
+        if current is not None and (end_time is None or current[0] <= end_time):
+            start, low, total, high, count = current
+            row = np.array([(start, low, total / count, high, count)], dtype=ROLLUP_DTYPE)
+            rows = np.concatenate([rows, row])
+        return rows[rows['time'] + self.interval > start_time]
+
+    def oldest(self):
+        """
+        Returns the time of the oldest sample in the rows, or None if there are none.
+        That is the start of the oldest row once the first rows have been dropped (or
+        for rows loaded from the tier file), as rows are floored to the interval.
+        """
+        oldest = self.rows.oldest_time()
+        if oldest is None:
+            oldest = None if self.current is None else self.current[0]
+        if oldest is None or self.first_time is None:
+            return oldest
+        return max(oldest, self.first_time)
+
+
+def envelope(rows, interval):
+    """
+    Interleaves the min and max of each row, giving a line which draws the envelope
+    of the original samples. Returns [data, times].
+    """
+    data = np.empty(2 * len(rows))
+    times = np.empty(2 * len(rows))
+    data[0::2] = rows['min']
+    data[1::2] = rows['max']
+    times[0::2] = rows['time']
+    times[1::2] = rows['time'] + interval / 2
+    return [data, times]
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Drift free sampling schedule on the monotonic clock.
+
+Readings are due on a fixed grid of deadlines, start + k * period, on
+time.monotonic(), so the time a reading takes is never added to the period and the
+cadence does not drift. Deadlines that pass while a reading is still being made are
+either skipped (the next reading is on the grid again) or caught up (the missed
+readings are made at once, one after the other).
+
+Times are turned into epoch seconds through an anchor, the epoch time of the
+monotonic clock's zero. It is measured again every REANCHOR_INTERVAL seconds, and
+slewed towards the new value by at most MAX_SLEW seconds per second, so the epoch
+times of readings follow the system clock (and daily logs roll over at midnight)
+while never running backwards: an NTP step back of one second is taken up
+over 100 s of readings. Only a system clock more than MAX_STEP ahead, e.g. after
+the machine was suspended, which stops the monotonic clock, is caught up at once.
+"""
+
+import math
+import time
+
+SKIP = 'skip'
+CATCHUP = 'catchup'
+
+# Seconds between measurements of the anchor.
+REANCHOR_INTERVAL = 60
+# Fastest correction of the anchor, in seconds per second (so readings are stamped
+# about 1% closer together or further apart while it is corrected).
+MAX_SLEW = 0.01
+# Seconds the system clock can be ahead of the anchor before it is stepped to it.
+MAX_STEP = 1.0
+
+
+def epoch_anchor():
+    """
+    Returns time.time() - time.monotonic(), from the closest of a few tries.
+    """
+    best = None
+    for _ in range(5):
+        before = time.monotonic()
+        epoch = time.time()
+        after = time.monotonic()
+        if best is None or after - before < best[0]:
+            best = (after - before, epoch - (before + after) / 2)
+    return best[1]
+
+
+class Scheduler:
+    """
+    Fixed rate schedule of readings.
+
+    Parameters
+    ----------
+    period : float
+        Seconds between readings.
+
+    missed : str, optional
+        What to do with deadlines that passed during a reading: SKIP them and wait for
+        the next one on the grid (the default), or CATCHUP by making the missed
+        readings straight away.
+
+    align : bool, optional
+        Put the deadlines on whole multiples of the period in epoch time, e.g.
+        :00, :05, :10 ... for 5 s, rather than one period after the start.
+    """
+
+    def __init__(self, period, missed=SKIP, align=True):
+        if missed not in (SKIP, CATCHUP):
+            raise ValueError(f"missed must be {SKIP!r} or {CATCHUP!r}, not {missed!r}")
+        self.period = period
+        self.missed = missed
+
+        # The anchor is slew_anchor at slew_start, changing by slew_rate per second
+        # until slew_end, see anchor().
+        now = time.monotonic()
+        self.slew_start = self.slew_end = now
+        self.slew_anchor = epoch_anchor()
+        self.slew_rate = 0.0
+        self.next_anchor = now + REANCHOR_INTERVAL
+
+        first = now + period
+        if align:
+            first = math.ceil((first + self.slew_anchor) / period) * period - self.slew_anchor
+        self.start = first
+        self.index = 0  # Of the next deadline.
+        self.skipped = 0  # Deadlines skipped just before the latest one.
+
+    def deadline(self):
+        """
+        Returns the monotonic time the next reading is due.
+        """
+        return self.start + self.index * self.period
+
+    def anchor(self, monotonic_time):
+        """
+        Returns the epoch time of the monotonic clock's zero, as of monotonic_time.
+        """
+        elapsed = min(max(monotonic_time - self.slew_start, 0), self.slew_end - self.slew_start)
+        return self.slew_anchor + self.slew_rate * elapsed
+
+    def reanchor(self, monotonic_time):
+        """
+        Measures the anchor again, and slews towards it from monotonic_time on.
+        """
+        anchor = self.anchor(monotonic_time)
+        error = epoch_anchor() - anchor
+        if error > MAX_STEP:
+            anchor, error = anchor + error, 0.0
+        self.slew_start = monotonic_time
+        self.slew_end = monotonic_time + abs(error) / MAX_SLEW
+        self.slew_anchor = anchor
+        self.slew_rate = math.copysign(MAX_SLEW, error)
+
+    def to_epoch(self, monotonic_time):
+        """
+        Returns the epoch seconds of a time.monotonic() value.
+        """
+        return self.anchor(monotonic_time) + monotonic_time
+
+    def now(self):
+        """
+        Returns the current epoch time, on the schedule's clock.
+        """
+        return self.to_epoch(time.monotonic())
+
+    def wait(self, stop_event):
+        """
+        Waits until the next deadline. Returns its monotonic time, or None if
+        stop_event was set first.
+        """
+        deadline = self.deadline()
+        now = time.monotonic()
+        if now >= self.next_anchor:
+            # From the next reading on.
+            self.reanchor(max(now, deadline))
+            self.next_anchor = now + REANCHOR_INTERVAL
+
+        timeout = deadline - now
+        if timeout > 0 and stop_event.wait(timeout):
+            return None
+        if stop_event.is_set():
+            return None
+
+        self.index += 1
+
+        # Deadlines that have already passed as well.
+        behind = math.floor((time.monotonic() - deadline) / self.period)
+        self.skipped = behind if behind > 0 and self.missed == SKIP else 0
+        self.index += self.skipped
+        return deadline
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated PicoLog 1216, for running and benchmarking without the hardware.
+
+SimulatedPL1216 has the same pl1000* functions, arguments and status codes as
+picosdk.pl1000.pl1000, so it can be passed to StreamingReader (or DataCollector,
+or `python -m pressurebot run --simulate`) in place of the driver. In BM_STREAM
+mode it "captures" scans at the rate set by pl1000SetInterval from the moment
+pl1000Run is called, and pl1000GetValues returns those captured since the last
+call, after a USB transfer delay, as 12 bit ADC counts with Gaussian noise.
+"""
+
+import ctypes
+import math
+import time
+
+import numpy as np
+
+from pressurebot.calibration import MAX_ADC, INPUT_RANGE
+
+PICO_OK = 0
+PICO_NOT_FOUND = 3
+PICO_INVALID_HANDLE = 12
+PICO_INVALID_PARAMETER = 13
+PICO_INVALID_CHANNEL = 20
+PICO_NOT_RUNNING = 44
+
+# Fastest total sampling rate of the PL1216, across all channels.
+MAX_SAMPLE_RATE = 100000
+
+
+def default_signal(channel):
+    """
+    Returns the PL1216 voltage of channel against time: a slow wander around a level
+    that depends on the channel, so each simulated gauge reads differently.
+    """
+    level = 0.8 + 0.05 * (channel % 8)
+    phase = channel
+
+    def signal(times):
+        return level + 0.05 * np.sin(2 * np.pi * times / 600 + phase)
+
+    return signal
+
+
+def _obj(argument):
+    # ctypes.byref(x) -> x. Arrays are passed without byref.
+    return getattr(argument, '_obj', argument)
+
+
+class SimulatedPL1216:
+    """
+    Stand in for picosdk.pl1000.pl1000 with one PL1216 attached.
+
+    Parameters
+    ----------
+    signals : dict, optional
+        Channel number -> function of epoch seconds (numpy array) returning the
+        input voltage. Channels not given use default_signal.
+
+    noise : float, optional
+        Standard deviation of the ADC noise, in counts.
+
+    latency : float, optional
+        Seconds each pl1000GetValues call takes, like a USB round trip.
+
+    bandwidth : float, optional
+        Transfer rate of pl1000GetValues in bytes per second, on top of latency.
+
+    seed : int, optional
+        Seed of the noise, for reproducible runs.
+    """
+
+    PL1000_BLOCK_METHOD = {"BM_SINGLE": 0, "BM_WINDOW": 1, "BM_STREAM": 2}
+
+    def __init__(self, signals=None, noise=2.0, latency=0.001, bandwidth=1e6, seed=0):
+        self.signals = dict(signals or {})
+        self.noise = noise
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.rng = np.random.default_rng(seed)
+        self.open = False
+        self.channels = [1]
+        self.interval = 1e-3  # Seconds between scans.
+        self.buffer_size = 0  # Scans kept by the driver between reads.
+        self.running = False
+        self.next_scan = None  # Epoch time of the next scan not yet returned.
+
+    def signal(self, channel):
+        if channel not in self.signals:
+            self.signals[channel] = default_signal(channel)
+        return self.signals[channel]
+
+    def pl1000OpenUnit(self, handle):
+        if self.open:
+            return PICO_NOT_FOUND  # Only one unit attached, and it is in use.
+        self.open = True
+        _obj(handle).value = 1
+        return PICO_OK
+
+    def pl1000SetInterval(self, handle, us_for_block, ideal_no_of_samples, channels, no_of_channels):
+        if not self.open:
+            return PICO_INVALID_HANDLE
+        channels = _obj(channels)
+        if isinstance(channels, ctypes.c_int16):
+            channels = [channels.value]
+        else:
+            channels = list(channels[:no_of_channels])
+        if not channels or any(not 1 <= channel <= 16 for channel in channels):
+            return PICO_INVALID_CHANNEL
+        if ideal_no_of_samples < 1:
+            return PICO_INVALID_PARAMETER
+
+        # Like the driver, lengthen the block if it asks for more than the maximum
+        # sampling rate, and write the block time used back.
+        block = _obj(us_for_block)
+        min_us = math.ceil(ideal_no_of_samples * len(channels) * 1e6 / MAX_SAMPLE_RATE)
+        block.value = max(block.value, min_us)
+
+        self.channels = channels
+        self.interval = block.value * 1e-6 / ideal_no_of_samples
+        return PICO_OK
+
+    def pl1000Run(self, handle, no_of_values, method):
+        if not self.open:
+            return PICO_INVALID_HANDLE
+        if method != self.PL1000_BLOCK_METHOD["BM_STREAM"]:
+            return PICO_INVALID_PARAMETER  # Only streaming is simulated.
+        self.buffer_size = no_of_values
+        self.running = True
+        self.next_scan = time.time()
+        return PICO_OK
+
+    def pl1000GetValues(self, handle, values, no_of_values, overflow, trigger_index):
+        if not self.open:
+            return PICO_INVALID_HANDLE
+        if not self.running:
+            return PICO_NOT_RUNNING
+
+        now = time.time()
+        n_ready = int((now - self.next_scan) / self.interval)
+        # The driver keeps only the last buffer_size scans, older ones are lost.
+        lost = max(n_ready - self.buffer_size, 0)
+        n = min(n_ready - lost, _obj(no_of_values).value)
+        scan_times = self.next_scan + (lost + np.arange(n)) * self.interval
+        self.next_scan += (lost + n) * self.interval
+
+        n_channels = len(self.channels)
+        volts = np.empty((n, n_channels))
+        for column, channel in enumerate(self.channels):
+            volts[:, column] = self.signal(channel)(scan_times)
+        counts = volts * (MAX_ADC / INPUT_RANGE) + self.rng.normal(0, self.noise, volts.shape)
+        counts = np.clip(np.rint(counts), 0, MAX_ADC).astype(np.uint16)
+
+        # Bit per channel whose input went beyond the input range.
+        over = (volts > INPUT_RANGE).any(axis=0)
+        _obj(overflow).value = sum(1 << column for column in range(n_channels) if over[column])
+
+        time.sleep(self.latency + counts.nbytes / self.bandwidth)
+        ctypes.memmove(_obj(values), counts.ctypes.data, counts.nbytes)
+        _obj(no_of_values).value = n
+        return PICO_OK
+
+    def pl1000Stop(self, handle):
+        if not self.open:
+            return PICO_INVALID_HANDLE
+        self.running = False
+        return PICO_OK
+
+    def pl1000CloseUnit(self, handle):
+        if not self.open:
+            return PICO_INVALID_HANDLE
+        self.open = False
+        self.running = False
+        return PICO_OK
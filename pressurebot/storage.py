@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Binary, buffered and daily rotated on-disk log of pressure readings.
+
+Each day is written to its own file, e.g. pressure_2024-02-26.bin, holding a 64 byte
+header (magic, number of channels, PL1216 channel numbers) followed by fixed width
+little endian records of
+
+    time (float64 epoch seconds), pressure (float64 mbar) per channel
+
+so a whole file can be opened with np.memmap (see read_log) without any parsing.
+Logs of the first layout (PBLOG1, a 16 byte header with only the number of
+channels), written when only the channel 16 gauge was logged, are read as channel
+16, and rewritten in the current layout when the day's log is opened to append.
+"""
+
+import os
+import glob
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from pressurebot import metrics
+
+LOG_MAGIC = b'PBLOG2'
+HEADER_SIZE = 64
+OLD_LOG_MAGIC = b'PBLOG1'
+OLD_HEADER_SIZE = 16
+OLD_LOG_CHANNELS = [16]
+
+FSYNC = metrics.histogram('pressurebot_fsync_seconds', 'Time to fsync the binary log')
+
+
+def record_dtype(n_channels=1):
+    """
+    Returns the numpy dtype of one log record.
+    """
+    return np.dtype([('time', '<f8'), ('pressure', '<f8', (n_channels,))])
+
+
+def make_header(channels):
+    """
+    Returns the file header for a list of PL1216 channel numbers.
+    """
+    numbers = np.array([len(channels)] + list(channels), dtype='<u2')
+    return (LOG_MAGIC + numbers.tobytes()).ljust(HEADER_SIZE, b'\0')
+
+
+def read_layout(filename):
+    """
+    Returns [PL1216 channel numbers, header size] of a log file of either layout.
+    Raises ValueError if it is not a log file, or an old layout log of several
+    channels, whose numbers it doesn't say.
+    """
+    with open(filename, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+    if len(header) == HEADER_SIZE and header.startswith(LOG_MAGIC):
+        numbers = np.frombuffer(header, dtype='<u2', offset=len(LOG_MAGIC))
+        return [[int(number) for number in numbers[1:numbers[0] + 1]], HEADER_SIZE]
+    if len(header) >= OLD_HEADER_SIZE and header.startswith(OLD_LOG_MAGIC):
+        n_channels = int(np.frombuffer(header, dtype='<u2', count=1, offset=len(OLD_LOG_MAGIC))[0])
+        if n_channels != len(OLD_LOG_CHANNELS):
+            raise ValueError(f"{filename} is an old log of {n_channels} channels, "
+                             f"without their channel numbers")
+        return [list(OLD_LOG_CHANNELS), OLD_HEADER_SIZE]
+    raise ValueError(f"{filename} is not a pressure log file")
+
+
+def read_header(filename):
+    """
+    Returns the list of PL1216 channel numbers stored in a log file, in column order.
+    """
+    return read_layout(filename)[0]
+
+
+def read_log(filename):
+    """
+    Memory maps a log file. Returns a read only record array with 'time' and
+    'pressure' fields. A partly written last record is ignored.
+    """
+    channels, header_size = read_layout(filename)
+    dtype = record_dtype(len(channels))
+    n_records = (os.path.getsize(filename) - header_size) // dtype.itemsize
+    if n_records <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=header_size, shape=(n_records,))
+
+
+def upgrade_log(filename):
+    """
+    Rewrites an old layout (PBLOG1) log file in the current layout.
+    """
+    records = np.array(read_log(filename))
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(make_header(read_header(filename)))
+        records.tofile(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
+
+
+def log_files(folder='.', prefix='pressure'):
+    """
+    Returns the log files in folder, oldest first.
+    """
+    return sorted(glob.glob(os.path.join(folder, f'{prefix}_????-??-??.bin')))
+
+
+def format_time(offset=0, timestamp=None):
+    """
+    Returns current time in Year-M-D H:M:S format. Offset in seconds. Default of 0.
+    If timestamp (epoch seconds) is given, it is formatted instead of the current time.
+    """
+    t = datetime.now() if timestamp is None else datetime.fromtimestamp(timestamp)
+    t = t - timedelta(seconds=offset)
+    if t.microsecond % 1000 >= 500:  # check if there will be rounding up
+        t = t + timedelta(milliseconds=1)  # manually round up
+    return t.strftime('%Y:%m:%d %H:%M:%S%f')[:-6]
+
+
+def format_line(pressure, time_value):
+    """
+    Returns one line of the text log (pressure_data.txt) format.
+    """
+    time_string = datetime.fromtimestamp(time_value).strftime('%Y:%m:%d %H:%M:%S')
+    return "{:.2e} {}\n".format(min(pressure, 1000), time_string)
+
+
+def export_text(filenames, text_filename, channel=None):
+    """
+    Writes the readings of one channel (PL1216 channel number, the first column by
+    default) of binary log files to the text log format.
+    """
+    with open(text_filename, 'a') as file:
+        for filename in filenames:
+            channels = read_header(filename)
+            if channel is not None and channel not in channels:
+                continue
+            column = 0 if channel is None else channels.index(channel)
+            records = read_log(filename)
+            file.writelines(format_line(pressure, time_value) for time_value, pressure
+                            in zip(records['time'], records['pressure'][:, column]))
+
+
+class BinaryLog:
+    """
+    Appends readings to daily binary log files.
+
+    The current file is kept open. Records go through the normal buffered file
+    object, which is flushed to the OS every flush_interval seconds and forced to
+    disk with os.fsync every fsync_interval seconds.
+
+    Parameters
+    ----------
+    folder : str, optional
+        Folder of the log files.
+
+    prefix : str, optional
+        Start of the log file names.
+
+    channels : list of int, optional
+        PL1216 channel numbers, one pressure column each. [16] by default.
+
+    flush_interval : float, optional
+        Seconds between flushes of the write buffer.
+
+    fsync_interval : float, optional
+        Seconds between fsync calls.
+
+    text_filename : str, optional
+        If given, readings are also appended to this file in the old text format.
+    """
+
+    def __init__(self, folder='.', prefix='pressure', channels=(16,), flush_interval=10,
+                 fsync_interval=60, text_filename=None):
+        self.folder = folder
+        self.prefix = prefix
+        self.channels = list(channels)
+        self.dtype = record_dtype(len(self.channels))
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.text_filename = text_filename
+
+        self.file = None
+        self.text_file = None
+        self.filename = None
+        self.rotate_at = 0
+        self.last_flush = 0
+        self.last_fsync = 0
+
+    def open(self, time_value):
+        """
+        Opens the log file of the day time_value falls in.
+        """
+        self.close()
+
+        day = datetime.fromtimestamp(time_value).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.rotate_at = (day + timedelta(days=1)).timestamp()
+        self.filename = os.path.join(self.folder, f'{self.prefix}_{day:%Y-%m-%d}.bin')
+
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as file:
+                if file.read(len(OLD_LOG_MAGIC)) == OLD_LOG_MAGIC:
+                    upgrade_log(self.filename)
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) >= HEADER_SIZE:
+            if read_header(self.filename) != self.channels:
+                raise ValueError(f"{self.filename} was written with different channels")
+            # Drop a partly written record, left by a crash.
+            size = os.path.getsize(self.filename)
+            os.truncate(self.filename, size - (size - HEADER_SIZE) % self.dtype.itemsize)
+            self.file = open(self.filename, 'ab')
+        else:
+            self.file = open(self.filename, 'wb')
+            self.file.write(make_header(self.channels))
+
+        if self.text_filename is not None:
+            self.text_file = open(self.text_filename, 'a')
+
+    def write(self, time_value, pressure):
+        """
+        Adds one record. pressure is a float, or a sequence with one value per channel.
+        The text log only gets the first channel.
+        """
+        if self.file is None or time_value >= self.rotate_at:
+            self.open(time_value)
+
+        record = np.zeros(1, dtype=self.dtype)
+        record['time'] = time_value
+        record['pressure'] = pressure
+        self.file.write(record.tobytes())
+
+        if self.text_file is not None:
+            self.text_file.write(format_line(float(record['pressure'][0, 0]), time_value))
+
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.flush(fsync=now - self.last_fsync >= self.fsync_interval)
+
+    def flush(self, fsync=False):
+        if self.file is None:
+            return
+
+        now = time.monotonic()
+        self.file.flush()
+        if self.text_file is not None:
+            self.text_file.flush()
+        self.last_flush = now
+
+        if fsync:
+            with FSYNC.time():
+                os.fsync(self.file.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        if self.file is None:
+            return
+
+        self.flush(fsync=True)
+        self.file.close()
+        self.file = None
+        if self.text_file is not None:
+            self.text_file.close()
+            self.text_file = None
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio Telegram bot front end.
+
+All chats are served from one event loop, without a thread per request. Replies are
+built from DataCollector.snapshot, which the collection thread replaces as a whole
+after every reading, so the bot never takes the collector lock. Each reply text is
+rendered once per reading and then reused for every chat that asks for it.
+"""
+
+import os
+import json
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from telebot import util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import ReplyParameters
+
+from pressurebot.calibration import IN_RANGE, UNDER_RANGE, OVER_RANGE
+from pressurebot.plotting import ChartCache, parse_window
+from pressurebot import metrics
+
+# Worker processes rendering /plot charts, so rendering never holds up the GIL for
+# the collection thread or the other replies.
+RENDER_WORKERS = 2
+
+
+def describe(value, flag=IN_RANGE):
+    """
+    Returns e.g. "1.23e-07 mbar". Readings clipped to the gauge range get a < or >.
+    """
+    if value is None:
+        return "No Data"
+    prefix = {IN_RANGE: "", UNDER_RANGE: "< ", OVER_RANGE: "> "}[flag]
+    return f"{prefix}{value:.2e} mbar"
+
+
+def format_pressure_reply(channels, values, flags):
+    """
+    Returns the /pressure reply for the given channels and their latest values and flags.
+    """
+    if all(value is None for value in values):
+        return "No Data Collected Yet"
+    if len(channels) == 1:
+        return f"Pressure: {describe(values[0], flags[0])}"
+    return "\n".join(f"{channel.name}: {describe(value, flag)}"
+                     for channel, value, flag in zip(channels, values, flags))
+
+
+class ReplyCache:
+    """
+    Pressure replies, rendered at most once per reading of the collector.
+    """
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.snapshot = None
+        self.replies = {}
+
+    def pressure(self, key=None):
+        """
+        Returns the /pressure reply for one channel (name or number), or all channels.
+        Raises KeyError for an unknown channel.
+        """
+        snapshot = self.collector.snapshot
+        if snapshot is not self.snapshot:
+            self.snapshot, self.replies = snapshot, {}
+
+        reply = self.replies.get(key)
+        if reply is None:
+            channels = self.collector.channels
+            values = [None] * len(channels) if snapshot is None else snapshot[1]
+            flags = [IN_RANGE] * len(channels) if snapshot is None else snapshot[2]
+
+            if key is not None:
+                index = channels.index(self.collector.channel(key))
+                channels, values, flags = [channels[index]], [values[index]], [flags[index]]
+
+            reply = self.replies[key] = format_pressure_reply(channels, values, flags)
+        return reply
+
+
+class Subscribers:
+    """
+    Set of chat ids that receive pushed messages, saved to a JSON file in data_dir
+    (not saved if filename is None).
+    """
+
+    def __init__(self, filename='subscribers.json', data_dir='.'):
+        self.filename = None if filename is None else os.path.join(data_dir, filename)
+        self.chat_ids = set()
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as file:
+                self.chat_ids = set(json.load(file))
+
+    def __iter__(self):
+        return iter(sorted(self.chat_ids))
+
+    def __len__(self):
+        return len(self.chat_ids)
+
+    def add(self, chat_id):
+        self.chat_ids.add(chat_id)
+        self.save()
+
+    def discard(self, chat_id):
+        self.chat_ids.discard(chat_id)
+        self.save()
+
+    def save(self):
+        if self.filename is not None:
+            with open(self.filename, 'w') as file:
+                json.dump(sorted(self.chat_ids), file)
+
+
+class PressureBot:
+    """
+    Telegram bot answering from a DataCollector.
+
+    Commands:
+        /pressure [channel]  latest pressure of all gauges, or of one
+        /plot [window] [channel]  chart of e.g. the last 6h or 3d (default 1h)
+        /alerts              alerts currently raised
+        /stats               timings and counters of the daemon, see pressurebot.metrics
+        /subscribe           receive alert messages in this chat (e.g. groups)
+        /unsubscribe         stop receiving them
+        /end                 stop collection and the bot
+
+    Parameters
+    ----------
+    collector : DataCollector
+        Source of the readings.
+
+    token : str
+        Telegram bot token.
+
+    subscribers_file : str, optional
+        JSON file of the subscribed chat ids, in the collector's data folder. None to
+        not save them.
+    """
+
+    def __init__(self, collector, token, subscribers_file='subscribers.json'):
+        self.collector = collector
+        self.bot = AsyncTeleBot(token)
+        self.replies = ReplyCache(collector)
+        self.executor = None
+        self.charts = None
+        self.subscribers = Subscribers(subscribers_file, collector.data_dir)
+        self.loop = None
+        self.stopped = None
+        self.pushes = set()  # Broadcasts of alerts still being sent.
+
+        self.handle(['pressure', 'p', 'P', 'Pressure'], self.pressure_response)
+        self.handle(['plot'], self.plot_response)
+        self.handle(['alerts'], self.alerts_response)
+        self.handle(['stats'], self.stats_response)
+        self.handle(['subscribe'], self.subscribe)
+        self.handle(['unsubscribe'], self.unsubscribe)
+        self.handle(['end'], self.end)
+
+    def handle(self, commands, handler):
+        """
+        Registers handler for commands, timing each call, reply included.
+        """
+        latency = metrics.histogram('pressurebot_bot_handler_seconds',
+                                    'Time to handle a bot command, reply included',
+                                    labels={'command': commands[0]})
+
+        async def timed(message):
+            with latency.time():
+                await handler(message)
+
+        self.bot.message_handler(commands=commands)(timed)
+
+    async def pressure_response(self, message):
+        # "/pressure" replies with every channel, "/pressure chamber" or "/p 16" with one.
+        key = util.extract_arguments(message.text) or None
+        try:
+            response = self.replies.pressure(key)
+        except KeyError:
+            response = f"Unknown channel {key}. Channels: " + ", ".join(
+                channel.name for channel in self.collector.channels)
+        await self.bot.reply_to(message, response)
+
+    async def plot_response(self, message):
+        # "/plot", "/plot 6h", "/plot 3d roughing".
+        args = util.extract_arguments(message.text).split()
+        try:
+            seconds, label = parse_window(args[0] if args else "1h")
+            png = await self.charts.chart(seconds, label, args[1] if len(args) > 1 else None)
+        except ValueError:
+            await self.bot.reply_to(message, "Usage: /plot [window] [channel], e.g. /plot 6h or /plot 3d")
+            return
+        except KeyError:
+            await self.bot.reply_to(message, f"Unknown channel {args[1]}. Channels: " + ", ".join(
+                channel.name for channel in self.collector.channels))
+            return
+
+        if png is None:
+            await self.bot.reply_to(message, "No Data Collected Yet")
+        else:
+            await self.bot.send_photo(message.chat.id, ('pressure.png', png),
+                                      reply_parameters=ReplyParameters(message.message_id))
+
+    async def alerts_response(self, message):
+        alerts = self.collector.alerts
+        if not len(alerts):
+            response = "No alert rules set up (see alerts.json)"
+        elif not alerts.active():
+            response = f"No alerts. {len(alerts)} rules checked."
+        else:
+            response = "\n".join(f"ALERT: {rule.describe()} ({rule.state()})" for rule in alerts.active())
+        await self.bot.reply_to(message, response)
+
+    async def stats_response(self, message):
+        await self.bot.reply_to(message, metrics.summary())
+
+    async def subscribe(self, message):
+        self.subscribers.add(message.chat.id)
+        await self.bot.reply_to(message, "Subscribed to pressure messages")
+
+    async def unsubscribe(self, message):
+        self.subscribers.discard(message.chat.id)
+        await self.bot.reply_to(message, "Unsubscribed from pressure messages")
+
+    async def end(self, message):
+        self.collector.stop_collection()
+
+    async def broadcast(self, text):
+        """
+        Sends text to every subscribed chat, concurrently.
+        """
+        chat_ids = list(self.subscribers)
+        results = await asyncio.gather(
+            *(self.bot.send_message(chat_id, text) for chat_id in chat_ids),
+            return_exceptions=True)
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                print(f"Could not message chat {chat_id}: {result}")
+
+    def push(self, text):
+        """
+        Broadcasts text to the subscribers. Safe to call from any thread, returns at once.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.start_push, text)
+
+    def start_push(self, text):
+        task = asyncio.ensure_future(self.broadcast(text))
+        self.pushes.add(task)
+        task.add_done_callback(self.pushes.discard)
+
+    def stop(self):
+        """
+        Stops run(). Safe to call from any thread.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def run(self):
+        """
+        Polls Telegram until stop() is called (DataCollector.stop_collection calls it).
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.collector.add_stop_callback(self.stop)
+        self.collector.add_alert_callback(self.push)
+        if self.collector.stop_event.is_set():
+            self.stopped.set()
+
+        # Spawn rather than fork, the daemon has threads running.
+        self.executor = ProcessPoolExecutor(RENDER_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        self.charts = ChartCache(self.collector, self.executor)
+
+        polling = asyncio.create_task(self.bot.polling(skip_pending=True, timeout=5))
+        try:
+            await self.stopped.wait()
+        finally:
+            self.collector.remove_alert_callback(self.push)
+            polling.cancel()
+            # Let alerts raised before stopping still go out.
+            await asyncio.gather(polling, *self.pushes, return_exceptions=True)
+            await self.bot.close_session()
+            self.executor.shutdown(cancel_futures=True)
+            self.collector.remove_stop_callback(self.stop)
+            print("Stopped polling")
+
+
+def run_bot(collector, token, subscribers_file='subscribers.json'):
+    """
+    Runs a PressureBot in a new event loop, until the collector is stopped.
+    """
+    asyncio.run(PressureBot(collector, token, subscribers_file).run())